@@ -119,7 +119,7 @@ async def main():  # pylint: disable=too-many-statements
         print(error)
         return
     dis_users = await dis_obj.read_and_clear_users()
-    print("Data in '.disable_users.json' file Test:", dis_users)
+    print("Data in '.disable_users.journal' file Test:", dis_users)
     await enable_selected_users(panel_data, dis_users)
     try:
         print("Get All Users Test: ", await all_user(panel_data))
@@ -0,0 +1,179 @@
+"""
+Replay logs captured with 'v2iplimit.py --capture DIRECTORY'
+through the parser and the check of the main program (check_users_usage()
+and the enforcement through the panel outbox) without touching the panel,
+the nodes or Telegram: the panel is stubbed out and confirms every write.
+It prints the parser speed and the users that would be disabled.
+(it needs a config.json file like the main program)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from utils import check_usage, enforcement, handel_dis_users, outbox
+from utils.check_usage import ACTIVE_USERS, check_users_usage
+from utils.log_capture import replay_capture
+from utils.parse_logs import parse_logs
+from utils.policy_store import POLICY_STORE
+from utils.read_config import read_config
+from utils.types import PanelType
+
+parser = argparse.ArgumentParser(description="Replay captured logs")
+parser.add_argument("path", help="A capture directory or a single segment file")
+parser.add_argument(
+    "--speed",
+    type=float,
+    default=None,
+    help="1 replays at the original speed, 2 twice as fast (default: as fast as possible)",
+)
+parser.add_argument(
+    "--interval",
+    type=float,
+    default=None,
+    help="Seconds of captured logs per check (default: 'CHECK_INTERVAL' of the config)",
+)
+parser.add_argument(
+    "--output", help="Write the detection results as JSON (to compare parser versions)"
+)
+args = parser.parse_args()
+
+REPLAY_PANEL = PanelType("replay", "replay", "replay")
+
+
+def stub_panel(stack: ExitStack, directory: str, messages: list[str]) -> list:
+    """
+    Stub out the panel and Telegram for the check of the main program.
+    Every panel write is confirmed, the journals are written to 'directory'
+    (never to the files of the main program) and the admin messages are kept.
+
+    Args:
+        stack (ExitStack): Undoes the stubs when it is closed.
+        directory (str): The directory of the journals.
+        messages (list[str]): The messages that would be sent to the admins.
+
+    Returns:
+        list: The enforcement tasks started by the checks.
+    """
+
+    async def keep_message(message) -> None:
+        messages.append(str(message))
+
+    tasks = []
+
+    def start(*start_args, **start_kwargs):
+        task = enforcement.start_enforcement(*start_args, **start_kwargs)
+        if task is not None:
+            tasks.append(task)
+        return task
+
+    stack.enter_context(mock.patch.dict(handel_dis_users.JOURNALS, clear=True))
+    dis_obj = handel_dis_users.DisabledUsers(os.path.join(directory, "disable_users.journal"))
+    handel_dis_users.JOURNALS[".disable_users.journal"] = dis_obj.journal
+    panel_outbox = outbox.PanelOutbox(os.path.join(directory, "panel_outbox.journal"))
+    for target, name, value in (
+        (outbox, "OUTBOX", panel_outbox),
+        (outbox, "OUTBOX_TASK", None),
+        (outbox, "get_token", mock.AsyncMock(return_value=REPLAY_PANEL)),
+        (outbox, "set_user_status", mock.AsyncMock(return_value=None)),
+        (outbox, "get_user_status", mock.AsyncMock(return_value="active")),
+        (outbox, "send_logs", keep_message),
+        (enforcement, "send_logs", keep_message),
+        (check_usage, "send_logs", keep_message),
+        (check_usage, "send_full_report", mock.AsyncMock()),
+        (check_usage, "start_enforcement", start),
+    ):
+        stack.enter_context(mock.patch.object(target, name, value))
+    return tasks
+
+
+async def run_check(
+    tasks: list, active_users: dict[str, set[str]], offenders: dict[str, list[str]]
+) -> None:
+    """
+    Run check_users_usage() on the logs parsed since the last check
+    and wait until the panel stub confirmed the disables.
+
+    Args:
+        tasks (list): The enforcement tasks (from stub_panel()).
+        active_users (dict[str, set[str]]): Every IP seen for each user (updated).
+        offenders (dict[str, list[str]]): The users over their limit (updated).
+    """
+    for user_name, user in ACTIVE_USERS.items():
+        active_users.setdefault(user_name, set()).update(user.ip)
+    await check_users_usage(REPLAY_PANEL)
+    for result in await asyncio.gather(*tasks):
+        offenders.update({user: sorted(ips) for user, ips in result.offenders.items()})
+    tasks.clear()
+
+
+async def main():  # pylint: disable=too-many-locals
+    """Replay the capture and print the results."""
+    await POLICY_STORE.migrate_config()
+    interval = args.interval or float((await read_config()).get("CHECK_INTERVAL", 240))
+    directory = tempfile.mkdtemp(prefix="v2iplimit-replay-")
+    messages: list[str] = []
+    active_users: dict[str, set[str]] = {}
+    offenders: dict[str, list[str]] = {}
+    frames = 0
+    lines = 0
+    checks = 0
+    parse_time = 0.0
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        tasks = stub_panel(stack, directory, messages)
+        try:
+            check_at = None
+            async for received_at, source, frame in replay_capture(args.path, args.speed):
+                if check_at is None:
+                    check_at = received_at + interval
+                elif received_at >= check_at:
+                    await run_check(tasks, active_users, offenders)
+                    checks += 1
+                    check_at += interval * ((received_at - check_at) // interval + 1)
+                frames += 1
+                lines += frame.count("\n") + 1
+                parse_start = time.perf_counter()
+                await parse_logs(frame, node=source)
+                parse_time += time.perf_counter() - parse_start
+            if ACTIVE_USERS:
+                await run_check(tasks, active_users, offenders)
+                checks += 1
+        finally:
+            if outbox.OUTBOX_TASK is not None:
+                outbox.OUTBOX_TASK.cancel()
+                await asyncio.gather(outbox.OUTBOX_TASK, return_exceptions=True)
+            shutil.rmtree(directory, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    print(f"Frames: {frames} Lines: {lines} Checks: {checks} in {elapsed:.2f}s")
+    if parse_time:
+        print(f"Parser: {lines / parse_time:,.0f} lines/sec")
+    print(f"Active users: {len(active_users)} Over the limit: {len(offenders)}")
+    for user_name, ips in offenders.items():
+        print(f"- {user_name}: {len(ips)} {ips}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "frames": frames,
+                    "lines": lines,
+                    "checks": checks,
+                    "active_users": {
+                        name: sorted(ips) for name, ips in active_users.items()
+                    },
+                    "offenders": offenders,
+                    "messages": messages,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
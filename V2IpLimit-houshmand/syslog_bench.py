@@ -0,0 +1,81 @@
+"""
+Benchmark for the syslog receiver.
+It sends Xray access lines over UDP on loopback and
+measures how many lines per second go through parse_logs().
+(it needs a config.json file like the main program)
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from utils.check_usage import ACTIVE_USERS
+from utils.syslog_receiver import SYSLOG_STATS, SyslogReceiver, start_syslog_receiver
+
+parser = argparse.ArgumentParser(description="Syslog receiver benchmark")
+parser.add_argument("--lines", type=int, default=500_000)
+parser.add_argument("--lines-per-packet", type=int, default=20)
+parser.add_argument("--port", type=int, default=5514)
+parser.add_argument("--rate", type=int, default=100_000, help="lines per second")
+args = parser.parse_args()
+
+LINE = (
+    "<14>1 2024-01-01T00:00:00Z bench-node xray - - - "
+    + "2024/01/01 00:00:00 5.{a}.{b}.9:53768 accepted tcp:example.com:443"
+    + " [REALITY TCP 4 -> IPv4] email: {user}.bench_user_{user}"
+)
+
+
+def build_packets() -> list[bytes]:
+    """Build the packets that are sent to the receiver."""
+    lines = [
+        LINE.format(a=i % 500 // 2, b=i % 3, user=i % 500)
+        for i in range(args.lines)
+    ]
+    step = args.lines_per_packet
+    return [
+        "\n".join(lines[i : i + step]).encode() for i in range(0, len(lines), step)
+    ]
+
+
+def send_packets(packets: list[bytes]) -> None:
+    """Send the packets at '--rate' from another process, like a remote Xray node would."""
+    packet_interval = args.lines_per_packet / args.rate
+    start = time.perf_counter()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for number, packet in enumerate(packets):
+            sock.sendto(packet, ("127.0.0.1", args.port))
+            delay = start + number * packet_interval - time.perf_counter()
+            if delay > 0.001:
+                time.sleep(delay)
+
+
+async def main():
+    """Run the benchmark."""
+    receiver = SyslogReceiver()
+    datagram_protocol, server = await start_syslog_receiver(receiver, "127.0.0.1", args.port)
+    drain_task = asyncio.create_task(receiver.drain_forever())
+    packets = build_packets()
+    start = time.perf_counter()
+    sender = multiprocessing.Process(target=send_packets, args=(packets,))
+    sender.start()
+    while sender.is_alive():
+        await asyncio.sleep(0.05)
+    last_count = -1
+    while last_count != sum(stats.lines for stats in SYSLOG_STATS.values()):
+        last_count = sum(stats.lines for stats in SYSLOG_STATS.values())
+        await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - start - 0.2
+    received = sum(stats.lines for stats in SYSLOG_STATS.values())
+    print(f"Lines sent: {args.lines} received: {received} (rate: {args.rate}/sec)")
+    print(f"Elapsed: {elapsed:.2f}s -> {received / elapsed:,.0f} lines/sec")
+    print(f"Active users: {len(ACTIVE_USERS)}")
+    drain_task.cancel()
+    datagram_protocol.close()
+    server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
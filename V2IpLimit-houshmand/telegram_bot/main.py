@@ -8,8 +8,11 @@ listing admins, setting special limits, and creating a config and more...
 # Imports
 # =========================
 import asyncio
+import html
 import os
 import sys
+import tempfile
+import threading
 
 try:
     from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
@@ -45,7 +48,25 @@ from telegram_bot.utils import (
     show_except_users_handler,
     write_country_code_json,
 )
+from utils.latency import SAMPLED_TRACES, STAGES, stage_nodes, stage_quantiles
+from utils.node_health import node_health_rows
+from utils.policy_import import EXPORT_HEADER, export_rows, read_policy_file
+from utils.policy_store import POLICY_STORE
+from utils.profiler import (
+    MAX_PROFILE_SECONDS,
+    memory_snapshot,
+    start_profile,
+    stop_memory_tracing,
+    stop_profile,
+)
 from utils.read_config import read_config
+from utils.report_file import REPORT_INLINE_ROWS, remove_report, write_report
+from utils.usage_report import (
+    USAGE_REPORT_HEADER,
+    USAGE_REPORT_STATE,
+    full_report_caption,
+    usage_rows,
+)
 
 
 # =========================
@@ -67,7 +88,8 @@ from utils.read_config import read_config
     GET_GENERAL_LIMIT_NUMBER,
     GET_CHECK_INTERVAL,
     GET_TIME_TO_ACTIVE_USERS,
-) = range(15)
+    IMPORT_LIMITS,
+) = range(16)
 
 
 # =========================
@@ -188,9 +210,30 @@ START_MESSAGE = """
 <b>تنظیم زمان فعال بودن کاربران</b>
 🕐 /set_time_to_active_users
 
+<b>افزودن یا حذف گروهی محدودیت‌ها و استثناها با فایل CSV/JSON</b>
+📥 /import_limits
+
+<b>دریافت فایل محدودیت‌های ویژه و کاربران استثنا</b>
+📤 /export_limits
+
 <b>ارسال فایل 'config.json' به عنوان پشتیبان</b>
 💾 /backup
 
+<b>گزارش کامل IP های فعال (آخرین بررسی)</b>
+📑 /usage_report
+
+<b>وضعیت اتصال و ترافیک لاگ هر نود</b>
+🛰️ /nodes
+
+<b>تأخیر از لاگ تا غیرفعال شدن کاربر در هر مرحله</b>
+⏱️ /latency
+
+<b>پروفایل مصرف CPU (پیش‌فرض 30 ثانیه) و توقف آن</b>
+🔬 /profile 60 — /profile_stop
+
+<b>مقایسه مصرف حافظه با snapshot قبلی</b>
+🧠 /memory_snapshot — /memory_snapshot stop
+
 ━━━━━━━━━━━━━━━━━━━━━━━━
 """
 
@@ -604,6 +647,22 @@ async def get_limit_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def reply_report(update: Update, name: str, header, rows, caption: str) -> None:
+    """Write the rows to a compressed CSV file and reply with it as one document."""
+    path = await write_report(name, header, rows)
+    try:
+        with open(path, "rb") as file:
+            await update.message.reply_document(
+                document=file,
+                filename=os.path.basename(path),
+                caption=caption,
+                reply_markup=MAIN_KEYBOARD,
+                parse_mode="HTML",
+            )
+    finally:
+        remove_report(path)
+
+
 async def show_special_limit_function(update: Update, _context: ContextTypes.DEFAULT_TYPE):
     """Show special limit list for all users."""
     check = await check_admin_privilege(update)
@@ -611,12 +670,19 @@ async def show_special_limit_function(update: Update, _context: ContextTypes.DEF
         return check
 
     out_put = await get_special_limit_list()
-    if out_put:
+    if out_put and len(out_put) > REPORT_INLINE_ROWS:
+        await reply_report(
+            update,
+            "special_limits",
+            ("username", "limit"),
+            list(out_put.items()),
+            f"📊 <b>لیست محدودیت‌های ویژه:</b> <code>{len(out_put)}</code> کاربر",
+        )
+    elif out_put:
+        users = "\n".join(f"{key} : {value}" for key, value in out_put.items())
         await update.message.reply_html(
-            text="📊 <b>لیست محدودیت‌های ویژه:</b>\n", reply_markup=MAIN_KEYBOARD
+            text=f"📊 <b>لیست محدودیت‌های ویژه:</b>\n\n🎯 {users}", reply_markup=MAIN_KEYBOARD
         )
-        for user in out_put:
-            await update.message.reply_html(text=f"🎯 {user}")
     else:
         await update.message.reply_html(
             text=(
@@ -687,6 +753,318 @@ async def send_backup(update: Update, _context: ContextTypes.DEFAULT_TYPE):
             text="❌ <b>فایل config.json یافت نشد!</b>\n\nابتدا تنظیمات را با /create_config تکمیل کنید.",
             reply_markup=MAIN_KEYBOARD,
         )
+        return
+    path = os.path.join(tempfile.mkdtemp(prefix="v2iplimit-"), "policy.sqlite3")
+    try:
+        await POLICY_STORE.backup(path)
+        with open(path, "rb") as file:
+            await update.message.reply_document(
+                document=file,
+                caption=(
+                    "💾 <b>فایل پشتیبان محدودیت‌های ویژه و کاربران استثنا</b>\n\n"
+                    f"برای بازگردانی آن را با نام <code>{POLICY_STORE.filename}</code>"
+                    " کنار config.json قرار دهید."
+                ),
+                reply_markup=MAIN_KEYBOARD,
+                parse_mode="HTML",
+            )
+    finally:
+        remove_report(path)
+
+
+async def usage_report_command(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Send the full usage report of the last check interval."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    if not USAGE_REPORT_STATE["latest"]:
+        await update.message.reply_html(
+            text="❌ <b>هنوز گزارشی وجود ندارد!</b>\n\nپس از اولین بررسی دوباره امتحان کنید.",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    latest = USAGE_REPORT_STATE["latest"]
+    await reply_report(
+        update, "usage", USAGE_REPORT_HEADER, usage_rows(latest), full_report_caption(latest)
+    )
+    return ConversationHandler.END
+
+
+NODE_HEALTH_HEADER = (
+    "node",
+    "state",
+    "last_frame",
+    "lines_per_sec_1m",
+    "lines_per_sec_15m",
+    "reconnects",
+    "backoff_left",
+    "queued",
+    "last_error",
+)
+
+
+async def nodes_command(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Show the log stream health of every node."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    rows = node_health_rows()
+    if not rows:
+        await update.message.reply_html(
+            text="❌ <b>هنوز هیچ نودی متصل نشده است!</b>",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    caption = (
+        f"🛰️ <b>وضعیت نودها:</b> <code>{len(rows)}</code> نود"
+        " (نودهای بی‌صدا اول نمایش داده می‌شوند)"
+    )
+    if len(rows) > REPORT_INLINE_ROWS:
+        await reply_report(update, "nodes", NODE_HEALTH_HEADER, rows, caption)
+        return ConversationHandler.END
+    lines = [
+        f"{name} [{state}] last: {last_frame} lines/s: {rate_1m}/{rate_15m}"
+        f" reconnects: {reconnects}"
+        + (f" retry in: {backoff}" if backoff != "-" else "")
+        + (f" queued: {queued}" if queued else "")
+        for name, state, last_frame, rate_1m, rate_15m, reconnects, backoff, queued, _ in rows
+    ]
+    await update.message.reply_html(
+        text=caption
+        + "\n<i>lines/s: 1m/15m</i>\n<pre>"
+        + html.escape("\n".join(lines), quote=False)
+        + "</pre>",
+        reply_markup=MAIN_KEYBOARD,
+    )
+    return ConversationHandler.END
+
+
+def _quantiles(stage: str, node: str | None = None) -> tuple[int, str, str]:
+    count, median, p95 = stage_quantiles(stage, node)
+    if not count:
+        return 0, "-", "-"
+    return (
+        count,
+        *("&gt;1h" if value == float("inf") else f"≤{value:g}s" for value in (median, p95)),
+    )
+
+
+async def latency_command(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Show the detection latency per stage and node, and the last sampled traces."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    lines = ["⏱️ <b>تأخیر تشخیص تا غیرفعال‌سازی</b> (تعداد، p50، p95)\n"]
+    for stage in STAGES:
+        count, median, p95 = _quantiles(stage)
+        lines.append(
+            f"<b>{stage}</b>: <code>{count}</code> {median} {p95}"
+        )
+    nodes = stage_nodes()
+    if nodes:
+        lines.append("\n<b>هر نود</b> (p95 دریافت / پردازش / کل):")
+    for node in nodes[:30]:
+        stages = [_quantiles(stage, node)[2] for stage in ("receive", "parse", "total")]
+        lines.append(f"<code>{html.escape(node, quote=False)}</code>: " + " / ".join(stages))
+    if SAMPLED_TRACES:
+        lines.append("\n<b>آخرین نمونه‌ها</b> (کاربر: دریافت، پردازش، تشخیص، غیرفعال):")
+    for trace in list(SAMPLED_TRACES)[-5:]:
+        origin = trace["logged"] or trace["received"]
+        steps = (trace["received"], trace["parsed"], trace["detected"], trace["disabled"])
+        lines.append(
+            f"<code>{html.escape(trace['user'], quote=False)}</code> "
+            f"({html.escape(trace['node'], quote=False)}): "
+            + ", ".join(f"+{step - origin:.1f}s" for step in steps)
+        )
+    await update.message.reply_html(text="\n".join(lines), reply_markup=MAIN_KEYBOARD)
+    return ConversationHandler.END
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sample the event loop for some seconds and send the top functions and a flamegraph file."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    seconds = context.args[0] if context.args else "30"
+    if not seconds.isdigit() or not 1 <= int(seconds) <= MAX_PROFILE_SECONDS:
+        await update.message.reply_html(
+            text=f"❌ مدت باید عددی بین 1 و {MAX_PROFILE_SECONDS} ثانیه باشد.\n"
+            "مثال: <code>/profile 60</code>",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    try:
+        sampler = start_profile(threading.get_ident())
+    except ValueError:
+        await update.message.reply_html(
+            text="⏳ یک پروفایل در حال اجراست. برای توقف: /profile_stop",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    try:
+        await update.message.reply_html(
+            text=f"🔬 پروفایل به مدت <code>{seconds}</code> ثانیه شروع شد."
+            " برای توقف: /profile_stop"
+        )
+        await asyncio.to_thread(sampler.run, int(seconds))
+    finally:
+        sampler.stop()  # also when the run fails or is cancelled
+    lines = [
+        f"{own / max(sampler.samples, 1):6.1%} {total / max(sampler.samples, 1):6.1%}  {name}"
+        for name, own, total in sampler.top_functions()
+    ]
+    caption = (
+        f"🔬 <b>پروفایل:</b> <code>{sampler.samples}</code> نمونه در "
+        f"<code>{sampler.duration:.0f}</code> ثانیه\n"
+        "فایل را با flamegraph.pl یا speedscope.app باز کنید."
+    )
+    await update.message.reply_html(
+        text="<b>self   total  function</b>\n<pre>"
+        + html.escape("\n".join(lines) or "-", quote=False)
+        + "</pre>",
+        reply_markup=MAIN_KEYBOARD,
+    )
+    path = await asyncio.to_thread(sampler.write_file)
+    try:
+        with open(path, "rb") as file:
+            await update.message.reply_document(
+                document=file, filename=os.path.basename(path), caption=caption, parse_mode="HTML"
+            )
+    finally:
+        remove_report(path)
+    return ConversationHandler.END
+
+
+async def profile_stop(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Stop the running profile early (its result is sent by /profile)."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    text = "✅ پروفایل متوقف شد." if stop_profile() else "❌ پروفایلی در حال اجرا نیست."
+    await update.message.reply_html(text=text, reply_markup=MAIN_KEYBOARD)
+    return ConversationHandler.END
+
+
+async def memory_snapshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start tracing memory, then show the growth since the previous snapshot."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    if context.args and context.args[0] == "stop":
+        stopped = stop_memory_tracing()
+        text = "✅ ردیابی حافظه متوقف شد." if stopped else "❌ ردیابی حافظه فعال نیست."
+        await update.message.reply_html(text=text, reply_markup=MAIN_KEYBOARD)
+        return ConversationHandler.END
+    lines = await asyncio.to_thread(memory_snapshot)
+    if not lines:
+        text = (
+            "🧠 ردیابی حافظه شروع شد (برنامه کمی کندتر می‌شود).\n"
+            "بعداً دوباره /memory_snapshot را بزنید تا افزایش حافظه را ببینید.\n"
+            "برای توقف: <code>/memory_snapshot stop</code>"
+        )
+    else:
+        text = (
+            "🧠 <b>بیشترین افزایش حافظه از آخرین snapshot:</b>\n<pre>"
+            + html.escape("\n".join(lines)[:3500], quote=False)
+            + "</pre>"
+        )
+    await update.message.reply_html(text=text, reply_markup=MAIN_KEYBOARD)
+    return ConversationHandler.END
+
+
+async def export_limits(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Send the special limits and except users as one CSV file."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    rows = export_rows(POLICY_STORE)
+    await reply_report(
+        update,
+        "limits",
+        EXPORT_HEADER,
+        rows,
+        (
+            f"📤 <b>محدودیت‌های ویژه و کاربران استثنا:</b> <code>{len(rows)}</code> ردیف\n"
+            "این فایل را می‌توانید پس از ویرایش با /import_limits دوباره ارسال کنید."
+        ),
+    )
+    return ConversationHandler.END
+
+
+async def import_limits(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Ask for a CSV/JSON file of special limits and except users."""
+    check = await check_admin_privilege(update)
+    if check:
+        return check
+
+    await update.message.reply_html(
+        text=(
+            "📥 <b>افزودن گروهی محدودیت‌ها</b>\n\n"
+            "یک فایل <code>.csv</code> با ستون‌های <code>username,limit</code>"
+            " (یا <code>.jsonl</code> یا <code>.json</code>، فشرده با gz هم قابل قبول است) ارسال کنید.\n\n"
+            "مقدار <code>limit</code> می‌تواند یکی از این‌ها باشد:\n"
+            "🔢 عدد: تنظیم محدودیت ویژه\n"
+            "<code>except</code>: افزودن به استثناها\n"
+            "<code>remove</code>: حذف محدودیت ویژه\n"
+            "<code>remove_except</code>: حذف از استثناها\n\n"
+            "اگر حتی یک ردیف نامعتبر باشد هیچ تغییری اعمال نمی‌شود."
+        ),
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    return IMPORT_LIMITS
+
+
+async def import_limits_handler(update: Update, _context: ContextTypes.DEFAULT_TYPE):
+    """Validate the uploaded file and apply all of its rows in one transaction."""
+    document = update.message.document
+    path = os.path.join(tempfile.mkdtemp(prefix="v2iplimit-"), "import")
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        changes = await asyncio.to_thread(read_policy_file, path, document.file_name or "")
+    except Exception as error:  # pylint: disable=broad-except
+        await update.message.reply_html(
+            text=f"❌ <b>خطا در خواندن فایل!</b>\n\n<code>{html.escape(str(error), quote=False)}</code>",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    finally:
+        remove_report(path)
+    if changes.error_count:
+        errors = html.escape("\n".join(changes.errors), quote=False)
+        await update.message.reply_html(
+            text=(
+                f"❌ <b>{changes.error_count} ردیف نامعتبر، هیچ تغییری اعمال نشد!</b>\n\n"
+                f"<code>{errors}</code>"
+            ),
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    await POLICY_STORE.write(
+        limits=changes.limits,
+        remove_limits=changes.remove_limits,
+        add_except=changes.add_except,
+        remove_except=changes.remove_except,
+    )
+    await update.message.reply_html(
+        text=(
+            "✅ <b>فایل با موفقیت اعمال شد!</b>\n\n"
+            f"📄 ردیف‌ها: <code>{changes.rows}</code>\n"
+            f"🎯 محدودیت ویژه تنظیم شده: <code>{len(changes.limits)}</code>\n"
+            f"🗑️ محدودیت ویژه حذف شده: <code>{len(changes.remove_limits)}</code>\n"
+            f"✅ افزوده شده به استثناها: <code>{len(changes.add_except)}</code>\n"
+            f"🚫 حذف شده از استثناها: <code>{len(changes.remove_except)}</code>"
+        ),
+        reply_markup=MAIN_KEYBOARD,
+    )
+    return ConversationHandler.END
 
 
 async def set_except_users(update: Update, _context: ContextTypes.DEFAULT_TYPE):
@@ -762,14 +1140,24 @@ async def show_except_users(update: Update, _context: ContextTypes.DEFAULT_TYPE)
     if check:
         return check
 
-    messages = await show_except_users_handler()
-    if messages:
+    except_users = await show_except_users_handler()
+    if except_users and len(except_users) > REPORT_INLINE_ROWS:
+        await reply_report(
+            update,
+            "except_users",
+            ("username",),
+            [(user,) for user in except_users],
+            f"📋 <b>لیست کاربران استثنا:</b> <code>{len(except_users)}</code> کاربر",
+        )
+    elif except_users:
+        users = "\n".join(str(user) for user in except_users)
         await update.message.reply_html(
-            text="📋 <b>لیست کاربران استثنا:</b>\n\n✅ کاربران زیر هیچ محدودیتی ندارند:",
+            text=(
+                "📋 <b>لیست کاربران استثنا:</b>\n\n✅ کاربران زیر هیچ محدودیتی ندارند:\n\n"
+                f"👤 {users}"
+            ),
             reply_markup=MAIN_KEYBOARD,
         )
-        for message in messages:
-            await update.message.reply_html(text=f"👤 {message}")
     else:
         await update.message.reply_html(
             text=(
@@ -924,7 +1312,9 @@ async def handle_keyboard_commands(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_html(
             "🎯 <b>مدیریت محدودیت‌های ویژه</b>\n\n"
             "📊 /show_special_limit - نمایش محدودیت‌های فعلی\n"
-            "➕ /set_special_limit - تنظیم محدودیت جدید",
+            "➕ /set_special_limit - تنظیم محدودیت جدید\n"
+            "📥 /import_limits - افزودن گروهی با فایل\n"
+            "📤 /export_limits - دریافت فایل محدودیت‌ها",
             reply_markup=MAIN_KEYBOARD,
         )
 
@@ -1006,6 +1396,14 @@ application.add_handler(CommandHandler("start", start))
 application.add_handler(CommandHandler("admins_list", admins_list))
 application.add_handler(CommandHandler("show_except_users", show_except_users))
 application.add_handler(CommandHandler("spernet", spernet_info))
+application.add_handler(CommandHandler("usage_report", usage_report_command))
+application.add_handler(CommandHandler("export_limits", export_limits))
+application.add_handler(CommandHandler("nodes", nodes_command))
+application.add_handler(CommandHandler("latency", latency_command))
+# پروفایل در پس‌زمینه اجرا می‌شود تا بقیه دستورات منتظر نمانند
+application.add_handler(CommandHandler("profile", profile_command, block=False))
+application.add_handler(CommandHandler("profile_stop", profile_stop))
+application.add_handler(CommandHandler("memory_snapshot", memory_snapshot_command))
 
 # محاوره‌های چندمرحله‌ای (با Regex برای ورودی‌های عددی)
 application.add_handler(
@@ -1100,6 +1498,14 @@ application.add_handler(
     )
 )
 
+application.add_handler(
+    ConversationHandler(
+        entry_points=[CommandHandler("import_limits", import_limits)],
+        states={IMPORT_LIMITS: [MessageHandler(filters.Document.ALL, import_limits_handler)]},
+        fallbacks=[CommandHandler("start", start)],
+    )
+)
+
 application.add_handler(
     ConversationHandler(
         entry_points=[CommandHandler("add_admin", add_admin)],
@@ -1,24 +1,406 @@
 """
 Send logs to telegram bot.
+send_logs() only queues the message, a background task sends the queue
+to the admins: repeated messages are merged with a count and small
+messages are joined up to the Telegram message size limit.
+Sends follow the Telegram rate limits (global and per chat) and wait
+the 'retry_after' of a flood control error.
+Large reports are sent once as a compressed document with send_document_logs().
 """
 
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from telegram.error import NetworkError, RetryAfter
+
 from telegram_bot.main import application
-from telegram_bot.utils import check_admin
+from utils.logs import logger
+from utils.metrics import TELEGRAM_SEND_SECONDS
+from utils.read_config import read_config
+from utils.report_file import remove_report
 
+MAX_MESSAGE_LENGTH = 4096  # Telegram limit
+MAX_CAPTION_LENGTH = 1024  # Telegram limit for document captions
+FLUSH_INTERVAL = 1.0  # seconds between two sends
+COALESCE_WINDOW = 60.0  # a message sent again within this window is only counted
+MAX_PENDING = 1000  # distinct messages kept while Telegram is slow
+SEND_CONCURRENCY = 5  # messages in flight (one at a time per admin)
+GLOBAL_RATE = 25.0  # messages per second for the whole bot (Telegram allows ~30)
+CHAT_RATE = 1.0  # messages per second in one chat
+CHAT_BURST = 3
+SEND_ATTEMPTS = 4
+HTML_TOKEN_REGEX = re.compile(r"<(/?)([a-zA-Z]+)[^>]*>|&#?\w+;")
 
-async def send_logs(msg):
-    """Send logs to all admins."""
-    admins = await check_admin()
-    retries = 2
-    if admins:
-        for admin in admins:
-            for _ in range(retries):
-                try:
-                    await application.bot.sendMessage(
-                        chat_id=admin, text=msg, parse_mode="HTML"
+PENDING: dict[str, int] = {}  # message -> count, in arrival order
+FAILED_FLUSHES: dict[str, int] = {}  # message -> flushes that delivered it to no admin
+RECENT: dict[str, list] = {}  # message -> [sent at, times repeated since]
+NOTIFY_METRICS: dict[str, int] = {
+    "queued": 0,
+    "coalesced": 0,
+    "dropped": 0,
+    "sent": 0,
+    "documents": 0,
+}
+_SENDER: list = [None]  # the sender task (one per event loop)
+DOCUMENT_TASKS: set[asyncio.Task] = set()  # keeps a reference to the document sends
+
+
+class TokenBucket:
+    """
+    A token bucket, callers wait in the order they asked for a token.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): The maximum number of tokens (the burst size).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """Take a token, wait if there is none."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1  # reserve it, a negative value is the queue of waiters
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def hold(self, seconds: float) -> None:
+        """Give no token for 'seconds' (after a flood control error)."""
+        self.tokens = min(self.tokens, -seconds * self.rate)
+        self.updated = time.monotonic()
+
+
+@dataclass
+class AdminStats:
+    """
+    The delivery statistics of one admin chat.
+
+    Attributes:
+        sent (int): Messages delivered.
+        failed (int): Messages given up.
+        retries (int): Extra attempts (flood control or network errors).
+        latency_sum (float): Seconds from the first attempt to the delivery, summed.
+        latency_max (float): The slowest delivery.
+        last_error (str | None): The last error.
+    """
+
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    latency_sum: float = 0.0
+    latency_max: float = 0.0
+    last_error: str | None = None
+
+
+GLOBAL_BUCKET = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+CHAT_BUCKETS: dict[int, TokenBucket] = {}
+ADMIN_STATS: dict[int, AdminStats] = {}
+
+
+def _update_tags(tags: list[tuple[str, str]], html: str) -> None:
+    """Update the (name, opening tag) of the open tags with the tags of 'html'."""
+    for match in HTML_TOKEN_REGEX.finditer(html):
+        name = match.group(2)
+        if name is None:  # an entity
+            continue
+        name = name.lower()
+        if not match.group(1):
+            tags.append((name, match.group(0)))
+            continue
+        for index in range(len(tags) - 1, -1, -1):
+            if tags[index][0] == name:
+                del tags[index:]
+                break
+
+
+def _close_tags(tags: list[tuple[str, str]]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(tags))
+
+
+def _open_tags(tags: list[tuple[str, str]]) -> str:
+    return "".join(tag for _, tag in tags)
+
+
+def _html_pieces(line: str) -> list[str]:
+    """Returns the tags, the entities and the characters of a line."""
+    pieces: list[str] = []
+    position = 0
+    for match in HTML_TOKEN_REGEX.finditer(line):
+        pieces.extend(line[position : match.start()])
+        pieces.append(match.group(0))
+        position = match.end()
+    pieces.extend(line[position:])
+    return pieces
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Split an HTML text into parts of at most 'limit' characters, on line
+    boundaries (a longer line is cut, never inside a tag or an entity).
+    The tags open at a cut are closed at the end of the part and opened
+    again at the start of the next one, so every part is valid HTML.
+
+    Args:
+        text (str): The text to split.
+        limit (int): The maximum length of a part.
+
+    Returns:
+        list[str]: The parts.
+    """
+    parts: list[str] = []
+    tags: list[tuple[str, str]] = []  # the tags open at the end of 'current'
+    current, empty = "", True  # 'empty': 'current' only opens the tags again
+    for line in text.split("\n"):
+        after = list(tags)
+        _update_tags(after, line)
+        candidate = current + line if empty else f"{current}\n{line}"
+        if len(candidate) + len(_close_tags(after)) <= limit:
+            current, tags, empty = candidate, after, False
+            continue
+        if not empty:
+            parts.append(current + _close_tags(tags))
+            current, empty = _open_tags(tags), True
+            if len(current + line) + len(_close_tags(after)) <= limit:
+                current, tags, empty = current + line, after, False
+                continue
+        closing = _close_tags(tags)
+        for piece in _html_pieces(line):
+            if not empty and len(current) + len(piece) + len(closing) > limit:
+                parts.append(current + closing)
+                current = _open_tags(tags)
+            current += piece
+            empty = False
+            if piece.startswith("<"):
+                _update_tags(tags, piece)
+                closing = _close_tags(tags)
+    if not empty:
+        parts.append(current + _close_tags(tags))
+    return parts
+
+
+def build_batches(
+    messages: dict[str, int], limit: int = MAX_MESSAGE_LENGTH
+) -> list[tuple[str, list[str]]]:
+    """
+    Join the queued messages into as few Telegram messages as possible.
+    A message longer than 'limit' is split with split_message().
+
+    Args:
+        messages (dict[str, int]): The messages and how many times each was sent.
+        limit (int): The maximum length of a Telegram message.
+
+    Returns:
+        list[tuple[str, list[str]]]: The texts to send and the messages in each one.
+    """
+    batches: list[tuple[str, list[str]]] = []
+    current, included = "", []
+    for message, count in messages.items():
+        text = message if count == 1 else f"{message}\n<i>(x{count})</i>"
+        for part in split_message(text, limit):
+            if current and len(current) + 2 + len(part) > limit:
+                batches.append((current, included))
+                current, included = part, [message]
+            else:
+                current = f"{current}\n\n{part}" if current else part
+                if message not in included:
+                    included.append(message)
+    if current:
+        batches.append((current, included))
+    return batches
+
+
+def _release_recent(now: float) -> None:
+    """Queue the messages repeated during their window, forget the old ones."""
+    for message, (sent_at, repeated) in list(RECENT.items()):
+        if now - sent_at < COALESCE_WINDOW:
+            continue
+        if repeated:
+            PENDING[message] = PENDING.get(message, 0) + repeated
+            RECENT[message] = [now, 0]
+        else:
+            del RECENT[message]
+
+
+async def send_to_chat(chat_id: int, text: str, document: str | None = None) -> bool:
+    """
+    Send one message within the rate limits, retrying flood control
+    ('retry_after' is waited) and network errors.
+
+    Args:
+        chat_id (int): The chat of the admin.
+        text (str): The HTML text (the caption if a document is sent,
+            cut to 1024 characters with split_message()).
+        document (str | None): The path of a file to send as a document.
+
+    Returns:
+        bool: True if the message was delivered.
+    """
+    if document is not None:
+        text = split_message(text, MAX_CAPTION_LENGTH)[0]  # never cut inside a tag
+    stats = ADMIN_STATS.setdefault(chat_id, AdminStats())
+    bucket = CHAT_BUCKETS.setdefault(chat_id, TokenBucket(CHAT_RATE, CHAT_BURST))
+    start = time.monotonic()
+    for attempt in range(SEND_ATTEMPTS):
+        if attempt:
+            stats.retries += 1
+        await bucket.acquire()
+        await GLOBAL_BUCKET.acquire()
+        try:
+            if document is None:
+                await application.bot.sendMessage(chat_id=chat_id, text=text, parse_mode="HTML")
+            else:
+                with open(document, "rb") as file:
+                    await application.bot.send_document(
+                        chat_id=chat_id,
+                        document=file,
+                        filename=os.path.basename(document),
+                        caption=text,
+                        parse_mode="HTML",
                     )
-                    break
-                except Exception as e:  # pylint: disable=broad-except
-                    print(f"Failed to send message to admin {admin}: {e}")
-    else:
+        except RetryAfter as error:
+            retry_after = error.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            stats.last_error = str(error)
+            bucket.hold(float(retry_after))
+            continue
+        except NetworkError as error:  # includes timeouts
+            stats.last_error = str(error)
+            await asyncio.sleep(2**attempt)
+            continue
+        except Exception as error:  # pylint: disable=broad-except
+            stats.last_error = str(error)
+            break
+        latency = time.monotonic() - start
+        TELEGRAM_SEND_SECONDS.observe(latency)
+        stats.sent += 1
+        stats.latency_sum += latency
+        stats.latency_max = max(stats.latency_max, latency)
+        NOTIFY_METRICS["documents" if document else "sent"] += 1
+        return True
+    stats.failed += 1
+    logger.error("Failed to send message to admin %s: %s", chat_id, stats.last_error)
+    return False
+
+
+async def _send_to_admin(
+    admin: int, texts: list[str], semaphore: asyncio.Semaphore
+) -> list[bool]:
+    delivered = []
+    for text in texts:
+        async with semaphore:
+            delivered.append(await send_to_chat(admin, text))
+    return delivered
+
+
+async def flush_logs() -> None:
+    """
+    Send the queued messages now. A message leaves the queue once an admin
+    received it, the others are sent again with the next flush (at most
+    SEND_ATTEMPTS times).
+    """
+    now = time.time()
+    _release_recent(now)
+    if not PENDING:
+        return
+    messages = dict(PENDING)
+    admins = (await read_config()).get("ADMINS", [])
+    if not admins:
+        PENDING.clear()
         print("No admins found.")
+        return
+    batches = build_batches(messages)
+    semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_send_to_admin(admin, [text for text, _ in batches], semaphore) for admin in admins)
+    )
+    sent: set[str] = set()
+    for index, (_, included) in enumerate(batches):
+        if any(delivered[index] for delivered in results):
+            sent.update(included)
+    for message, count in messages.items():
+        if message not in sent:
+            FAILED_FLUSHES[message] = FAILED_FLUSHES.get(message, 0) + 1
+            if FAILED_FLUSHES[message] < SEND_ATTEMPTS:
+                continue
+            NOTIFY_METRICS["dropped"] += 1
+        FAILED_FLUSHES.pop(message, None)
+        RECENT.setdefault(message, [now, 0])
+        left = PENDING.pop(message, count) - count  # repeats queued during the send
+        if left > 0:
+            RECENT[message][1] += left
+
+
+async def _run_sender() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush_logs()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Failed to send the logs: %s", error)
+
+
+async def send_logs(msg):
+    """
+    Queue a message for all admins, it returns without waiting for Telegram.
+    A message already queued, or sent less than COALESCE_WINDOW seconds ago,
+    is only counted and sent once with the count.
+    """
+    msg = str(msg)
+    if msg in PENDING:
+        PENDING[msg] += 1
+        NOTIFY_METRICS["coalesced"] += 1
+    elif msg in RECENT:
+        RECENT[msg][1] += 1
+        NOTIFY_METRICS["coalesced"] += 1
+    else:
+        if len(PENDING) >= MAX_PENDING:
+            del PENDING[next(iter(PENDING))]
+            NOTIFY_METRICS["dropped"] += 1
+        PENDING[msg] = 1
+        NOTIFY_METRICS["queued"] += 1
+    sender = _SENDER[0]
+    if sender is None or sender.done() or sender.get_loop() is not asyncio.get_running_loop():
+        _SENDER[0] = asyncio.create_task(_run_sender(), name="send_logs")
+
+
+async def _send_document(path: str, caption: str) -> None:
+    try:
+        admins = (await read_config()).get("ADMINS", [])
+        if not admins:
+            print("No admins found.")
+            return
+        semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+
+        async def send(admin: int) -> None:
+            async with semaphore:
+                await send_to_chat(admin, caption, document=path)
+
+        await asyncio.gather(*(send(admin) for admin in admins))
+    except Exception as error:  # pylint: disable=broad-except
+        logger.error("Failed to send the report %s: %s", path, error)
+    finally:
+        remove_report(path)
+
+
+async def send_document_logs(path: str, caption: str) -> None:
+    """
+    Send a report file to all admins as one document, it returns without
+    waiting for Telegram. The file is deleted once it was sent.
+
+    Args:
+        path (str): The path of the file (written by utils.report_file.write_report()).
+        caption (str): The HTML caption (cut to 1024 characters with split_message()).
+    """
+    task = asyncio.create_task(_send_document(path, caption), name="send_document")
+    DOCUMENT_TASKS.add(task)
+    task.add_done_callback(DOCUMENT_TASKS.discard)
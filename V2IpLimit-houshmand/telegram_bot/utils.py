@@ -1,20 +1,17 @@
 """
-This module contains utility functions for reading and writing to a JSON file,
+This module contains utility functions for reading and writing the config,
 managing admin IDs, and handling special limits for users and more...
+Every change goes through CONFIG_STORE (in memory, saved atomically),
+the special limits and except users are kept in POLICY_STORE (sqlite).
 """
 
-import json
-import os
-import sys
+import copy
 
+from utils.config_store import CONFIG_STORE
+from utils.panel_scheduler import panel_client
+from utils.policy_store import POLICY_STORE
 from utils.types import PanelType
 
-try:
-    import httpx
-except ImportError:
-    print("Module 'httpx' is not installed use: 'pip install httpx' to install it")
-    sys.exit()
-
 
 async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     """
@@ -28,7 +25,7 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     for scheme in ["https", "http"]:
         url = f"{scheme}://{panel_data.panel_domain}/api/admin/token"
         try:
-            async with httpx.AsyncClient(verify=False) as client:
+            async with panel_client() as client:
                 response = await client.post(url, data=payload, timeout=5)
                 response.raise_for_status()
             json_obj = response.json()
@@ -45,24 +42,27 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
 
 async def read_json_file() -> dict:
     """
-    Reads and returns the content of the config.json file.
+    Returns a copy of the config.
 
     Returns:
         The content of the config.json file.
     """
-    with open("config.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+    return copy.deepcopy(CONFIG_STORE.get())
 
 
 async def write_json_file(data: dict):
     """
-    Writes the given data to the config.json file.
+    Replaces the config with the given data and saves it.
 
     Args:
         data: The data to write to the file.
     """
-    with open("config.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+
+    def replace(config: dict) -> None:
+        config.clear()
+        config.update(data)
+
+    await CONFIG_STORE.update(replace)
 
 
 async def add_admin_to_config(new_admin_id: int) -> int | None:
@@ -75,19 +75,15 @@ async def add_admin_to_config(new_admin_id: int) -> int | None:
     Returns:
         The ID of the new admin if it was added, None otherwise.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        admins = data.get("ADMINS", [])
-        if int(new_admin_id) not in admins:
-            admins.append(int(new_admin_id))
-            data["ADMINS"] = admins
-            await write_json_file(data)
-            return new_admin_id
-    else:
-        data = {"ADMINS": [new_admin_id]}
-        await write_json_file(data)
+
+    def add(config: dict) -> int | None:
+        admins = config.setdefault("ADMINS", [])
+        if int(new_admin_id) in admins:
+            return None
+        admins.append(int(new_admin_id))
         return new_admin_id
-    return None
+
+    return await CONFIG_STORE.update(add)
 
 
 async def check_admin() -> list[int] | None:
@@ -97,9 +93,7 @@ async def check_admin() -> list[int] | None:
     Returns:
         The list of admins.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        return data.get("ADMINS", [])
+    return CONFIG_STORE.get().get("ADMINS", [])
 
 
 async def handel_special_limit(username: str, limit: int) -> list:
@@ -114,19 +108,8 @@ async def handel_special_limit(username: str, limit: int) -> list:
         A list where the first element is a flag indicating whether the limit was set before,
         and the second element is the new limit.
     """
-    set_before = 0
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        special_limit = data.get("SPECIAL_LIMIT", {})
-        if special_limit.get(username):
-            set_before = 1
-        special_limit[username] = limit
-        data["SPECIAL_LIMIT"] = special_limit
-        await write_json_file(data)
-        return [set_before, special_limit[username]]
-    data = {"SPECIAL_LIMIT": {username: limit}}
-    await write_json_file(data)
-    return [0, special_limit[username]]
+    set_before = await POLICY_STORE.set_limit(username, limit)
+    return [int(set_before), limit]
 
 
 async def remove_admin_from_config(admin_id: int) -> bool:
@@ -139,14 +122,15 @@ async def remove_admin_from_config(admin_id: int) -> bool:
     Returns:
         bool: True if the admin was successfully removed, False otherwise.
     """
-    data = await read_json_file()
-    admins = data.get("ADMINS", [])
-    if admin_id in admins:
+
+    def remove(config: dict) -> bool:
+        admins = config.get("ADMINS", [])
+        if admin_id not in admins:
+            return False
         admins.remove(admin_id)
-        data["ADMINS"] = admins
-        await write_json_file(data)
         return True
-    return False
+
+    return await CONFIG_STORE.update(remove)
 
 
 async def add_base_information(domain: str, password: str, username: str):
@@ -164,42 +148,26 @@ async def add_base_information(domain: str, password: str, username: str):
     await get_token(
         PanelType(panel_domain=domain, panel_password=password, panel_username=username)
     )
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-    else:
-        data = {}
-    data.update(
-        {
-            "PANEL_DOMAIN": domain,
-            "PANEL_USERNAME": username,
-            "PANEL_PASSWORD": password,
-        }
+    await CONFIG_STORE.update(
+        lambda config: config.update(
+            {
+                "PANEL_DOMAIN": domain,
+                "PANEL_USERNAME": username,
+                "PANEL_PASSWORD": password,
+            }
+        )
     )
-    await write_json_file(data)
 
 
-async def get_special_limit_list() -> list | None:
+async def get_special_limit_list() -> dict | None:
     """
-    This function reads config file, retrieves the list of special limits,
-    and returns this list in a format suitable for messaging (split into shorter messages).
+    This function retrieves the special limits.
+    The caller sends a short list as a message and a long one as a report file.
 
     Returns:
-        list
+        dict | None: The limit of each user, None if there is no special limit.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        special_list = data.get("SPECIAL_LIMIT", None)
-        if not special_list:
-            return None
-        special_list = "\n".join(
-            [f"{key} : {value}" for key, value in special_list.items()]
-        )
-        messages = special_list.split("\n")
-        shorter_messages = [
-            "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
-        ]
-        return shorter_messages
-    return None
+    return dict(sorted(POLICY_STORE.load().special_limits.items())) or None
 
 
 async def write_country_code_json(country_code: str) -> None:
@@ -209,104 +177,56 @@ async def write_country_code_json(country_code: str) -> None:
     Args:
         country_code: The country code to write to the file.
     """
-    data = await read_json_file()
-    data["IP_LOCATION"] = country_code
-    await write_json_file(data)
+    await _save_value("IP_LOCATION", country_code)
 
 
 async def add_except_user(except_user: str) -> str | None:
     """
-    Add a user to the exception list in the config file.
-    If the config file does not exist, it creates one.
-    """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        user = data.get("EXCEPT_USERS", [])
-        if except_user not in user:
-            user.append(except_user)
-            data["EXCEPT_USERS"] = user
-            await write_json_file(data)
-            return except_user
-    else:
-        data = {"EXCEPT_USERS": [except_user]}
-        await write_json_file(data)
+    Add a user to the exception list.
+    """
+    if await POLICY_STORE.add_except(except_user):
         return except_user
     return None
 
 
 async def show_except_users_handler() -> list | None:
     """
-    Retrieve the list of exception users from the config file.
-    If the list is too long, it splits the list into shorter messages.
+    Retrieve the list of exception users.
+    The caller sends a short list as a message and a long one as a report file.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        except_users = data.get("EXCEPT_USERS", None)
-        if not except_users:
-            return None
-        except_users = "\n".join([f"{key}" for key in except_users])
-        messages = except_users.split("\n")
-        shorter_messages = [
-            "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
-        ]
-        return shorter_messages
-    return None
+    return sorted(POLICY_STORE.load().except_users) or None
 
 
 async def remove_except_user_from_config(user: str) -> str | None:
     """
-    Remove a user from the exception list in the config file.
+    Remove a user from the exception list.
     """
-    data = await read_json_file()
-    except_user = data.get("EXCEPT_USERS", [])
-    if user in except_user:
-        except_user.remove(user)
-        data["EXCEPT_USERS"] = except_user
-        await write_json_file(data)
+    if await POLICY_STORE.remove_except(user):
         return user
     return None
 
 
+async def _save_value(key: str, value):
+    await CONFIG_STORE.update(lambda config: config.__setitem__(key, value))
+    return value
+
+
 async def save_general_limit(limit: int) -> int:
     """
     Save the general limit to the config file.
-    If the config file does not exist, it creates one.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        data["GENERAL_LIMIT"] = limit
-        await write_json_file(data)
-        return limit
-    data = {"GENERAL_LIMIT": limit}
-    await write_json_file(data)
-    return limit
+    return await _save_value("GENERAL_LIMIT", limit)
 
 
 async def save_check_interval(interval: int) -> int:
     """
     Save the check interval to the config file.
-    If the config file does not exist, it creates one.
     """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        data["CHECK_INTERVAL"] = interval
-        await write_json_file(data)
-        return interval
-    data = {"CHECK_INTERVAL": interval}
-    await write_json_file(data)
-    return interval
+    return await _save_value("CHECK_INTERVAL", interval)
 
 
 async def save_time_to_active_users(time: int) -> int:
     """
     Save the time to active users to the config file.
-    If the config file does not exist, it creates one.
-    """
-    if os.path.exists("config.json"):
-        data = await read_json_file()
-        data["TIME_TO_ACTIVE_USERS"] = time
-        await write_json_file(data)
-        return time
-    data = {"TIME_TO_ACTIVE_USERS": time}
-    await write_json_file(data)
-    return time
+    """
+    return await _save_value("TIME_TO_ACTIVE_USERS", time)
@@ -0,0 +1,28 @@
+"""
+The modules read config.json (and write app.log) in the working directory,
+so the tests run in a temporary directory with a test config.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="v2iplimit-test-")
+TEST_CONFIG = {
+    "BOT_TOKEN": "123456:TEST",
+    "ADMINS": [],
+    "PANEL_DOMAIN": "127.0.0.1:9",
+    "PANEL_USERNAME": "admin",
+    "PANEL_PASSWORD": "admin",
+    "CHECK_INTERVAL": 240,
+    "TIME_TO_ACTIVE_USERS": 600,
+    "IP_LOCATION": "None",
+    "GENERAL_LIMIT": 2,
+}
+
+with open(os.path.join(TEST_DIR, "config.json"), "w", encoding="utf-8") as config_file:
+    json.dump(TEST_CONFIG, config_file)
+os.chdir(TEST_DIR)
+sys.path.insert(0, ROOT)
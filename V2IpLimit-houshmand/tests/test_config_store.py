@@ -0,0 +1,31 @@
+"""
+Tests of the in-memory config and its writes.
+"""
+
+import json
+import os
+import stat
+import tempfile
+import unittest
+
+from utils.config_store import ConfigStore
+
+
+class ConfigStoreTest(unittest.IsolatedAsyncioTestCase):
+    """Saving the config keeps config.json as it was set up."""
+
+    async def test_update_keeps_the_file_mode(self):
+        """The rewritten config.json has the mode of the old one."""
+        filename = os.path.join(tempfile.mkdtemp(), "config.json")
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump({"BOT_TOKEN": "123456:TEST", "ADMINS": []}, file)
+        os.chmod(filename, 0o640)
+        store = ConfigStore(filename)
+        await store.update(lambda data: data.update(GENERAL_LIMIT=3))
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o640)
+        with open(filename, encoding="utf-8") as file:
+            self.assertEqual(json.load(file)["GENERAL_LIMIT"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
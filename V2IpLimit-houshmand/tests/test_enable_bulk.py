@@ -0,0 +1,38 @@
+"""
+Tests of the bulk enable of users.
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from utils import panel_api
+from utils.types import PanelType
+
+PANEL = PanelType("admin", "admin", "127.0.0.1:9")
+
+
+class EnableUsersBulkTest(unittest.IsolatedAsyncioTestCase):
+    """Every user gets a final state, even when a worker fails unexpectedly."""
+
+    async def test_unexpected_error_is_a_failed_user(self):
+        """An exception in one enable fails that user and the others are enabled."""
+
+        async def set_user_status(_client, _panel_data, username, _status, _headers):
+            if username == "user1":
+                raise RuntimeError("broken response")
+            return None
+
+        with mock.patch.object(panel_api, "get_token", mock.AsyncMock(return_value=PANEL)), \
+                mock.patch.object(panel_api, "set_user_status", set_user_status):
+            states = await asyncio.wait_for(
+                panel_api.enable_users_bulk(PANEL, ["user1", "user2"], 2), 5
+            )
+        results = {state.username: state for state in states}
+        self.assertFalse(results["user1"].enabled)
+        self.assertIn("broken response", results["user1"].error)
+        self.assertTrue(results["user2"].enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
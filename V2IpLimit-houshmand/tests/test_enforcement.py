@@ -0,0 +1,46 @@
+"""
+Tests of the enforcement of the users over the limit.
+"""
+
+import os
+import unittest
+from unittest import mock
+
+from utils import enforcement, outbox
+from utils.types import UserStatus
+from utils.user_state import USER_STATES
+
+
+class DisableOffendersTest(unittest.IsolatedAsyncioTestCase):
+    """The user-state index never hides an offender from the outbox."""
+
+    def setUp(self):
+        if os.path.exists(".panel_outbox.journal"):
+            os.remove(".panel_outbox.journal")
+        self.panel_outbox = outbox.PanelOutbox()  # its worker is not running
+        patches = [
+            mock.patch.object(enforcement, "get_outbox", return_value=self.panel_outbox),
+            mock.patch.object(enforcement, "send_logs", mock.AsyncMock()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def test_user_known_as_disabled_is_checked(self):
+        """A user the index shows as disabled is queued, read from the panel first."""
+        USER_STATES.set("user1", UserStatus.DISABLE)
+        USER_STATES.set("user2", UserStatus.ACTIVE)
+        self.addCleanup(USER_STATES.set, "user1", None)
+        self.addCleanup(USER_STATES.set, "user2", None)
+        offenders = {"user1": ["1.1.1.1"], "user2": ["2.2.2.2"]}
+        result = await enforcement.disable_offenders(offenders, 0.01)
+        self.assertEqual(sorted(result.timed_out), ["user1", "user2"])
+        actions = {
+            action.username: action for action in self.panel_outbox.actions.values()
+        }
+        self.assertTrue(actions["user1"].check_first)
+        self.assertFalse(actions["user2"].check_first)
+
+
+if __name__ == "__main__":
+    unittest.main()
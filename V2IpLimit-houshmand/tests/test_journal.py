@@ -0,0 +1,27 @@
+"""
+Tests of the append-only journal.
+"""
+
+import os
+import tempfile
+import unittest
+
+from utils.journal import Journal
+
+
+class JournalTest(unittest.IsolatedAsyncioTestCase):
+    """A write cut by a crash does not break the next records."""
+
+    async def test_append_after_truncated_write(self):
+        """The cut record (inside a multi-byte character) is skipped, the next ones are read."""
+        filename = os.path.join(tempfile.mkdtemp(), "test.journal")
+        with open(filename, "wb") as file:
+            file.write(b'{"user": "a"}\n{"user": "\xd8')
+        journal = Journal(filename, list)
+        journal.append({"user": "b"})
+        await journal.flush()
+        self.assertEqual(journal.read(), [{"user": "a"}, {"user": "b"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
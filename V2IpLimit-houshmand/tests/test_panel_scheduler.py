@@ -0,0 +1,60 @@
+"""
+Tests of the panel request scheduler.
+"""
+
+import asyncio
+import unittest
+
+from utils.panel_scheduler import PanelScheduler, RequestPriority
+
+
+class SlotTest(unittest.IsolatedAsyncioTestCase):
+    """The requests waiting for a busy endpoint are served in priority order."""
+
+    async def test_busy_endpoint_serves_priority_first(self):
+        """Enforcement waiting behind reporting requests gets the next free slot."""
+        scheduler = PanelScheduler(rate=1000, burst=1000, endpoint_limits={"user": 1})
+        release = asyncio.Event()
+        served = []
+
+        async def request(name: str, priority: RequestPriority, hold: bool = False):
+            async with scheduler.slot("user", priority):
+                served.append(name)
+                if hold:
+                    await release.wait()
+
+        holder = asyncio.create_task(request("holder", RequestPriority.REPORTING, True))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.create_task(request(f"report{index}", RequestPriority.REPORTING))
+            for index in range(3)
+        ]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.create_task(request("enforce", RequestPriority.ENFORCEMENT)))
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        self.assertEqual(served, ["holder", "enforce", "report0", "report1", "report2"])
+
+    async def test_cancelled_waiter_frees_slot(self):
+        """A request cancelled while it waits does not keep the endpoint busy."""
+        scheduler = PanelScheduler(rate=1000, burst=1000, endpoint_limits={"user": 1})
+        release = asyncio.Event()
+
+        async def request(hold: bool = False):
+            async with scheduler.slot("user", RequestPriority.REPORTING):
+                if hold:
+                    await release.wait()
+
+        holder = asyncio.create_task(request(True))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(request())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        release.set()
+        await holder
+        await asyncio.wait_for(request(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Tests of the validation of the import files.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from utils.policy_import import PolicyChanges, read_policy_file
+
+
+class PolicyImportTest(unittest.TestCase):
+    """Invalid rows are reported instead of raising."""
+
+    def read_json(self, data) -> PolicyChanges:
+        """Write 'data' to a .json file and read it."""
+        path = os.path.join(tempfile.mkdtemp(), "import.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        return read_policy_file(path, "limits.json")
+
+    def test_invalid_limits_are_row_errors(self):
+        """Non-ASCII digits and a limit of 0 are invalid rows."""
+        changes = PolicyChanges()
+        changes.add(1, "user1", "²")
+        changes.add(2, "user2", "0")
+        changes.add(3, "user3", "٣")
+        changes.add(4, "user4", "3")
+        self.assertEqual(changes.error_count, 3)
+        self.assertEqual(changes.limits, {"user4": 3})
+
+    def test_json_with_wrong_types(self):
+        """A SPECIAL_LIMIT that is not an object fails with ValueError."""
+        with self.assertRaises(ValueError):
+            self.read_json({"SPECIAL_LIMIT": ["user1"]})
+        with self.assertRaises(ValueError):
+            self.read_json({"EXCEPT_USERS": {"user1": 1}})
+
+    def test_json_rows(self):
+        """The rows of a valid .json file are read."""
+        changes = self.read_json({"SPECIAL_LIMIT": {"user1": 2}, "EXCEPT_USERS": ["user2"]})
+        self.assertEqual(changes.error_count, 0)
+        self.assertEqual(changes.limits, {"user1": 2})
+        self.assertEqual(changes.add_except, ["user2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
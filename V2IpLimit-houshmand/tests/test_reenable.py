@@ -0,0 +1,116 @@
+"""
+Tests of the re-enable loop when a user is disabled again during its enable.
+"""
+
+import asyncio
+import os
+import time
+import unittest
+from unittest import mock
+
+from utils import enforcement, outbox, panel_api
+from utils.handel_dis_users import DISABLED_USERS, JOURNALS, REENABLE_HEAP, DisabledUsers
+from utils.panel_api import EnableState, enable_dis_user
+from utils.types import PanelType
+
+TIME_TO_ACTIVE = 600
+PANEL = PanelType("admin", "admin", "127.0.0.1:9")
+
+
+async def fake_config() -> dict:
+    """The config read by the re-enable loop."""
+    return {"TIME_TO_ACTIVE_USERS": TIME_TO_ACTIVE, "ENABLE_RATE": 5}
+
+
+class ReenableTest(unittest.IsolatedAsyncioTestCase):
+    """A disable during enable_users_bulk() must keep the user disabled."""
+
+    def setUp(self):
+        DISABLED_USERS.clear()
+        REENABLE_HEAP.clear()
+        JOURNALS.clear()
+        for filename in (".disable_users.journal", ".panel_outbox.journal"):
+            if os.path.exists(filename):
+                os.remove(filename)
+        patches = [
+            mock.patch.object(panel_api, "read_config", fake_config),
+            mock.patch.object(panel_api, "send_logs", mock.AsyncMock()),
+            mock.patch.object(outbox, "send_logs", mock.AsyncMock()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def run_reenable(self, enable_users_bulk) -> None:
+        """Run the re-enable loop until the fake bulk enable was called."""
+        called = asyncio.Event()
+
+        async def bulk(panel_data, usernames, concurrency):
+            states = await enable_users_bulk(panel_data, usernames, concurrency)
+            called.set()
+            return states
+
+        with mock.patch.object(panel_api, "enable_users_bulk", bulk):
+            task = asyncio.create_task(enable_dis_user(PANEL))
+            await asyncio.wait_for(called.wait(), 5)
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+    async def test_disable_confirmed_during_enable(self):
+        """The outbox confirms a new disable while the user is being enabled."""
+        dis_obj = DisabledUsers()
+        old_disabled_at = time.time() - TIME_TO_ACTIVE - 10
+        DISABLED_USERS["user1"] = old_disabled_at
+        dis_obj.rebuild_schedule()
+        panel_outbox = outbox.PanelOutbox()
+
+        async def enable_and_disable(_panel_data, usernames, _concurrency):
+            # the user is detected again and the panel confirms the disable
+            panel_outbox.submit("user1", "disabled")
+            with mock.patch.object(
+                outbox, "get_token", mock.AsyncMock(return_value=PANEL)
+            ), mock.patch.object(panel_outbox, "_apply", mock.AsyncMock(return_value=None)):
+                await panel_outbox.drain_once(PANEL)
+            return [EnableState(username, attempts=1, enabled=True) for username in usernames]
+
+        await self.run_reenable(enable_and_disable)
+        self.assertIn("user1", DISABLED_USERS)
+        self.assertGreater(DISABLED_USERS["user1"], old_disabled_at + TIME_TO_ACTIVE)
+        self.assertEqual(dis_obj.next_disabled_at(), DISABLED_USERS["user1"])
+
+    async def test_disable_requested_during_enable(self):
+        """A new disable still waiting in the outbox keeps the user disabled."""
+        old_disabled_at = time.time() - TIME_TO_ACTIVE - 10
+        DISABLED_USERS["user3"] = old_disabled_at
+        DisabledUsers().rebuild_schedule()
+        panel_outbox = outbox.PanelOutbox()  # its worker is not running
+
+        async def enable_and_detect(_panel_data, usernames, _concurrency):
+            with mock.patch.object(enforcement, "get_outbox", return_value=panel_outbox), \
+                    mock.patch.object(enforcement, "send_logs", mock.AsyncMock()):
+                result = await enforcement.disable_offenders({"user3": ["1.1.1.1"]}, 0.01)
+            self.assertEqual(result.timed_out, ["user3"])
+            return [EnableState(username, attempts=1, enabled=True) for username in usernames]
+
+        started = time.time()
+        await self.run_reenable(enable_and_detect)
+        self.assertIn("user3", DISABLED_USERS)
+        self.assertGreaterEqual(DISABLED_USERS["user3"], started)
+        self.assertEqual(DisabledUsers().next_disabled_at(), DISABLED_USERS["user3"])
+
+    async def test_enabled_user_is_removed(self):
+        """A user enabled without a new disable leaves the disabled users."""
+        DISABLED_USERS["user2"] = time.time() - TIME_TO_ACTIVE - 10
+        DisabledUsers().rebuild_schedule()
+
+        async def enable(_panel_data, usernames, _concurrency):
+            return [EnableState(username, attempts=1, enabled=True) for username in usernames]
+
+        await self.run_reenable(enable)
+        self.assertNotIn("user2", DISABLED_USERS)
+
+
+if __name__ == "__main__":
+    unittest.main()
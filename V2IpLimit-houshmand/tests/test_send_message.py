@@ -0,0 +1,33 @@
+"""
+Tests of the messages sent to the admins.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from telegram_bot import send_message
+from telegram_bot.send_message import MAX_CAPTION_LENGTH, send_to_chat
+
+
+class CaptionTest(unittest.IsolatedAsyncioTestCase):
+    """A long caption is cut into valid HTML."""
+
+    async def test_long_caption_is_cut_outside_tags(self):
+        """The tag open at the cut is closed and no tag is cut in half."""
+        path = os.path.join(tempfile.mkdtemp(), "report.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("username,ips\n")
+        caption = "<b>Usage report: " + "user1, " * 200 + "</b>"
+        bot = mock.AsyncMock()
+        with mock.patch.object(send_message, "application", mock.Mock(bot=bot)):
+            self.assertTrue(await send_to_chat(1, caption, document=path))
+        sent = bot.send_document.call_args.kwargs["caption"]
+        self.assertLessEqual(len(sent), MAX_CAPTION_LENGTH)
+        self.assertTrue(sent.endswith("</b>"))
+        self.assertEqual(sent.count("<b>"), sent.count("</b>"))
+
+
+if __name__ == "__main__":
+    unittest.main()
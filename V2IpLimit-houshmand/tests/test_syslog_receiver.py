@@ -0,0 +1,42 @@
+"""
+Tests of the TCP framing of the syslog receiver.
+"""
+
+import unittest
+
+from utils.syslog_receiver import split_tcp_frames, tcp_framing
+
+LINE = b"2024/01/01 10:00:00 1.2.3.4:5000 accepted tcp:example.com:443 email: user1"
+
+
+class TcpFramingTest(unittest.TestCase):
+    """The framing is chosen from the first frame of the connection."""
+
+    def test_octet_counting(self):
+        """A length followed by ' <' is octet-counted."""
+        message = b"<14>" + LINE
+        buffer = b"%d %s%d %s" % (len(message), message, len(message), message[:10])
+        octet_counting = tcp_framing(buffer)
+        self.assertTrue(octet_counting)
+        frames, rest = split_tcp_frames(buffer, octet_counting)
+        self.assertEqual(frames, [message])
+        self.assertEqual(rest, b"%d %s" % (len(message), message[:10]))
+
+    def test_lf_lines_starting_with_a_digit(self):
+        """LF-framed Xray lines start with the year and are not octet-counted."""
+        buffer = LINE + b"\n" + LINE + b"\n2024/01"
+        octet_counting = tcp_framing(buffer)
+        self.assertFalse(octet_counting)
+        frames, rest = split_tcp_frames(buffer, octet_counting)
+        self.assertEqual(frames, [LINE, LINE])
+        self.assertEqual(rest, b"2024/01")
+
+    def test_undecided_until_more_data(self):
+        """Only a length was received, the framing is not known yet."""
+        self.assertIsNone(tcp_framing(b"123"))
+        self.assertIsNone(tcp_framing(b"123 "))
+        self.assertFalse(tcp_framing(b"2024/"))
+
+
+if __name__ == "__main__":
+    unittest.main()
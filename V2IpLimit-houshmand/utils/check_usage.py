@@ -4,51 +4,57 @@ appears more than two times in the ACTIVE_USERS list.
 """
 
 import asyncio
+import time
 from collections import Counter
 
-from telegram_bot.send_message import send_logs
+from telegram_bot.send_message import send_document_logs, send_logs
+from utils.enforcement import start_enforcement
+from utils.latency import detection_trace
+from utils.limit_policy import get_policy
 from utils.logs import logger
-from utils.panel_api import disable_user
+from utils.metrics import LAST_CHECK, OFFENDERS_FOUND
 from utils.read_config import read_config
+from utils.report_file import write_report
 from utils.types import PanelType, UserType
+from utils.usage_report import (
+    USAGE_REPORT_HEADER,
+    USAGE_REPORT_STATE,
+    full_report_caption,
+    usage_report,
+    usage_rows,
+)
 
 ACTIVE_USERS: dict[str, UserType] | dict = {}
 
 
+def filter_active_ips(ips: list[str]) -> list[str]:
+    """
+    Keep the IPs seen more than two times (the others are just noise).
+
+    Args:
+        ips (list[str]): Every IP seen for a user, with duplicates.
+
+    Returns:
+        list[str]: The distinct IPs that count as active.
+    """
+    ip_counts = Counter(ips)
+    return list({ip for ip in ips if ip_counts[ip] > 2})
+
+
 async def check_ip_used() -> dict:
     """
     This function checks if a user (name and IP address)
     appears more than two times in the ACTIVE_USERS list.
+    It returns the active IPs of each user (the report is sent by check_users_usage).
     """
     all_users_log = {}
     for email in list(ACTIVE_USERS.keys()):
         data = ACTIVE_USERS[email]
-        ip_counts = Counter(data.ip)
-        data.ip = list({ip for ip in data.ip if ip_counts[ip] > 2})
+        data.ip = filter_active_ips(data.ip)
         all_users_log[email] = data.ip
-        logger.info(data)
+        logger.info(data, extra={"user": email})
     total_ips = sum(len(ips) for ips in all_users_log.values())
-    all_users_log = dict(
-        sorted(
-            all_users_log.items(),
-            key=lambda x: len(x[1]),
-            reverse=True,
-        )
-    )
-    messages = [
-        f"<code>{email}</code> with <code>{len(ips)}</code> active ip  \n- "
-        + "\n- ".join(ips)
-        for email, ips in all_users_log.items()
-        if ips
-    ]
     logger.info("Number of all active ips: %s", str(total_ips))
-    messages.append(f"---------\nCount Of All Active IPs: <b>{total_ips}</b>")
-    messages.append("<code>github.com/houshmand-2005/V2IpLimit/</code>")
-    shorter_messages = [
-        "\n".join(messages[i : i + 100]) for i in range(0, len(messages), 100)
-    ]
-    for message in shorter_messages:
-        await send_logs(message)
     return all_users_log
 
 
@@ -58,25 +64,48 @@ async def check_users_usage(panel_data: PanelType):
     """
     config_data = await read_config()
     all_users_log = await check_ip_used()
-    except_users = config_data.get("EXCEPT_USERS", [])
-    special_limit = config_data.get("SPECIAL_LIMIT", {})
-    limit_number = config_data["GENERAL_LIMIT"]
+    policy = get_policy()
+    trace_sample = float(config_data.get("LATENCY_TRACE_SAMPLE", 0.1))
+    offenders = {}
+    traces = {}
     for user_name, user_ip in all_users_log.items():
-        if user_name not in except_users:
-            user_limit_number = int(special_limit.get(user_name, limit_number))
+        user_limit_number = policy.limit_of(user_name)
+        if user_limit_number is not None:
             if len(set(user_ip)) > user_limit_number:
                 message = (
                     f"User {user_name} has {str(len(set(user_ip)))}"
                     + f" active ips. {str(set(user_ip))}"
                 )
-                logger.warning(message)
-                await send_logs(str("<b>Warning: </b>" + message))
-                try:
-                    await disable_user(panel_data, UserType(name=user_name, ip=[]))
-                except ValueError as error:
-                    print(error)
+                logger.warning(message, extra={"user": user_name})
+                offenders[user_name] = list(set(user_ip))
+                if user_name in ACTIVE_USERS:
+                    trace = detection_trace(
+                        ACTIVE_USERS[user_name], user_ip, user_limit_number, trace_sample
+                    )
+                    if trace is not None:
+                        traces[user_name] = trace
+    OFFENDERS_FOUND.inc(len(offenders))
+    start_enforcement(panel_data, offenders, config_data, traces)
+    summary, full_due = usage_report(
+        all_users_log, set(offenders), float(config_data.get("FULL_REPORT_INTERVAL", 21600))
+    )
+    await send_logs(summary)
+    if full_due:
+        await send_full_report()
     ACTIVE_USERS.clear()
     all_users_log.clear()
+    LAST_CHECK.set(time.time())
+
+
+async def send_full_report() -> None:
+    """Send the full usage report of the last interval as one compressed CSV document."""
+    latest = USAGE_REPORT_STATE["latest"]
+    try:
+        path = await write_report("usage", USAGE_REPORT_HEADER, usage_rows(latest))
+    except OSError as error:
+        logger.error("Failed to write the usage report: %s", error)
+        return
+    await send_document_logs(path, full_report_caption(latest))
 
 
 async def run_check_users_usage(panel_data: PanelType) -> None:
@@ -0,0 +1,182 @@
+"""
+This module keeps config.json in memory.
+Readers get the cached config without touching the file system,
+changes go through CONFIG_STORE.update(): they are serialized with a lock,
+written to a temp file, fsynced and renamed over config.json off the event
+loop, then pushed to the subscribers.
+"""
+
+import asyncio
+import copy
+import json
+import os
+import stat
+import sys
+import tempfile
+from collections.abc import Callable
+from typing import Any
+
+from utils.logs import logger
+
+CONFIG_FILE = "config.json"
+
+
+class ConfigStore:
+    """
+    The in-memory config.
+
+    Args:
+        filename (str): The config file.
+    """
+
+    def __init__(self, filename: str = CONFIG_FILE):
+        self.filename = filename
+        self.data: dict | None = None
+        self.mtime = 0.0
+        self._lock: tuple | None = None
+        self._subscribers: list[Callable[[dict], Any]] = []
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+        return self._lock[1]
+
+    def _read(self) -> dict:
+        with open(self.filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "BOT_TOKEN" not in data:
+            raise ValueError("BOT_TOKEN is not set in the config.json file.")
+        if "ADMINS" not in data:
+            raise ValueError("ADMINS is not set in the config.json file.")
+        return data
+
+    def load(self) -> dict:
+        """
+        Read the config file the first time, exit if it is missing or invalid.
+
+        Returns:
+            dict: The config.
+        """
+        if self.data is not None:
+            return self.data
+        if not os.path.exists(self.filename):
+            print("Config file not found.")
+            sys.exit()
+        try:
+            self.mtime = os.path.getmtime(self.filename)
+            self.data = self._read()
+        except json.JSONDecodeError as error:
+            print("Error decoding the config.json file. Please check its syntax.", error)
+            sys.exit()
+        except ValueError as error:
+            print(error)
+            sys.exit()
+        return self.data
+
+    def get(self) -> dict:
+        """
+        Returns the cached config (do not change it, use update()).
+
+        Returns:
+            dict: The config.
+        """
+        return self.data if self.data is not None else self.load()
+
+    def subscribe(self, callback: Callable[[dict], Any]) -> None:
+        """
+        Call 'callback' with the new config after every change.
+        A coroutine function is run as a task, a callback is only added once.
+
+        Args:
+            callback (Callable[[dict], Any]): The function to call.
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def _notify(self) -> None:
+        for callback in self._subscribers:
+            try:
+                result = callback(self.data)
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Config subscriber %s failed: %s", callback, error)
+
+    def _write(self, data: dict) -> float:
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp_name = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp() creates the file with mode 0600, keep the mode of config.json
+            try:
+                mode = stat.S_IMODE(os.stat(self.filename).st_mode)
+            except FileNotFoundError:
+                mode = 0o644  # the usual mode of a new file
+            os.chmod(temp_name, mode)
+            os.replace(temp_name, self.filename)
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+        return os.path.getmtime(self.filename)
+
+    async def update(self, mutate: Callable[[dict], Any]) -> Any:
+        """
+        Change the config and save it.
+        'mutate' gets a copy of the config and changes it in place,
+        nothing is written if it did not change anything.
+
+        Args:
+            mutate (Callable[[dict], Any]): The change.
+
+        Returns:
+            Any: What 'mutate' returned.
+        """
+        async with self._get_lock():
+            current = self.get()
+            data = copy.deepcopy(current)
+            result = mutate(data)
+            if data != current:
+                self.mtime = await asyncio.to_thread(self._write, data)
+                self.data = data
+                self._notify()
+            return result
+
+    async def reload(self) -> bool:
+        """
+        Read the file again if it was changed by hand.
+        An invalid file is logged and the cached config is kept.
+
+        Returns:
+            bool: True if the config changed.
+        """
+        async with self._get_lock():
+            try:
+                mtime = await asyncio.to_thread(os.path.getmtime, self.filename)
+                if mtime == self.mtime:
+                    return False
+                self.mtime = mtime  # an invalid file is only reported once
+                data = await asyncio.to_thread(self._read)
+            except (OSError, ValueError) as error:  # JSONDecodeError is a ValueError
+                logger.error("Failed to reload %s: %s", self.filename, error)
+                return False
+            if data == self.data:
+                return False
+            self.data = data
+            logger.info("Reloaded %s", self.filename)
+            self._notify()
+            return True
+
+
+CONFIG_STORE = ConfigStore()
+
+
+async def run_config_watcher() -> None:
+    """Pick up changes made to config.json by hand (every 'CONFIG_RELOAD_INTERVAL' seconds)."""
+    while True:
+        await asyncio.sleep(int(CONFIG_STORE.get().get("CONFIG_RELOAD_INTERVAL", 10)))
+        await CONFIG_STORE.reload()
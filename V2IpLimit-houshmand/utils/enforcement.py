@@ -0,0 +1,161 @@
+"""
+This module disables the users that are over their limit.
+The disable actions go through the panel outbox, so they are
+kept and retried until the panel confirms them.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+
+from telegram_bot.send_message import send_logs
+from utils.handel_dis_users import DisabledUsers
+from utils.latency import start_trace
+from utils.logs import logger
+from utils.outbox import get_outbox, start_outbox
+from utils.types import PanelType, UserStatus
+from utils.user_state import USER_STATES
+
+ENFORCEMENT_TASKS: set[asyncio.Task] = set()
+IN_FLIGHT_USERS: set[str] = set()
+
+
+@dataclass
+class EnforcementResult:
+    """
+    The result of one enforcement round.
+
+    Attributes:
+        offenders (dict[str, list[str]]): The users over the limit and their IPs.
+        disabled (list[str]): Users disabled on the panel.
+        failed (dict[str, str]): Users that could not be disabled and the error.
+        timed_out (list[str]): Users not confirmed in time (they stay in the outbox).
+    """
+
+    offenders: dict[str, list[str]]
+    disabled: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    timed_out: list[str] = field(default_factory=list)
+
+    def summary(self) -> list[str]:
+        """
+        Build the notification of this round.
+
+        Returns:
+            list[str]: The messages to send (at most 100 users per message).
+        """
+        lines = [
+            f"<code>{user_name}</code> with <code>{len(ips)}</code> active ips"
+            + (" (failed)" if user_name in self.failed else "")
+            + (" (queued)" if user_name in self.timed_out else "")
+            for user_name, ips in self.offenders.items()
+        ]
+        header = (
+            f"<b>Warning: </b>{len(self.offenders)} users over the limit. "
+            + f"Disabled: <b>{len(self.disabled)}</b>"
+        )
+        if self.failed:
+            header += f" Failed: <b>{len(self.failed)}</b>"
+        if self.timed_out:
+            header += f" Queued: <b>{len(self.timed_out)}</b>"
+        lines.insert(0, header)
+        return ["\n".join(lines[i : i + 100]) for i in range(0, len(lines), 100)]
+
+
+async def disable_offenders(
+    offenders: dict[str, list[str]],
+    timeout: float = 120,
+    traces: dict[str, dict] | None = None,
+) -> EnforcementResult:
+    """
+    Queue the given users in the panel outbox and send one summary notification
+    once the panel confirmed them (or after 'timeout' seconds).
+    Users the user-state index knows as disabled are sent too (they are active
+    in the logs), the outbox reads their status first to skip a needless write.
+
+    Args:
+        offenders (dict[str, list[str]]): The users to disable and their IPs.
+        timeout (float): Seconds to wait for the panel before the summary,
+            users not confirmed by then are still disabled later.
+        traces (dict[str, dict] | None): The latency traces of the offenders,
+            started for the users sent to the outbox.
+
+    Returns:
+        EnforcementResult: What happened to each user.
+    """
+    result = EnforcementResult(offenders=offenders)
+    outbox = get_outbox()
+    dis_obj = DisabledUsers()
+    waiters = {}
+    for user_name in offenders:
+        if traces and user_name in traces:
+            start_trace(traces[user_name])
+        dis_obj.mark_disable(user_name)  # a running re-enable keeps the user
+        # the index can be older than an enable made in the panel, and the user
+        # is active in this interval: only ask the panel first instead of skipping
+        check_first = USER_STATES.get(user_name) is UserStatus.DISABLE
+        waiters[outbox.submit(user_name, "disabled", check_first)] = user_name
+    done, pending = set(), set()
+    try:
+        if waiters:
+            done, pending = await asyncio.wait(waiters, timeout=timeout)
+    finally:
+        IN_FLIGHT_USERS.difference_update(offenders)
+    for waiter in done:
+        user_name = waiters[waiter]
+        error = waiter.result()
+        if error is None:
+            result.disabled.append(user_name)
+        else:
+            result.failed[user_name] = error
+    for waiter in pending:
+        result.timed_out.append(waiters[waiter])
+        logger.error(
+            "Disable user %s not confirmed after %ss, it stays queued",
+            waiters[waiter],
+            timeout,
+            extra={"user": waiters[waiter]},
+        )
+    for message in result.summary():
+        await send_logs(message)
+    return result
+
+
+def start_enforcement(
+    panel_data: PanelType,
+    offenders: dict[str, list[str]],
+    config_data: dict,
+    traces: dict[str, dict] | None = None,
+) -> asyncio.Task | None:
+    """
+    Start disabling the offenders in the background so the caller never
+    waits for the panel. Users still being disabled by an earlier round are skipped.
+
+    Args:
+        panel_data (PanelType): The credentials for the panel (for the outbox worker).
+        offenders (dict[str, list[str]]): The users to disable and their IPs.
+        config_data (dict): The config, 'DISABLE_CONCURRENCY' (default 10) and
+            'DISABLE_TIMEOUT' (default 120 seconds) are used.
+        traces (dict[str, dict] | None): The latency traces of the offenders
+            (from utils.latency.detection_trace()).
+
+    Returns:
+        asyncio.Task | None: The enforcement task, None if there is nothing to do.
+    """
+    offenders = {
+        user_name: ips
+        for user_name, ips in offenders.items()
+        if user_name not in IN_FLIGHT_USERS
+    }
+    if not offenders:
+        return None
+    start_outbox(panel_data, int(config_data.get("DISABLE_CONCURRENCY", 10)))
+    IN_FLIGHT_USERS.update(offenders)
+    task = asyncio.create_task(
+        disable_offenders(
+            offenders, float(config_data.get("DISABLE_TIMEOUT", 120)), traces
+        ),
+        name="enforcement",
+    )
+    ENFORCEMENT_TASKS.add(task)
+    task.add_done_callback(ENFORCEMENT_TASKS.discard)
+    return task
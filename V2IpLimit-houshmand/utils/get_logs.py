@@ -6,6 +6,7 @@ import asyncio
 import random
 import ssl
 import sys
+import time
 from asyncio import Task
 from ssl import SSLError
 
@@ -19,8 +20,11 @@ except ImportError:
     )
     sys.exit()
 from telegram_bot.send_message import send_logs
-from utils.logs import logger  # pylint: disable=ungrouped-imports
+from utils.log_capture import record_frame  # pylint: disable=ungrouped-imports
+from utils.logs import logger, set_log_node
+from utils.node_health import node_stream
 from utils.panel_api import get_nodes, get_token
+from utils.panel_scheduler import RequestPriority, set_panel_priority
 from utils.parse_logs import parse_logs
 from utils.types import NodeType, PanelType
 
@@ -42,8 +46,12 @@ async def get_panel_logs(panel_data: PanelType) -> None:
     Raises:
         ValueError: If there is an issue with getting the panel token.
     """
+    set_panel_priority(RequestPriority.NODES)
+    set_log_node("Main panel")
+    stream = node_stream("Main panel")
     for scheme in ["wss", "ws"]:
         while True:
+            stream.set_state("connecting")
             interval = random.choice(("0.9", "1.3", "1.5", "1.7"))
             get_panel_token = await get_token(panel_data)
             if isinstance(get_panel_token, ValueError):
@@ -55,12 +63,16 @@ async def get_panel_logs(panel_data: PanelType) -> None:
                     + f"/logs?interval={interval}&token={token}",
                     ssl=ssl_context if scheme == "wss" else None,
                 ) as ws:
+                    stream.set_state("connected")
                     log_message = "Establishing connection for the main panel"
                     await send_logs(log_message)
                     logger.info(log_message)
                     while True:
-                        new_log = await ws.recv()
-                        await parse_logs(str(new_log))
+                        new_log = str(await ws.recv())
+                        received = time.time()
+                        stream.frame(new_log.count("\n") + 1, received)
+                        record_frame("Main panel", new_log)
+                        await parse_logs(new_log, node="Main panel", received=received)
 
             except SSLError:
                 break
@@ -68,6 +80,7 @@ async def get_panel_logs(panel_data: PanelType) -> None:
                 log_message = (
                     f"[Main panel] Failed to connect {error} trying 20 second later!"
                 )
+                stream.set_state("backoff", 20, str(error))
                 await send_logs(log_message)
                 logger.error(log_message)
                 await asyncio.sleep(20)
@@ -85,8 +98,12 @@ async def get_nodes_logs(panel_data: PanelType, node: NodeType) -> None:
     Raises:
         ValueError: If there is an issue with getting the panel token.
     """
+    set_panel_priority(RequestPriority.NODES)
+    set_log_node(node.node_name)
+    stream = node_stream(node.node_name)
     for scheme in ["wss", "ws"]:
         while True:
+            stream.set_state("connecting")
             interval = random.choice(("0.9", "1.3", "1.5", "1.7"))
             get_panel_token = await get_token(panel_data)
             if isinstance(get_panel_token, ValueError):
@@ -98,6 +115,7 @@ async def get_nodes_logs(panel_data: PanelType, node: NodeType) -> None:
                     url,
                     ssl=ssl_context if scheme == "wss" else None,
                 ) as ws:
+                    stream.set_state("connected")
                     log_message = (
                         "Establishing connection for"
                         + f" node number {node.node_id} name: {node.node_name}"
@@ -105,8 +123,11 @@ async def get_nodes_logs(panel_data: PanelType, node: NodeType) -> None:
                     await send_logs(log_message)
                     logger.info(log_message)
                     while True:
-                        new_log = await ws.recv()
-                        await parse_logs(str(new_log))
+                        new_log = str(await ws.recv())
+                        received = time.time()
+                        stream.frame(new_log.count("\n") + 1, received)
+                        record_frame(node.node_name, new_log)
+                        await parse_logs(new_log, node=node.node_name, received=received)
             except SSLError:
                 break
             except Exception as error:  # pylint: disable=broad-except
@@ -116,6 +137,7 @@ async def get_nodes_logs(panel_data: PanelType, node: NodeType) -> None:
                     + f" [node ip: {node.node_ip}] [node message: {node.message}]"
                     + f" [Error Message: {error}] trying to connect 10 second later!"
                 )
+                stream.set_state("backoff", 10, str(error))
                 await send_logs(log_message)
                 logger.error(log_message)
                 await asyncio.sleep(10)
@@ -130,6 +152,7 @@ async def handle_cancel(panel_data: PanelType, tasks: list[Task]) -> None:
         panel_data (PanelType): The credentials for the panel.
         tasks (list[Task]): The list of tasks to be cancelled.
     """
+    set_panel_priority(RequestPriority.NODES)
     deactivate_nodes = set()
     while True:
         nodes_list = await get_nodes(panel_data)
@@ -146,7 +169,7 @@ async def handle_cancel(panel_data: PanelType, tasks: list[Task]) -> None:
                 task.cancel()
                 tasks.remove(task)
                 if task in task_node_mapping:
-                    task_node_mapping.pop(task)
+                    node_stream(task_node_mapping.pop(task).node_name).set_state("stopped")
         await asyncio.sleep(20)
 
 
@@ -174,6 +197,7 @@ async def handle_cancel_all(tasks: list[Task], panel_data: PanelType) -> None:
         tasks (list[Task]): The list of tasks to be cancelled.
     """
     # pylint: disable=duplicate-code
+    set_panel_priority(RequestPriority.NODES)
     async with asyncio.TaskGroup() as tg:
         while True:
             await asyncio.sleep(8192)  # =~ 2 hours and 27 minutes
@@ -201,6 +225,7 @@ async def check_and_add_new_nodes(panel_data: PanelType, tg: asyncio.TaskGroup)
         panel_data (PanelType): The credentials for the panel.
         tg (asyncio.TaskGroup): The TaskGroup to which the new task will be added.
     """
+    set_panel_priority(RequestPriority.NODES)
     while True:
         all_nodes = await get_nodes(panel_data)
         if all_nodes and not isinstance(all_nodes, ValueError):
@@ -1,69 +1,273 @@
 """
 This module contains the DisabledUsers class
 which provides methods for managing disabled users
+and the schedule used to enable them again.
+Changes are appended to a journal file instead of rewriting the whole list.
 """
 
+import asyncio
+import heapq
 import json
 import os
+import time
 
+from utils.journal import Journal
 from utils.logs import logger
 
-DISABLED_USERS = set()
+DISABLED_USERS: dict[str, float] = {}  # username -> time the user was disabled
+REENABLE_HEAP: list[tuple[float, str]] = []
+# username -> disables requested or confirmed, compared by the re-enable loop
+# to find the users disabled again while they were being enabled
+DISABLE_MARKS: dict[str, int] = {}
+JOURNALS: dict[str, Journal] = {}
+_WAKEUP: list = [None, None]  # [event loop, asyncio.Event]
+
+
+def _wakeup_event() -> asyncio.Event:
+    """Return the event that wakes up the re-enable loop (one per event loop)."""
+    loop = asyncio.get_running_loop()
+    if _WAKEUP[0] is not loop:
+        _WAKEUP[0] = loop
+        _WAKEUP[1] = asyncio.Event()
+    return _WAKEUP[1]
 
 
 class DisabledUsers:
     """
     A class used to represent the Disabled Users.
+    Every instance shares the same DISABLED_USERS dict and journal,
+    the journal file is only read by the first instance.
+
+    Journal records:
+        {"op": "disable", "user": username, "at": time}
+        {"op": "enable", "user": username}
     """
 
-    def __init__(self, filename=".disable_users.json"):
+    def __init__(
+        self,
+        filename=".disable_users.journal",
+        legacy_filename=".disable_users.json",
+    ):
         self.filename = filename
-        self.disabled_users = self.load_disabled_users()
+        self.legacy_filename = legacy_filename
+        self.disabled_users = DISABLED_USERS
+        if filename in JOURNALS:
+            self.journal = JOURNALS[filename]
+        else:
+            self.journal = JOURNALS[filename] = Journal(filename, self.snapshot)
+            for username, disabled_at in self.load_disabled_users().items():
+                self._schedule(username, disabled_at)
+
+    def snapshot(self) -> list[dict]:
+        """
+        Returns the journal records of the current disabled users (used to compact it).
+        """
+        return [
+            {"op": "disable", "user": username, "at": disabled_at}
+            for username, disabled_at in DISABLED_USERS.items()
+        ]
 
-    def load_disabled_users(self):
+    def load_disabled_users(self) -> dict[str, float]:
         """
-        Loads the disabled users from the JSON file.
+        Loads the disabled users by replaying the journal.
+        Users of the old JSON file are imported once (the file is renamed to .bak),
+        users saved without a disable time (older versions) are due right away.
+        Broken records are logged and skipped, they never stop the program.
         """
+        disabled_users = self._load_legacy_file()
+        try:
+            records = self.journal.read()
+        except OSError as error:
+            logger.error("Failed to read %s: %s", self.filename, error)
+            return disabled_users
+        for record in records:
+            try:
+                username = record.get("user")
+                if record.get("op") == "disable" and username:
+                    disabled_users[str(username)] = float(record.get("at", 0))
+                elif record.get("op") == "enable":
+                    disabled_users.pop(username, None)
+            except (AttributeError, TypeError, ValueError) as error:
+                logger.error("Skip broken record %s of %s: %s", record, self.filename, error)
+        return disabled_users
+
+    def _load_legacy_file(self) -> dict[str, float]:
+        if not os.path.exists(self.legacy_filename):
+            return {}
         try:
-            if os.path.exists(self.filename):
-                with open(self.filename, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-                    return set(data.get("disable_user", []))
-            else:
-                return set()
-        except Exception as error:  # pylint: disable=broad-except
-            logger.error(error)
-            print("Check the error or delete the file :", error)
-            print("Delete the .disable_users.json file? (y/n)")
-            if input().lower() == "y":
-                print("Deleting ...")
-                logger.info("remove .disable_users.json file")
-                os.remove(".disable_users.json")
-            return set()
+            with open(self.legacy_filename, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            disabled_at = data.get("disabled_at", {})
+            disabled_users = {
+                username: float(disabled_at.get(username, 0))
+                for username in data.get("disable_user", [])
+            }
+        except (OSError, AttributeError, TypeError, ValueError) as error:
+            logger.error("Failed to import %s: %s", self.legacy_filename, error)
+            return {}
+        with open(self.filename, "a", encoding="utf-8") as file:
+            for username, user_disabled_at in disabled_users.items():
+                record = {"op": "disable", "user": username, "at": user_disabled_at}
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.legacy_filename, self.legacy_filename + ".bak")
+        logger.info(
+            "Imported %s disabled users from %s", len(disabled_users), self.legacy_filename
+        )
+        return disabled_users
+
+    def _schedule(self, username: str, disabled_at: float) -> None:
+        if DISABLED_USERS.get(username) == disabled_at:
+            return
+        DISABLED_USERS[username] = disabled_at
+        heapq.heappush(REENABLE_HEAP, (disabled_at, username))
+        if _WAKEUP[1] is not None:
+            _WAKEUP[1].set()
 
     async def save_disabled_users(self):
         """
-        Saves the disabled users to the JSON file.
+        Writes the pending journal records to disk now.
         """
-        with open(self.filename, "w", encoding="utf-8") as file:
-            json.dump({"disable_user": list(self.disabled_users)}, file)
+        await self.journal.flush()
 
     async def add_user(self, username: str):
         """
-        Adds a user to the set of disabled users
-        and saves the updated set to the JSON file.
+        Adds a user to the disabled users with the current time.
+        The change is appended to the journal (written within a second).
         """
-        DISABLED_USERS.add(username)
-        self.disabled_users.add(username)
-        await self.save_disabled_users()
+        disabled_at = time.time()
+        self.mark_disable(username)
+        self._schedule(username, disabled_at)
+        self.journal.append({"op": "disable", "user": username, "at": disabled_at})
+
+    def mark_disable(self, username: str) -> None:
+        """
+        Record that a disable of the user was requested (call it before the
+        disable is sent), a re-enable that is running for the user keeps it.
+        """
+        DISABLE_MARKS[username] = DISABLE_MARKS.get(username, 0) + 1
+
+    def disabled_times(self, usernames: list[str]) -> dict[str, tuple[float, int]]:
+        """
+        Returns the current disable time and disable mark of the users
+        (to pass to remove_users() and postpone_users()).
+        """
+        return {
+            username: (DISABLED_USERS[username], DISABLE_MARKS.get(username, 0))
+            for username in usernames
+            if username in DISABLED_USERS
+        }
+
+    async def _disabled_again(
+        self, username: str, scheduled: dict[str, tuple[float, int]]
+    ) -> bool:
+        """
+        Returns whether a user was disabled again since disabled_times(),
+        a user only asked to be disabled again is scheduled from now.
+        """
+        disabled_at = DISABLED_USERS.get(username)
+        current = (disabled_at, DISABLE_MARKS.get(username, 0))
+        if disabled_at is None or current == scheduled.get(username):
+            return False
+        if disabled_at == scheduled.get(username, (None,))[0]:
+            await self.add_user(username)  # the disable is not confirmed yet
+        return True
+
+    async def remove_users(
+        self,
+        usernames: list[str],
+        scheduled: dict[str, tuple[float, int]] | None = None,
+    ):
+        """
+        Removes enabled users and appends the change to the journal.
+        With 'scheduled' (from disabled_times()) a user disabled again
+        since then is kept.
+        """
+        for username in usernames:
+            if scheduled is not None and await self._disabled_again(username, scheduled):
+                continue
+            DISABLE_MARKS.pop(username, None)
+            if DISABLED_USERS.pop(username, None) is not None:
+                self.journal.append({"op": "enable", "user": username})
+
+    async def postpone_users(
+        self,
+        usernames: list[str],
+        disabled_at: float,
+        scheduled: dict[str, tuple[float, int]] | None = None,
+    ):
+        """
+        Moves users that could not be enabled to a new disable time,
+        so they are scheduled again.
+        With 'scheduled' (from disabled_times()) a user disabled again
+        since then keeps its new disable time.
+        """
+        for username in usernames:
+            if scheduled is not None and await self._disabled_again(username, scheduled):
+                continue
+            if username in DISABLED_USERS:
+                self._schedule(username, disabled_at)
+                self.journal.append(
+                    {"op": "disable", "user": username, "at": disabled_at}
+                )
+
+    def rebuild_schedule(self) -> None:
+        """
+        Rebuilds the re-enable schedule from DISABLED_USERS
+        (users taken by a re-enable loop that was cancelled are scheduled again).
+        """
+        REENABLE_HEAP[:] = [
+            (disabled_at, username) for username, disabled_at in DISABLED_USERS.items()
+        ]
+        heapq.heapify(REENABLE_HEAP)
+
+    def pop_due_users(self, disabled_before: float, limit: int) -> list[str]:
+        """
+        Returns up to 'limit' users disabled before 'disabled_before', oldest first.
+        The users stay in DISABLED_USERS until remove_users() is called.
+        """
+        due = []
+        while REENABLE_HEAP and len(due) < limit:
+            disabled_at, username = REENABLE_HEAP[0]
+            if DISABLED_USERS.get(username) != disabled_at:
+                heapq.heappop(REENABLE_HEAP)  # enabled or rescheduled since
+                continue
+            if disabled_at > disabled_before:
+                break
+            heapq.heappop(REENABLE_HEAP)
+            due.append(username)
+        return due
+
+    def next_disabled_at(self) -> float | None:
+        """
+        Returns the disable time of the next user to enable, None if there is no user.
+        """
+        while REENABLE_HEAP:
+            disabled_at, username = REENABLE_HEAP[0]
+            if DISABLED_USERS.get(username) == disabled_at:
+                return disabled_at
+            heapq.heappop(REENABLE_HEAP)
+        return None
+
+    async def wait_for_change(self, timeout: float):
+        """
+        Waits until a user is added or rescheduled, or 'timeout' seconds.
+        """
+        event = _wakeup_event()
+        try:
+            await asyncio.wait_for(event.wait(), max(timeout, 0))
+        except TimeoutError:
+            pass
+        event.clear()
 
     async def read_and_clear_users(self):
         """
         Returns a list of disabled users, clears the set of disabled users
-        and saves the empty set to the JSON file.
+        and rewrites the journal as an empty file.
         """
         disabled_users = list(self.disabled_users)
         self.disabled_users.clear()
-        DISABLED_USERS.clear()
-        await self.save_disabled_users()
+        REENABLE_HEAP.clear()
+        await self.journal.compact()
         return set(disabled_users)
@@ -0,0 +1,140 @@
+"""
+This module contains an append-only JSON-lines journal.
+Appends are buffered in memory and written with one fsync per batch
+from a worker thread, the file is compacted from a snapshot when it grows.
+"""
+
+import asyncio
+import json
+import os
+from collections.abc import Callable
+
+from utils.logs import logger
+
+
+class Journal:  # pylint: disable=too-many-instance-attributes
+    """
+    An append-only file of JSON records.
+
+    Args:
+        filename (str): The path of the journal file.
+        snapshot (Callable[[], list[dict]]): Returns the records that describe
+            the current state, used to compact the file.
+        flush_interval (float): Seconds between an append and the write to disk.
+        compact_ratio (int): The file is compacted when it has more than
+            'compact_ratio' times the records of the snapshot (and at least 1000).
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        snapshot: Callable[[], list[dict]],
+        flush_interval: float = 1.0,
+        compact_ratio: int = 4,
+    ):
+        self.filename = filename
+        self.snapshot = snapshot
+        self.flush_interval = flush_interval
+        self.compact_ratio = compact_ratio
+        self.lines = 0
+        self._buffer: list[str] = []
+        self._file = None
+        self._lock: tuple[asyncio.AbstractEventLoop, asyncio.Lock] | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    def read(self) -> list[dict]:
+        """
+        Read every record of the journal.
+        Broken lines (for example a write cut by a crash) are logged and skipped.
+
+        Returns:
+            list[dict]: The records, oldest first.
+        """
+        records = []
+        if not os.path.exists(self.filename):
+            return records
+        with open(self.filename, "r", encoding="utf-8", errors="replace") as file:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.error("Skip broken line %s of %s", number, self.filename)
+        self.lines = len(records)
+        return records
+
+    def append(self, record: dict) -> None:
+        """
+        Add a record, it is written to disk within 'flush_interval' seconds.
+
+        Args:
+            record (dict): The record to add.
+        """
+        self._buffer.append(json.dumps(record))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._delayed_flush()
+            )
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    def _write(self, lines: list[str]) -> None:
+        if self._file is None:
+            truncated = False
+            if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+                with open(self.filename, "rb") as file:
+                    file.seek(-1, os.SEEK_END)
+                    truncated = file.read(1) != b"\n"  # the last write was cut by a crash
+            self._file = open(  # pylint: disable=consider-using-with
+                self.filename, "a", encoding="utf-8"
+            )
+            if truncated:
+                self._file.write("\n")
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rewrite(self, lines: list[str]) -> None:
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as file:
+            if lines:
+                file.write("\n".join(lines) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(temp_filename, self.filename)
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+        return self._lock[1]
+
+    async def flush(self) -> None:
+        """Write the buffered records (or compact the file) off the event loop."""
+        async with self._get_lock():
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            if self.lines + len(lines) > 1000:
+                snapshot = [json.dumps(record) for record in self.snapshot()]
+                if self.lines + len(lines) > self.compact_ratio * len(snapshot):
+                    await asyncio.to_thread(self._rewrite, snapshot)
+                    self.lines = len(snapshot)
+                    logger.info("Compacted %s to %s records", self.filename, self.lines)
+                    return
+            await asyncio.to_thread(self._write, lines)
+            self.lines += len(lines)
+
+    async def compact(self) -> None:
+        """Rewrite the file from the snapshot (atomic: temp file, fsync, rename)."""
+        async with self._get_lock():
+            self._buffer = []
+            snapshot = [json.dumps(record) for record in self.snapshot()]
+            await asyncio.to_thread(self._rewrite, snapshot)
+            self.lines = len(snapshot)
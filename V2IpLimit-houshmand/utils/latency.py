@@ -0,0 +1,221 @@
+"""
+This module measures the time from a log line to the disable of its user.
+
+Every log frame gets one stamp, shared by the observations it contains:
+    [Xray time of its first accepted line, receive time, parse end time, node]
+Users keep the stamp of the first frame that showed each of their IPs, when
+the disable of a user over the limit is handed to the outbox the stamp of
+the IP that went over the limit starts the trace, and the panel confirmation
+of the disable ends it.
+
+Stages (v2iplimit_detection_stage_seconds{stage,node}):
+    receive   Xray time -> received (needs the node clock and time zone to match ours)
+    parse     received -> parsed (the syslog queue included)
+    detect    parsed -> found over the limit by the usage check
+    enforce   found -> disable confirmed by the panel
+    total     Xray time (or received) -> disable confirmed
+A part of the traces ('LATENCY_TRACE_SAMPLE', default 0.1) is kept for /latency.
+"""
+
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+from utils.metrics import METRICS
+from utils.types import UserType
+
+STAGES = ("receive", "parse", "detect", "enforce", "total")
+MAX_CLOCK_SKEW = 86400  # Xray times further away are not used
+MAX_PENDING_TRACES = 10_000
+DETECTION_SECONDS = METRICS.histogram(
+    "v2iplimit_detection_stage_seconds",
+    "Time spent in each stage from a log line to the disable of its user",
+    ("stage", "node"),
+    (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0),
+)
+LATENCY_METRICS = {"clock_skew": 0, "traces": 0}
+PENDING_TRACES: dict[str, dict] = {}  # username -> trace waiting for the panel
+SAMPLED_TRACES: deque = deque(maxlen=50)
+
+
+def xray_time(line: str) -> float | None:
+    """
+    Returns the time at the start of an Xray log line
+    ("2024/06/01 12:34:56" or "2024/06/01 12:34:56.123456", local time).
+
+    Args:
+        line (str): The log line.
+
+    Returns:
+        float | None: The Unix time, None if the line does not start with a time.
+    """
+    try:
+        stamp = datetime.strptime(line[:19], "%Y/%m/%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+    if line[19:20] == ".":
+        fraction = line[20:27].split(" ", 1)[0]
+        if fraction.isdigit():
+            stamp += int(fraction) / 10 ** len(fraction)
+    return stamp
+
+
+def new_stamp(line: str, received: float, node: str) -> list:
+    """
+    Returns the stamp of a frame from its first accepted line.
+
+    Args:
+        line (str): The first accepted line.
+        received (float): The time the frame was received.
+        node (str): The node that sent it.
+
+    Returns:
+        list: [Xray time or None, received, parsed (set by finish_stamp), node].
+    """
+    logged = xray_time(line.lstrip())
+    if logged is not None and not -5 < received - logged < MAX_CLOCK_SKEW:
+        LATENCY_METRICS["clock_skew"] += 1
+        logged = None
+    return [logged, received, 0.0, node]
+
+
+def finish_stamp(stamp: list) -> None:
+    """
+    Set the parse end time of a frame and record its receive and parse stages.
+
+    Args:
+        stamp (list): The stamp of the frame.
+    """
+    logged, received, _, node = stamp
+    stamp[2] = time.time()
+    if logged is not None:
+        DETECTION_SECONDS.observe(max(received - logged, 0.0), "receive", node)
+    DETECTION_SECONDS.observe(stamp[2] - received, "parse", node)
+
+
+def detection_trace(
+    user: UserType, ips: list[str], limit: int, sample: float
+) -> dict | None:
+    """
+    Returns the trace of a user found over the limit, started with start_trace()
+    once the disable is handed to the outbox.
+
+    Args:
+        user (UserType): The user (with the first stamp of each IP).
+        ips (list[str]): The active IPs of the user.
+        limit (int): The limit of the user.
+        sample (float): The part of the traces kept for /latency.
+
+    Returns:
+        dict | None: The trace, None if the stamps of the IPs are missing.
+    """
+    stamps = sorted(
+        (user.first_seen[ip] for ip in set(ips) if ip in user.first_seen),
+        key=lambda stamp: stamp[1],
+    )
+    if len(stamps) <= limit:
+        return None
+    logged, received, parsed, node = stamps[limit]  # the IP that went over the limit
+    return {
+        "user": user.name,
+        "node": node,
+        "logged": logged,
+        "received": received,
+        "parsed": parsed,
+        "detected": time.time(),
+        "sampled": random.random() < sample,
+    }
+
+
+def start_trace(trace: dict) -> None:
+    """
+    Record the detect stage of a trace and wait for the panel confirmation.
+    A user already waiting keeps its first trace.
+
+    Args:
+        trace (dict): The trace from detection_trace().
+    """
+    if trace["user"] in PENDING_TRACES:
+        return
+    if trace["parsed"]:
+        DETECTION_SECONDS.observe(
+            trace["detected"] - trace["parsed"], "detect", trace["node"]
+        )
+    if len(PENDING_TRACES) >= MAX_PENDING_TRACES:
+        PENDING_TRACES.pop(next(iter(PENDING_TRACES)))
+    PENDING_TRACES[trace["user"]] = trace
+
+
+def drop_trace(username: str) -> None:
+    """
+    Forget the trace of a user whose disable was given up.
+
+    Args:
+        username (str): The user.
+    """
+    PENDING_TRACES.pop(username, None)
+
+
+def trace_enforced(username: str) -> None:
+    """
+    End the trace of a user when the panel confirmed the disable.
+
+    Args:
+        username (str): The disabled user.
+    """
+    trace = PENDING_TRACES.pop(username, None)
+    if trace is None:
+        return
+    trace["disabled"] = now = time.time()
+    node = trace["node"]
+    DETECTION_SECONDS.observe(now - trace["detected"], "enforce", node)
+    DETECTION_SECONDS.observe(now - (trace["logged"] or trace["received"]), "total", node)
+    LATENCY_METRICS["traces"] += 1
+    if trace["sampled"]:
+        SAMPLED_TRACES.append(trace)
+
+
+def stage_quantiles(stage: str, node: str | None = None) -> tuple[int, float, float]:
+    """
+    Returns the count and the estimated median and 95th percentile of a stage
+    (the upper bound of the histogram bucket, inf above the last one).
+
+    Args:
+        stage (str): The stage.
+        node (str | None): Only this node, all nodes if None.
+
+    Returns:
+        tuple[int, float, float]: The count, p50 and p95 in seconds (0 if empty).
+    """
+    buckets = DETECTION_SECONDS.buckets
+    counts = [0] * (len(buckets) + 1)
+    for (series_stage, series_node), series in DETECTION_SECONDS.values.items():
+        if series_stage != stage or (node is not None and series_node != node):
+            continue
+        for index, count in enumerate(series[: len(buckets)]):
+            counts[index] += count
+        counts[-1] += series[-1]
+    total = counts[-1]
+    if not total:
+        return 0, 0.0, 0.0
+    result = []
+    for quantile in (0.5, 0.95):
+        cumulative, value = 0, float("inf")
+        for bound, count in zip(buckets, counts):
+            cumulative += count
+            if cumulative >= quantile * total:
+                value = bound
+                break
+        result.append(value)
+    return total, result[0], result[1]
+
+
+def stage_nodes() -> list[str]:
+    """
+    Returns the nodes with latency data.
+
+    Returns:
+        list[str]: The node names.
+    """
+    return sorted({node for _, node in DETECTION_SECONDS.values})
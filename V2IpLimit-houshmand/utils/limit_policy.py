@@ -0,0 +1,253 @@
+"""
+This module compiles the limit settings (GENERAL_LIMIT and LIMIT_RULES of
+the config, the special limits and except users of the policy store)
+into one policy object.
+The policy is only rebuilt after the settings changed, so the checks look up
+the limit of a user in O(1) without parsing the config again.
+
+LIMIT_RULES gives a limit to a group of users, for example:
+    "LIMIT_RULES": [
+        {"prefix": "family_", "limit": 4},
+        {"glob": "biz-*", "limit": 10},
+        {"regex": "^vip[0-9]+$", "limit": 20}
+    ]
+A "glob" or "regex" rule must match the whole username ("vip" does not match
+"vip2"), a "prefix" rule its start. The first matching rule is used,
+a SPECIAL_LIMIT of the user comes first.
+"""
+
+import fnmatch
+import re
+from dataclasses import dataclass, field
+
+from utils.config_store import CONFIG_STORE
+from utils.logs import logger
+from utils.policy_store import POLICY_STORE, PolicyStore
+
+POLICY_METRICS: dict[str, int] = {
+    "version": 0,
+    "builds": 0,
+    "invalid_limits": 0,
+    "invalid_rules": 0,
+}
+_POLICY: list = [None]  # the compiled policy, None after a config change
+MEMO_SIZE = 100_000  # usernames whose resolved limit is remembered
+
+
+class PatternMatcher:  # pylint: disable=too-few-public-methods
+    """
+    The LIMIT_RULES compiled into a prefix trie and one combined regex
+    (globs are translated to regexes, regexes with groups are matched alone).
+
+    Args:
+        rules (list[dict]): The rules, the first matching rule wins.
+    """
+
+    def __init__(self, rules: list[dict]):
+        self.trie: list = [{}, None]  # [children by character, (order, limit) of a prefix]
+        self.limits: list[int] = []  # the limit of each rule of the combined regex
+        self.orders: list[int] = []  # the position of each rule of the combined regex
+        # (order, limit, regex) of the rules matched one by one: the regexes with
+        # groups (their backreferences and names would change in the combined regex)
+        self.single: list[tuple[int, int, re.Pattern]] = []
+        patterns, sources = [], []
+        for order, rule in enumerate(rules):
+            try:
+                limit = int(rule["limit"])
+                if "prefix" in rule:
+                    self._add_prefix(str(rule["prefix"]), order, limit)
+                    continue
+                if "glob" in rule:
+                    pattern = fnmatch.translate(str(rule["glob"]))
+                else:
+                    pattern = str(rule["regex"])
+                compiled = re.compile(pattern)
+            except (KeyError, TypeError, ValueError, re.error) as error:
+                POLICY_METRICS["invalid_rules"] += 1
+                logger.warning("Invalid limit rule %r: %s", rule, error)
+                continue
+            if compiled.groups:
+                self.single.append((order, limit, compiled))
+                continue
+            patterns.append(f"(?P<r{len(self.limits)}>{pattern})")
+            sources.append(pattern)
+            self.limits.append(limit)
+            self.orders.append(order)
+        self.regex = None
+        if patterns:
+            try:
+                self.regex = re.compile("|".join(patterns))
+            except re.error as error:
+                logger.warning("Limit rules matched one by one: %s", error)
+                for index, pattern in enumerate(sources):
+                    self.single.append(
+                        (self.orders[index], self.limits[index], re.compile(pattern))
+                    )
+                self.single.sort(key=lambda item: item[0])
+
+    def _add_prefix(self, prefix: str, order: int, limit: int) -> None:
+        node = self.trie
+        for char in prefix:
+            node = node[0].setdefault(char, [{}, None])
+        if node[1] is None:
+            node[1] = (order, limit)
+
+    def match(self, user_name: str) -> int | None:
+        """
+        Returns the limit of the first rule matching the username.
+
+        Args:
+            user_name (str): The username.
+
+        Returns:
+            int | None: The limit, None if no rule matches.
+        """
+        best: tuple = (float("inf"), None)  # (order, limit) of the first matching rule
+        node = self.trie
+        if node[1] is not None:
+            best = node[1]
+        for char in user_name:
+            node = node[0].get(char)
+            if node is None:
+                break
+            if node[1] is not None and node[1][0] < best[0]:
+                best = node[1]
+        if self.regex is not None:
+            found = self.regex.fullmatch(user_name)
+            if found is not None:
+                index = int(found.lastgroup[1:])
+                if self.orders[index] < best[0]:
+                    best = (self.orders[index], self.limits[index])
+        for order, limit, regex in self.single:
+            if order >= best[0]:
+                break
+            if regex.fullmatch(user_name):
+                best = (order, limit)
+        return best[1]
+
+
+@dataclass(frozen=True, slots=True)
+class LimitPolicy:
+    """
+    The compiled limits.
+
+    Attributes:
+        version (int): Increased every time the policy is rebuilt.
+        general_limit (int): The limit of users without a special limit.
+        special_limits (dict[str, int]): The limit of each user with a special limit.
+        except_users (frozenset[str] | set[str]): The users without a limit.
+        rules (PatternMatcher | None): The group limits.
+        memo (dict[str, int]): The resolved limit of the users matched against the rules.
+    """
+
+    version: int
+    general_limit: int
+    special_limits: dict[str, int]
+    except_users: frozenset[str] | set[str]
+    rules: PatternMatcher | None = None
+    memo: dict[str, int] = field(default_factory=dict, repr=False, compare=False)
+
+    def limit_of(self, user_name: str) -> int | None:
+        """
+        Returns the limit of a user.
+
+        Args:
+            user_name (str): The username.
+
+        Returns:
+            int | None: The number of IPs allowed, None if the user has no limit.
+        """
+        if user_name in self.except_users:
+            return None
+        limit = self.special_limits.get(user_name)
+        if limit is not None:
+            return limit
+        if self.rules is None:
+            return self.general_limit
+        limit = self.memo.get(user_name)
+        if limit is None:
+            limit = self.rules.match(user_name)
+            if limit is None:
+                limit = self.general_limit
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo.clear()
+            self.memo[user_name] = limit
+        return limit
+
+    def is_over(self, user_name: str, ip_count: int) -> bool:
+        """
+        Returns True if the user has more IPs than allowed.
+
+        Args:
+            user_name (str): The username.
+            ip_count (int): The number of active IPs.
+
+        Returns:
+            bool: True if the user is over the limit.
+        """
+        limit = self.limit_of(user_name)
+        return limit is not None and ip_count > limit
+
+
+def compile_policy(
+    config_data: dict, version: int = 0, store: PolicyStore | None = None
+) -> LimitPolicy:
+    """
+    Compile the limits of a config.
+    Special limits that are not numbers are skipped (with a warning).
+
+    Args:
+        config_data (dict): The config, it must contain GENERAL_LIMIT.
+        version (int): The version of the policy.
+        store (PolicyStore | None): Where the special limits and except users
+            are kept, the config if None.
+
+    Returns:
+        LimitPolicy: The policy.
+    """
+    if store is not None:
+        special_limits = store.special_limits  # kept up to date by the store
+        except_users = store.except_users
+    else:
+        special_limits = {}
+        for user_name, limit in config_data.get("SPECIAL_LIMIT", {}).items():
+            try:
+                special_limits[user_name] = int(limit)
+            except (TypeError, ValueError):
+                POLICY_METRICS["invalid_limits"] += 1
+                logger.warning("Invalid special limit for %s: %r", user_name, limit)
+        except_users = frozenset(config_data.get("EXCEPT_USERS", []))
+    rules = config_data.get("LIMIT_RULES")
+    return LimitPolicy(
+        version=version,
+        general_limit=int(config_data["GENERAL_LIMIT"]),
+        special_limits=special_limits,
+        except_users=except_users,
+        rules=PatternMatcher(rules) if rules else None,
+    )
+
+
+def get_policy() -> LimitPolicy:
+    """
+    Returns the policy of the current settings, it is compiled again
+    only if the config or the policy store changed since the last call.
+
+    Returns:
+        LimitPolicy: The policy.
+    """
+    policy = _POLICY[0]
+    if policy is None:
+        POLICY_METRICS["version"] += 1
+        POLICY_METRICS["builds"] += 1
+        policy = _POLICY[0] = compile_policy(
+            CONFIG_STORE.get(), POLICY_METRICS["version"], POLICY_STORE.load()
+        )
+    return policy
+
+
+def _invalidate(_config_data: dict | None = None) -> None:
+    _POLICY[0] = None
+
+
+CONFIG_STORE.subscribe(_invalidate)
+POLICY_STORE.subscribe(_invalidate)
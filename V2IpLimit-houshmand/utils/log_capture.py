@@ -0,0 +1,188 @@
+"""
+This module records the raw log frames received from the panel and the nodes
+into compressed, timestamped segment files and replays them later.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from collections.abc import AsyncIterator
+
+from utils.logs import logger
+
+RECORDER: "LogRecorder | None" = None
+
+
+class LogRecorder:  # pylint: disable=too-many-instance-attributes
+    """
+    Writes raw log frames to gzip'd JSON-lines segment files.
+
+    Every line of a segment is a JSON object: {"t": time, "src": source, "frame": text}.
+    Frames are only buffered on the event loop, compression and disk
+    writes run in a worker thread, one at a time.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_seconds: int = 600,
+        segment_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self._buffer: list[str] = []
+        self._segment = None
+        self._segment_start = 0.0
+        self._segment_size = 0
+        self._lock = threading.Lock()  # held while the segment file is written
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, source: str, frame: str) -> None:
+        """
+        Buffer a frame to be written to the current segment.
+
+        Args:
+            source (str): The name of the panel or node that sent the frame.
+            frame (str): The raw frame.
+        """
+        self._buffer.append(
+            json.dumps({"t": time.time(), "src": source, "frame": frame})
+        )
+
+    def _write(self, records: list[str]) -> None:
+        with self._lock:
+            self._append(records)
+
+    def _append(self, records: list[str]) -> None:
+        now = time.time()
+        if self._segment is None or (
+            now - self._segment_start > self.segment_seconds
+            or self._segment_size > self.segment_bytes
+        ):
+            self._close_segment()
+            name = time.strftime("capture-%Y%m%d-%H%M%S.jsonl.gz", time.localtime(now))
+            self._segment = gzip.open(  # pylint: disable=consider-using-with
+                os.path.join(self.directory, name), "at", encoding="utf-8"
+            )
+            self._segment_start = now
+            self._segment_size = 0
+            logger.info("Start capture segment %s", name)
+        data = "\n".join(records) + "\n"
+        self._segment.write(data)
+        self._segment.flush()
+        self._segment_size += len(data)
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    async def flush(self) -> None:
+        """Write the buffered frames to disk."""
+        if self._buffer:
+            records, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._write, records)
+
+    async def run(self, interval: float = 1.0) -> None:
+        """
+        Flush the buffered frames every 'interval' seconds.
+
+        Args:
+            interval (float): Seconds between two flushes.
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            # the thread of a cancelled flush may still be writing, wait for it
+            with self._lock:
+                if self._buffer:
+                    self._append(self._buffer)
+                    self._buffer = []
+                self._close_segment()
+
+
+def start_capture(directory: str) -> LogRecorder:
+    """
+    Enable capture mode, every frame passed to record_frame() is saved.
+
+    Args:
+        directory (str): The directory for the segment files.
+
+    Returns:
+        LogRecorder: The recorder, its run() coroutine must be started.
+    """
+    global RECORDER  # pylint: disable=global-statement
+    RECORDER = LogRecorder(directory)
+    return RECORDER
+
+
+def record_frame(source: str, frame: str) -> None:
+    """
+    Save a raw frame if capture mode is enabled.
+
+    Args:
+        source (str): The name of the panel or node that sent the frame.
+        frame (str): The raw frame.
+    """
+    if RECORDER is not None:
+        RECORDER.record(source, frame)
+
+
+def capture_files(path: str) -> list[str]:
+    """
+    Return the segment files of a capture, oldest first.
+
+    Args:
+        path (str): A segment file or a directory of segment files.
+
+    Returns:
+        list[str]: The paths of the segment files.
+    """
+    if os.path.isfile(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.endswith(".jsonl.gz")
+    )
+
+
+async def replay_capture(
+    path: str, speed: float | None = None
+) -> AsyncIterator[tuple[float, str, str]]:
+    """
+    Read a capture back, either at the recorded pace or as fast as possible.
+
+    Args:
+        path (str): A segment file or a directory of segment files.
+        speed (float | None): 1.0 replays at original speed, 2.0 twice as fast...
+            None replays without any delay.
+
+    Yields:
+        tuple[float, str, str]: The receive time, the source and the frame.
+    """
+    first_time = None
+    start = time.monotonic()
+    for file_name in capture_files(path):
+        with gzip.open(file_name, "rt", encoding="utf-8") as file:
+            for number, line in enumerate(file):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error("Skip broken capture line %s:%s", file_name, number)
+                    continue
+                if speed:
+                    if first_time is None:
+                        first_time = record["t"]
+                    delay = (record["t"] - first_time) / speed - (
+                        time.monotonic() - start
+                    )
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                yield record["t"], record["src"], record["frame"]
@@ -1,10 +1,105 @@
 """
 This module sets up the logging configuration for the application.
-It configures a rotating file handler and a stream handler for the root logger.
+The root logger only puts the records in a queue, a listener thread writes
+them to a rotating file and to the stream handler (errors only), so the
+event loop never waits for disk writes or file rotation.
+
+configure_logging() applies the config:
+    'LOG_FORMAT'      "text" (default) or "json" (one object per line, with
+                      the "node" and "user" fields when they are known)
+    'LOG_LEVELS'      the level per module or logger name, for example
+                      {"root": "INFO", "check_usage": "WARNING", "httpx": "WARNING"}
+    'LOG_RATE_LIMIT'  the records per call site per minute below WARNING
+                      (default 0: no limit), the number of suppressed
+                      records is added to the next one of that call site
 """
 
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+MAX_QUEUE_SIZE = 10_000
+RATE_WINDOW = 60  # seconds
+LOG_NODE: ContextVar[str | None] = ContextVar("LOG_NODE", default=None)
+LOG_METRICS = {"dropped": 0, "suppressed": 0}
+
+
+def set_log_node(node: str) -> None:
+    """
+    Tag the records of the current task (and of the tasks it creates afterwards)
+    with a node name.
+
+    Args:
+        node (str): The node name.
+    """
+    LOG_NODE.set(node)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for key in ("node", "user"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogControl(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    The per-module levels and the per-call-site rate limit,
+    it runs before a record is queued.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.default_level = logging.INFO
+        self.levels: dict[str, int] = {}
+        self.rate_limit = 0
+        self.sites: dict[tuple[str, int], list] = {}  # site -> [window start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = record.module if record.name == "root" else record.name.split(".")[0]
+        if record.levelno < self.levels.get(name, self.default_level):
+            return False
+        if self.rate_limit and record.levelno < logging.WARNING:
+            site = (record.pathname, record.lineno)
+            state = self.sites.get(site)
+            if state is None or record.created - state[0] >= RATE_WINDOW:
+                suppressed = state[2] if state else 0
+                state = self.sites[site] = [record.created, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.getMessage()} ({suppressed} similar suppressed)"
+                    record.args = None
+            state[1] += 1
+            if state[1] > self.rate_limit:
+                state[2] += 1
+                LOG_METRICS["suppressed"] += 1
+                return False
+        if getattr(record, "node", None) is None:
+            record.node = LOG_NODE.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """A QueueHandler that drops (and counts) records when the queue is full."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_METRICS["dropped"] += 1
+
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -17,5 +112,38 @@ stream_handler.setLevel(logging.ERROR)
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 file_handler.setFormatter(formatter)
 stream_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+log_control = LogControl()
+queue_handler = DroppingQueueHandler(queue.Queue(MAX_QUEUE_SIZE))
+queue_handler.addFilter(log_control)
+logger.addHandler(queue_handler)
+listener = QueueListener(
+    queue_handler.queue, file_handler, stream_handler, respect_handler_level=True
+)
+listener.start()
+atexit.register(listener.stop)
+
+
+def configure_logging(config_data: dict) -> None:
+    """
+    Apply 'LOG_FORMAT', 'LOG_LEVELS' and 'LOG_RATE_LIMIT' from the config
+    (it is subscribed to the config changes).
+
+    Args:
+        config_data (dict): The config.
+    """
+    levels = {}
+    for name, level in (config_data.get("LOG_LEVELS") or {}).items():
+        value = logging.getLevelName(str(level).upper())
+        if isinstance(value, int):
+            levels[name] = value
+        else:
+            logger.error("Invalid log level %r for %s", level, name)
+    log_control.default_level = levels.pop("root", logging.INFO)
+    log_control.levels = levels
+    log_control.rate_limit = int(config_data.get("LOG_RATE_LIMIT", 0))
+    # the records below the file handler level are never written
+    lowest = min([log_control.default_level, *levels.values()])
+    logger.setLevel(lowest)
+    file_handler.setLevel(lowest)
+    json_format = config_data.get("LOG_FORMAT", "text") == "json"
+    file_handler.setFormatter(JsonFormatter() if json_format else formatter)
@@ -0,0 +1,171 @@
+"""
+This module measures the event loop lag: a timer asks to wake up every
+0.25 seconds and records how late it ran. A watchdog thread looks at the
+loop when the timer is late and records the running task (for example
+'Task-3-node1') and the function that blocks it.
+Lags over 'LOOP_LAG_THRESHOLD' (seconds, default 0.5) are counted per task
+and function, and one alert is sent when the loop was lagging for more than
+half of the last 'LOOP_LAG_ALERT_WINDOW' seconds (default 60, at most one
+alert per 'LOOP_LAG_ALERT_INTERVAL' seconds, default 900).
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from telegram_bot.send_message import send_logs
+from utils.logs import logger
+from utils.metrics import LOOP_LAG, LOOP_STALLS
+
+INTERVAL = 0.25
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOOP_MONITOR_STATE: dict = {
+    "beat": 0.0,
+    "culprit": (0.0, "unknown", "unknown"),  # (beat, task, function) of the last stall
+    "alerted_at": 0.0,
+}
+ALERT_TASKS: set[asyncio.Task] = set()
+
+
+def blocking_function(thread_id: int) -> str:
+    """
+    Returns the innermost function of the project on the stack of a thread
+    (or the innermost function if none is).
+
+    Args:
+        thread_id (int): The thread.
+
+    Returns:
+        str: "function (file:line)".
+    """
+    frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+    leaf = None
+    while frame is not None:
+        code = frame.f_code
+        name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+        leaf = leaf or name
+        if code.co_filename.startswith(PROJECT_DIR) and "site-packages" not in code.co_filename:
+            return name
+        frame = frame.f_back
+    return leaf or "unknown"
+
+
+def watchdog(loop: asyncio.AbstractEventLoop, thread_id: int, threshold: float,
+             stop: threading.Event) -> None:
+    """
+    Record what the loop runs when the timer is late (run it in a thread).
+
+    Args:
+        loop (asyncio.AbstractEventLoop): The event loop.
+        thread_id (int): The thread of the event loop.
+        threshold (float): The lag that is recorded.
+        stop (threading.Event): Set to stop the watchdog.
+    """
+    captured = 0.0
+    while not stop.wait(INTERVAL / 2):
+        beat = LOOP_MONITOR_STATE["beat"]
+        # look early, the stall can end just after reaching the threshold
+        if beat == captured or time.monotonic() - beat < INTERVAL + threshold / 2:
+            continue
+        captured = beat  # once per stall
+        task = asyncio.current_task(loop)
+        LOOP_MONITOR_STATE["culprit"] = (
+            beat,
+            task.get_name() if task is not None else "callback",
+            blocking_function(thread_id),
+        )
+
+
+def alert_due(lags: deque, now: float, config_data: dict) -> bool:
+    """
+    Drop the lags older than the alert window and returns whether
+    the loop lagged for more than half of it.
+
+    Args:
+        lags (deque): The (time, seconds, culprit) of the lags over the threshold.
+        now (float): The current monotonic time.
+        config_data (dict): The config.
+
+    Returns:
+        bool: True if an alert should be sent.
+    """
+    window = float(config_data.get("LOOP_LAG_ALERT_WINDOW", 60))
+    while lags and lags[0][0] < now - window:
+        lags.popleft()
+    if sum(lag for _, lag, _ in lags) < window / 2:
+        return False
+    interval = float(config_data.get("LOOP_LAG_ALERT_INTERVAL", 900))
+    alerted_at = LOOP_MONITOR_STATE["alerted_at"]
+    return not alerted_at or now - alerted_at >= interval
+
+
+def alert_message(lags: deque) -> str:
+    """
+    Returns the alert of a lagging loop (one message for the whole window).
+
+    Args:
+        lags (deque): The (time, seconds, culprit) of the lags over the threshold.
+
+    Returns:
+        str: The message.
+    """
+    culprits: dict[tuple[str, str], list] = {}
+    for _, lag, culprit in lags:
+        stats = culprits.setdefault(culprit, [0, 0.0])
+        stats[0] += 1
+        stats[1] += lag
+    top = sorted(culprits.items(), key=lambda item: item[1][1], reverse=True)[:5]
+    lines = [
+        f"{task} {function}: {count}x {seconds:.1f}s"
+        for (task, function), (count, seconds) in top
+    ]
+    return (
+        "[Event loop] lagging: "
+        + f"{sum(lag for _, lag, _ in lags):.1f}s lost in {len(lags)} stalls,"
+        + f" worst {max(lag for _, lag, _ in lags):.2f}s\n"
+        + "\n".join(lines)
+    )
+
+
+async def run_loop_monitor(config_data: dict) -> None:
+    """
+    Measure the loop lag until cancelled.
+
+    Args:
+        config_data (dict): The config ('LOOP_LAG_THRESHOLD').
+    """
+    threshold = float(config_data.get("LOOP_LAG_THRESHOLD", 0.5))
+    stop = threading.Event()
+    LOOP_MONITOR_STATE["beat"] = time.monotonic()
+    threading.Thread(
+        target=watchdog,
+        args=(asyncio.get_running_loop(), threading.get_ident(), threshold, stop),
+        name="loop_watchdog",
+        daemon=True,
+    ).start()
+    lags: deque = deque()
+    try:
+        while True:
+            await asyncio.sleep(INTERVAL)
+            now = time.monotonic()
+            beat = LOOP_MONITOR_STATE["beat"]
+            lag = max(now - beat - INTERVAL, 0.0)
+            LOOP_MONITOR_STATE["beat"] = now
+            LOOP_LAG.observe(lag)
+            if lag < threshold:
+                continue
+            stall_beat, *culprit = LOOP_MONITOR_STATE["culprit"]
+            culprit = tuple(culprit) if stall_beat == beat else ("unknown", "unknown")
+            LOOP_STALLS.inc(1, *culprit)
+            logger.warning("Event loop lag %.2fs in %s %s", lag, *culprit)
+            lags.append((now, lag, culprit))
+            if alert_due(lags, now, config_data):
+                LOOP_MONITOR_STATE["alerted_at"] = now
+                task = asyncio.create_task(send_logs(alert_message(lags)))
+                ALERT_TASKS.add(task)
+                task.add_done_callback(ALERT_TASKS.discard)
+    finally:
+        stop.set()
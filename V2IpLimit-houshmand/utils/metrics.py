@@ -0,0 +1,213 @@
+"""
+This module contains small counters and histograms in the Prometheus
+text format, they are served by utils/metrics_server.py.
+Updating a metric is a dict update, nothing is sent anywhere.
+"""
+
+import bisect
+from collections.abc import Callable, Iterable
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Counter:
+    """
+    A counter (or gauge) with optional labels.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labels (tuple[str, ...]): The label names.
+        kind (str): "counter" or "gauge".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        kind: str = "counter",
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.kind = kind
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, value: float, *labels) -> None:
+        """Add 'value' to the series of the label values."""
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def set(self, value: float, *labels) -> None:
+        """Set the series of the label values (for gauges)."""
+        self.values[labels] = value
+
+    def render(self) -> Iterable[str]:
+        """The lines of the metric in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+
+class Histogram:
+    """
+    A histogram with optional labels.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labels (tuple[str, ...]): The label names.
+        buckets (tuple[float, ...]): The upper bounds of the buckets.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.values: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels) -> None:
+        """Add one observation to the series of the label values."""
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        """The lines of the metric in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket_labels = _labels(self.labels, labels, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            bucket_labels = _labels(self.labels, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{bucket_labels} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(series[-2])}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {series[-1]}"
+
+
+class MetricsRegistry:
+    """
+    All metrics, and the functions that update gauges when /metrics is read.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram] = {}
+        self.collectors: list[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        """Returns a new counter."""
+        return self.metrics.setdefault(name, Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        """Returns a new gauge."""
+        return self.metrics.setdefault(name, Counter(name, documentation, labels, "gauge"))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Returns a new histogram."""
+        return self.metrics.setdefault(
+            name, Histogram(name, documentation, labels, buckets)
+        )
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Register a function called before every render (a decorator)."""
+        if func not in self.collectors:
+            self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text format.
+
+        Returns:
+            str: The body of /metrics.
+        """
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+LOG_FRAMES = METRICS.counter(
+    "v2iplimit_log_frames_total", "Log frames received", ("node",)
+)
+LOG_LINES = METRICS.counter("v2iplimit_log_lines_total", "Log lines received", ("node",))
+PARSE_SECONDS = METRICS.histogram(
+    "v2iplimit_parse_seconds",
+    "Time to parse one log frame",
+    ("node",),
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+)
+GEO_LOOKUPS = METRICS.counter(
+    "v2iplimit_geo_lookups_total", "IP location lookups (hit, miss, error)", ("result",)
+)
+PANEL_REQUEST_SECONDS = METRICS.histogram(
+    "v2iplimit_panel_request_seconds", "Panel API request latency", ("endpoint",)
+)
+PANEL_ERRORS = METRICS.counter(
+    "v2iplimit_panel_errors_total",
+    "Panel API errors (HTTP status or exception name)",
+    ("endpoint", "error"),
+)
+TOKEN_REFRESHES = METRICS.counter(
+    "v2iplimit_panel_token_refreshes_total", "Panel access tokens fetched"
+)
+TELEGRAM_SEND_SECONDS = METRICS.histogram(
+    "v2iplimit_telegram_send_seconds",
+    "Time to deliver one Telegram message (retries included)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+LAST_CHECK = METRICS.gauge(
+    "v2iplimit_last_check_timestamp_seconds", "Time of the last finished usage check"
+)
+OFFENDERS_FOUND = METRICS.counter(
+    "v2iplimit_offenders_total", "Users found over their limit (counted every check)"
+)
+LOOP_LAG = METRICS.histogram(
+    "v2iplimit_loop_lag_seconds", "How late the event loop ran a 0.25s timer"
+)
+LOOP_STALLS = METRICS.counter(
+    "v2iplimit_loop_stalls_total",
+    "Event loop lags over the threshold, by the running task and function",
+    ("task", "function"),
+)
@@ -0,0 +1,146 @@
+"""
+This module serves /metrics (Prometheus text format) and /healthz
+with a small asyncio HTTP server.
+It is started when 'METRICS_PORT' is set in the config
+('METRICS_HOST' defaults to 127.0.0.1).
+"""
+
+import asyncio
+import json
+import time
+
+from telegram_bot.send_message import ADMIN_STATS, NOTIFY_METRICS
+from utils.check_usage import ACTIVE_USERS
+from utils.get_logs import TASKS
+from utils.handel_dis_users import DISABLED_USERS
+from utils.latency import LATENCY_METRICS
+from utils.limit_policy import POLICY_METRICS
+from utils.logs import LOG_METRICS, logger
+from utils.metrics import LAST_CHECK, METRICS
+from utils.outbox import OUTBOX_METRICS
+from utils.panel_scheduler import SCHEDULER_METRICS
+from utils.read_config import read_config
+from utils.user_state import USER_STATE_METRICS
+
+STARTED_AT = time.time()
+MAX_REQUEST_SIZE = 8192
+
+FLAT_METRICS = {
+    "outbox": OUTBOX_METRICS,
+    "notify": NOTIFY_METRICS,
+    "user_state": USER_STATE_METRICS,
+    "policy": POLICY_METRICS,
+    "log": LOG_METRICS,
+    "latency": LATENCY_METRICS,
+}
+
+
+@METRICS.collector
+def collect_state() -> None:
+    """Copy the state of the other modules into gauges."""
+    METRICS.gauge("v2iplimit_active_users", "Users seen since the last check").set(
+        len(ACTIVE_USERS)
+    )
+    METRICS.gauge("v2iplimit_active_ips", "Distinct IPs seen since the last check").set(
+        len({ip for user in list(ACTIVE_USERS.values()) for ip in user.ip})
+    )
+    METRICS.gauge("v2iplimit_disabled_users", "Users disabled by the limiter").set(
+        len(DISABLED_USERS)
+    )
+    METRICS.gauge("v2iplimit_log_tasks", "Running log stream tasks").set(
+        sum(1 for task in TASKS if not task.done())
+    )
+    for prefix, values in FLAT_METRICS.items():
+        for key, value in values.items():
+            METRICS.gauge(f"v2iplimit_{prefix}_{key}", f"{prefix} {key}").set(value)
+    for key, values in SCHEDULER_METRICS.items():
+        gauge = METRICS.gauge(
+            f"v2iplimit_scheduler_{key}", f"Panel scheduler {key}", ("class",)
+        )
+        for name, value in values.items():
+            gauge.set(value, name)
+    for name in ("sent", "failed", "retries"):
+        gauge = METRICS.gauge(
+            f"v2iplimit_telegram_{name}", f"Telegram messages {name} per admin", ("chat",)
+        )
+        for chat_id, stats in ADMIN_STATS.items():
+            gauge.set(getattr(stats, name), chat_id)
+
+
+async def health() -> tuple[bool, dict]:
+    """
+    Returns whether the limiter works: the log streams run and
+    the usage check ran recently.
+
+    Returns:
+        tuple[bool, dict]: True if healthy, and the details.
+    """
+    config_data = await read_config()
+    interval = int(config_data.get("CHECK_INTERVAL", 240))
+    now = time.time()
+    last_check = LAST_CHECK.values.get((), 0.0)
+    log_tasks = sum(1 for task in TASKS if not task.done())
+    # the first check runs one interval after the start
+    check_ok = now - (last_check or STARTED_AT) < 3 * interval + 60
+    tasks_ok = log_tasks > 0 or now - STARTED_AT < 120
+    details = {
+        "status": "ok" if check_ok and tasks_ok else "fail",
+        "uptime": round(now - STARTED_AT),
+        "last_check_age": round(now - last_check) if last_check else None,
+        "log_tasks": log_tasks,
+        "outbox_depth": OUTBOX_METRICS["depth"],
+    }
+    return check_ok and tasks_ok, details
+
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer one HTTP request."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+        parts = head.split(b" ", 2)
+        path = parts[1].split(b"?")[0].decode() if len(parts) > 1 else ""
+        if path == "/metrics":
+            status, content_type = "200 OK", "text/plain; version=0.0.4"
+            body = METRICS.render().encode()
+        elif path == "/healthz":
+            healthy, details = await health()
+            status = "200 OK" if healthy else "503 Service Unavailable"
+            content_type = "application/json"
+            body = json.dumps(details).encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def run_metrics_server(config_data: dict) -> None:
+    """
+    Serve /metrics and /healthz until cancelled.
+    If the port can not be opened the error is logged and it returns,
+    so the other tasks keep running.
+
+    Args:
+        config_data (dict): The config ('METRICS_PORT' and 'METRICS_HOST').
+    """
+    host = config_data.get("METRICS_HOST", "127.0.0.1")
+    port = int(config_data["METRICS_PORT"])
+    try:
+        server = await asyncio.start_server(
+            handle_request, host, port, limit=MAX_REQUEST_SIZE
+        )
+    except OSError as error:
+        logger.error("Metrics server can not listen on %s:%s: %s", host, port, error)
+        return
+    logger.info("Metrics server listening on %s:%s", host, port)
+    async with server:
+        await server.serve_forever()
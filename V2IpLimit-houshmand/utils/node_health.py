@@ -0,0 +1,160 @@
+"""
+This module keeps the health of the log stream of every node (the panel
+websockets and the syslog senders): state, last frame, line rates,
+reconnects, backoff and queued packets, shown by the /nodes bot command.
+Updating it on the ingestion path is a few integer updates per frame.
+"""
+
+import time
+from dataclasses import dataclass, field
+
+SLOT_SECONDS = 10
+SLOTS = 90  # 15 minutes of line counts
+
+
+@dataclass
+class NodeStream:  # pylint: disable=too-many-instance-attributes
+    """
+    The health of the log stream of one node.
+
+    Attributes:
+        name (str): The node name.
+        state (str): "connecting", "connected", "backoff", "stopped" or "syslog".
+        since (float): Time of the last state change.
+        last_frame (float): Time of the last received frame (0 if none).
+        frames (int): Frames received.
+        lines (int): Lines received.
+        reconnects (int): Failed connections since the start.
+        backoff (float): The wait before the next connection attempt.
+        queued (int): Packets waiting to be parsed (syslog only).
+        last_error (str): The last connection error.
+    """
+
+    name: str
+    state: str = "connecting"
+    since: float = field(default_factory=time.time)
+    last_frame: float = 0.0
+    frames: int = 0
+    lines: int = 0
+    reconnects: int = 0
+    backoff: float = 0.0
+    queued: int = 0
+    last_error: str = ""
+    slot_lines: list = field(default_factory=lambda: [0] * SLOTS, repr=False)
+    slot_ids: list = field(default_factory=lambda: [0] * SLOTS, repr=False)
+
+    def set_state(self, state: str, backoff: float = 0.0, error: str = "") -> None:
+        """
+        Change the state of the stream.
+
+        Args:
+            state (str): The new state.
+            backoff (float): The wait before the next attempt ("backoff" only).
+            error (str): The connection error ("backoff" only).
+        """
+        if state == "backoff":
+            self.reconnects += 1
+            self.last_error = error
+        self.state = state
+        self.backoff = backoff
+        self.since = time.time()
+
+    def frame(self, lines: int, now: float | None = None) -> None:
+        """
+        Count a received frame.
+
+        Args:
+            lines (int): The lines of the frame.
+            now (float | None): The current time.
+        """
+        now = now or time.time()
+        self.last_frame = now
+        self.frames += 1
+        self.lines += lines
+        slot_id = int(now // SLOT_SECONDS)
+        index = slot_id % SLOTS
+        if self.slot_ids[index] != slot_id:
+            self.slot_ids[index] = slot_id
+            self.slot_lines[index] = 0
+        self.slot_lines[index] += lines
+
+    def rate(self, seconds: int, now: float | None = None) -> float:
+        """
+        Returns the lines per second over the last 'seconds'.
+
+        Args:
+            seconds (int): The window (at most 15 minutes).
+            now (float | None): The current time.
+
+        Returns:
+            float: The lines per second.
+        """
+        first = int((now or time.time()) // SLOT_SECONDS) - seconds // SLOT_SECONDS + 1
+        lines = sum(
+            count
+            for slot_id, count in zip(self.slot_ids, self.slot_lines)
+            if slot_id >= first
+        )
+        return lines / seconds
+
+
+NODE_STREAMS: dict[str, NodeStream] = {}
+
+
+def node_stream(name: str) -> NodeStream:
+    """
+    Returns the stream of a node, created on first use.
+
+    Args:
+        name (str): The node name.
+
+    Returns:
+        NodeStream: The stream health.
+    """
+    stream = NODE_STREAMS.get(name)
+    if stream is None:
+        stream = NODE_STREAMS[name] = NodeStream(name)
+    return stream
+
+
+def _age(seconds: float) -> str:
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.0f}h"
+
+
+def node_health_rows(now: float | None = None) -> list[tuple]:
+    """
+    Returns one row per node for the /nodes command, the silent ones first.
+
+    Args:
+        now (float | None): The current time.
+
+    Returns:
+        list[tuple]: (name, state, last frame age, lines/s 1m, lines/s 15m,
+            reconnects, backoff left, queued, last error).
+    """
+    now = now or time.time()
+    rows = []
+    streams = sorted(
+        NODE_STREAMS.values(),
+        key=lambda stream: (stream.state in ("connected", "syslog"), stream.last_frame),
+    )
+    for stream in streams:
+        backoff_left = max(stream.since + stream.backoff - now, 0.0)
+        rows.append(
+            (
+                stream.name,
+                stream.state,
+                _age(now - stream.last_frame) if stream.last_frame else "-",
+                round(stream.rate(60, now), 1),
+                round(stream.rate(900, now), 1),
+                stream.reconnects,
+                _age(backoff_left) if stream.state == "backoff" else "-",
+                stream.queued,
+                stream.last_error,
+            )
+        )
+    return rows
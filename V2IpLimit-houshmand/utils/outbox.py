@@ -0,0 +1,391 @@
+"""
+This module contains the outbox of panel write actions.
+Every disable of a user is written to a journal first,
+a worker sends the pending actions to the panel in batches and retries
+them until the panel confirms, pending actions survive a restart.
+"""
+
+import asyncio
+import heapq
+import random
+import time
+from dataclasses import dataclass
+
+import httpx
+from telegram_bot.send_message import send_logs
+
+from utils.handel_dis_users import DisabledUsers
+from utils.journal import Journal
+from utils.latency import drop_trace, trace_enforced
+from utils.logs import logger
+from utils.panel_api import get_token, get_user_status, set_user_status
+from utils.panel_scheduler import RequestPriority, panel_client, set_panel_priority
+from utils.types import PanelType
+
+OUTBOX: "PanelOutbox | None" = None
+OUTBOX_TASK: asyncio.Task | None = None
+OUTBOX_METRICS: dict[str, float] = {
+    "depth": 0,  # actions waiting for the panel
+    "submitted": 0,
+    "applied": 0,  # actions sent to the panel
+    "skipped": 0,  # users already in the target state
+    "dropped": 0,  # users that do not exist anymore
+    "retries": 0,
+    "drain_latency_last": 0.0,  # seconds from submit to panel confirmation
+    "drain_latency_max": 0.0,
+    "drain_latency_sum": 0.0,
+}
+
+
+@dataclass
+class PanelAction:  # pylint: disable=too-many-instance-attributes
+    """
+    A pending status change of a user.
+
+    Attributes:
+        action_id (int): The id of the action in the journal.
+        username (str): The username of the user.
+        status (str): The target status ("disabled", the outbox only disables users).
+        created_at (float): The time the action was submitted.
+        attempts (int): The number of attempts so far.
+        ready_at (float): The time of the next attempt.
+        check_first (bool): Ask the panel for the current status before the write
+            (for actions replayed after a restart or retried).
+        error (str | None): The last error, None if there was no error.
+    """
+
+    action_id: int
+    username: str
+    status: str
+    created_at: float
+    attempts: int = 0
+    ready_at: float = 0.0
+    check_first: bool = False
+    error: str | None = None
+
+
+class PanelOutbox:  # pylint: disable=too-many-instance-attributes
+    """
+    The durable queue of panel write actions.
+
+    Journal records:
+        {"op": "add", "id": id, "user": username, "status": status, "at": time}
+        {"op": "done", "id": id}
+
+    Args:
+        filename (str): The path of the journal file.
+        batch_size (int): The maximum number of actions sent with one token.
+    """
+
+    def __init__(self, filename: str = ".panel_outbox.journal", batch_size: int = 50):
+        self.batch_size = batch_size
+        self.actions: dict[int, PanelAction] = {}
+        self.by_user: dict[str, int] = {}
+        self.ready_heap: list[tuple[float, int]] = []
+        self.journal = Journal(filename, self.snapshot)
+        self._waiters: dict[int, asyncio.Future] = {}
+        self._wakeup: tuple[asyncio.AbstractEventLoop, asyncio.Event] | None = None
+        self._next_id = 1
+        self.load()
+
+    def snapshot(self) -> list[dict]:
+        """
+        Returns the journal records of the pending actions (used to compact it).
+        """
+        return [
+            {
+                "op": "add",
+                "id": action.action_id,
+                "user": action.username,
+                "status": action.status,
+                "at": action.created_at,
+            }
+            for action in self.actions.values()
+        ]
+
+    def load(self) -> None:
+        """
+        Replays the journal, the pending actions are checked against the panel
+        before they are sent again.
+        """
+        pending: dict[int, tuple[str, str, float]] = {}
+        for record in self.journal.read():
+            try:
+                action_id = int(record["id"])
+                if record["op"] == "add":
+                    pending[action_id] = (
+                        str(record["user"]),
+                        str(record["status"]),
+                        float(record["at"]),
+                    )
+                elif record["op"] == "done":
+                    pending.pop(action_id, None)
+                self._next_id = max(self._next_id, action_id + 1)
+            except (KeyError, TypeError, ValueError) as error:
+                logger.error("Skip broken outbox record %s: %s", record, error)
+        latest = {
+            username: (action_id, status, created_at)
+            for action_id, (username, status, created_at) in pending.items()
+        }
+        for username, (action_id, status, created_at) in latest.items():
+            self._add(
+                PanelAction(action_id, username, status, created_at, check_first=True)
+            )
+        if latest:
+            logger.info("Replay %s pending panel actions", len(latest))
+
+    def _add(self, action: PanelAction) -> None:
+        previous = self.by_user.get(action.username)
+        if previous is not None:
+            self._finish(self.actions[previous], "superseded")
+        self.actions[action.action_id] = action
+        self.by_user[action.username] = action.action_id
+        heapq.heappush(self.ready_heap, (action.ready_at, action.action_id))
+        OUTBOX_METRICS["depth"] = len(self.actions)
+
+    def _wakeup_event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._wakeup is None or self._wakeup[0] is not loop:
+            self._wakeup = (loop, asyncio.Event())
+        return self._wakeup[1]
+
+    def submit(self, username: str, status: str, check_first: bool = False) -> asyncio.Future:
+        """
+        Queue a status change, a pending action of the same user is replaced.
+
+        Args:
+            username (str): The username of the user.
+            status (str): The target status ("disabled", the outbox only disables users).
+            check_first (bool): Ask the panel for the current status before the
+                write (when the user probably has the status already).
+
+        Returns:
+            asyncio.Future: Resolves with None once the panel confirmed the
+            change, or with the error if the action was given up.
+        """
+        previous = self.by_user.get(username)
+        if previous is not None and self.actions[previous].status == status:
+            action = self.actions[previous]
+        else:
+            action = PanelAction(
+                self._next_id, username, status, time.time(), check_first=check_first
+            )
+            self._next_id += 1
+            self._add(action)
+            self.journal.append(
+                {
+                    "op": "add",
+                    "id": action.action_id,
+                    "user": username,
+                    "status": status,
+                    "at": action.created_at,
+                }
+            )
+            OUTBOX_METRICS["submitted"] += 1
+            self._wakeup_event().set()
+        loop = asyncio.get_running_loop()
+        waiter = self._waiters.get(action.action_id)
+        if waiter is None or waiter.get_loop() is not loop:  # (main() restarts the loop)
+            waiter = self._waiters[action.action_id] = loop.create_future()
+        return waiter
+
+    def _finish(self, action: PanelAction, error: str | None = None) -> None:
+        if error is not None:
+            drop_trace(action.username)
+        self.actions.pop(action.action_id, None)
+        if self.by_user.get(action.username) == action.action_id:
+            del self.by_user[action.username]
+        self.journal.append({"op": "done", "id": action.action_id})
+        OUTBOX_METRICS["depth"] = len(self.actions)
+        waiter = self._waiters.pop(action.action_id, None)
+        if (
+            waiter is not None
+            and not waiter.done()
+            and waiter.get_loop() is asyncio.get_running_loop()
+        ):
+            waiter.set_result(error)
+
+    def _pop_ready(self, now: float) -> list[PanelAction]:
+        batch = []
+        while self.ready_heap and len(batch) < self.batch_size:
+            ready_at, action_id = self.ready_heap[0]
+            action = self.actions.get(action_id)
+            if action is None or action.ready_at != ready_at:
+                heapq.heappop(self.ready_heap)  # finished or rescheduled since
+                continue
+            if ready_at > now:
+                break
+            heapq.heappop(self.ready_heap)
+            batch.append(action)
+        return batch
+
+    def _next_ready_at(self) -> float | None:
+        while self.ready_heap:
+            ready_at, action_id = self.ready_heap[0]
+            action = self.actions.get(action_id)
+            if action is not None and action.ready_at == ready_at:
+                return ready_at
+            heapq.heappop(self.ready_heap)
+        return None
+
+    async def _apply(
+        self,
+        client: httpx.AsyncClient,
+        panel_data: PanelType,
+        action: PanelAction,
+        headers: dict,
+    ) -> int | None:
+        """Send one action, returns None on success or the HTTP status code."""
+        action.attempts += 1
+        if action.check_first:
+            current_status = await get_user_status(
+                client, panel_data, action.username, headers
+            )
+            if current_status == "":
+                return 404
+            if current_status == action.status:
+                OUTBOX_METRICS["skipped"] += 1
+                return None
+        error_code = await set_user_status(
+            client, panel_data, action.username, action.status, headers
+        )
+        if error_code is None:
+            OUTBOX_METRICS["applied"] += 1
+        return error_code
+
+    async def _confirmed(self, action: PanelAction) -> None:
+        latency = time.time() - action.created_at
+        OUTBOX_METRICS["drain_latency_last"] = latency
+        OUTBOX_METRICS["drain_latency_max"] = max(
+            OUTBOX_METRICS["drain_latency_max"], latency
+        )
+        OUTBOX_METRICS["drain_latency_sum"] += latency
+        logger.info("Disabled user: %s", action.username, extra={"user": action.username})
+        trace_enforced(action.username)
+        # always set a new disable time: a user disabled again while it was being
+        # enabled must stay disabled and is enabled 'TIME_TO_ACTIVE_USERS' after this
+        await DisabledUsers().add_user(action.username)
+        self._finish(action)
+
+    async def _retry_later(self, action: PanelAction, error_code: int) -> None:
+        action.error = f"HTTP {error_code}" if error_code else "connection error"
+        action.check_first = True
+        action.ready_at = time.time() + min(
+            300, random.randint(2, 5) * action.attempts
+        )
+        heapq.heappush(self.ready_heap, (action.ready_at, action.action_id))
+        OUTBOX_METRICS["retries"] += 1
+        if action.attempts == 5:
+            await send_logs(
+                f"Panel action <code>{action.status}</code> for "
+                + f"<code>{action.username}</code> failed 5 times ({action.error}),"
+                + " it stays queued and is retried."
+            )
+
+    async def drain_once(self, panel_data: PanelType, concurrency: int = 10) -> int:
+        """
+        Send one batch of ready actions to the panel with a single token.
+
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+            concurrency (int): The maximum number of requests in flight.
+
+        Returns:
+            int: The number of actions handled.
+        """
+        batch = self._pop_ready(time.time())
+        if not batch:
+            return 0
+        try:
+            get_panel_token = await get_token(panel_data)
+        except ValueError:
+            for action in batch:
+                await self._retry_later(action, 0)
+            return 0
+        headers = {"Authorization": f"Bearer {get_panel_token.panel_token}"}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(client: httpx.AsyncClient, action: PanelAction) -> None:
+            async with semaphore:
+                if action.action_id not in self.actions:
+                    return  # superseded while waiting
+                error_code = await self._apply(client, panel_data, action, headers)
+            if action.action_id not in self.actions:
+                return
+            if error_code is None:
+                await self._confirmed(action)
+            elif error_code == 404:
+                OUTBOX_METRICS["dropped"] += 1
+                logger.error("User %s not found, drop the panel action", action.username)
+                self._finish(action, "user not found")
+            else:
+                await self._retry_later(action, error_code)
+
+        async with panel_client() as client:
+            await asyncio.gather(*(send(client, action) for action in batch))
+        return len(batch)
+
+    async def run(self, panel_data: PanelType, concurrency: int = 10) -> None:
+        """
+        Drain the outbox forever, an unexpected error is logged and
+        the batch is tried again.
+
+        Args:
+            panel_data (PanelType): The credentials for the panel.
+            concurrency (int): The maximum number of requests in flight.
+        """
+        set_panel_priority(RequestPriority.ENFORCEMENT)
+        event = self._wakeup_event()
+        while True:
+            event.clear()
+            try:
+                if await self.drain_once(panel_data, concurrency):
+                    continue
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Panel outbox error, retry in 5 seconds")
+                # the actions of the failed batch left the heap, schedule all again
+                self.ready_heap = [
+                    (action.ready_at, action.action_id) for action in self.actions.values()
+                ]
+                heapq.heapify(self.ready_heap)
+                await asyncio.sleep(5)
+                continue
+            next_ready_at = self._next_ready_at()
+            timeout = 60 if next_ready_at is None else next_ready_at - time.time()
+            try:
+                await asyncio.wait_for(event.wait(), max(min(timeout, 60), 0))
+            except TimeoutError:
+                pass
+
+
+def get_outbox() -> PanelOutbox:
+    """
+    Returns the outbox of the process, the journal is read on the first call.
+    """
+    global OUTBOX  # pylint: disable=global-statement
+    if OUTBOX is None:
+        OUTBOX = PanelOutbox()
+    return OUTBOX
+
+
+def start_outbox(panel_data: PanelType, concurrency: int = 10) -> asyncio.Task:
+    """
+    Start the outbox worker if it is not running yet in this event loop.
+
+    Args:
+        panel_data (PanelType): The credentials for the panel.
+        concurrency (int): The maximum number of requests in flight.
+
+    Returns:
+        asyncio.Task: The worker task.
+    """
+    global OUTBOX_TASK  # pylint: disable=global-statement
+    if (
+        OUTBOX_TASK is None
+        or OUTBOX_TASK.done()
+        or OUTBOX_TASK.get_loop() is not asyncio.get_running_loop()
+    ):
+        OUTBOX_TASK = asyncio.create_task(
+            get_outbox().run(panel_data, concurrency), name="panel_outbox"
+        )
+    return OUTBOX_TASK
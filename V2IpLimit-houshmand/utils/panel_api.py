@@ -5,6 +5,10 @@ This module contains functions to interact with the panel API.
 import asyncio
 import random
 import sys
+import time
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from dataclasses import dataclass
 from ssl import SSLError
 
 try:
@@ -14,10 +18,16 @@ except ImportError:
     sys.exit()
 from telegram_bot.send_message import send_logs
 
-from utils.handel_dis_users import DISABLED_USERS, DisabledUsers
+from utils.handel_dis_users import DisabledUsers
 from utils.logs import logger
+from utils.metrics import TOKEN_REFRESHES
+from utils.panel_scheduler import RequestPriority, panel_client, set_panel_priority
 from utils.read_config import read_config
-from utils.types import NodeType, PanelType, UserType
+from utils.types import NodeType, PanelType, PanelUserType, UserStatus, UserType
+from utils.user_state import USER_STATE_METRICS, USER_STATES
+
+PANEL_SCHEMES: dict[str, str] = {}
+ENABLE_REPORT_INTERVAL = 300  # seconds between two summaries of a long re-enable run
 
 
 async def get_token(panel_data: PanelType) -> PanelType | ValueError:
@@ -42,11 +52,12 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
         for scheme in ["https", "http"]:
             url = f"{scheme}://{panel_data.panel_domain}/api/admin/token"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
+                async with panel_client() as client:
                     response = await client.post(url, data=payload, timeout=5)
                     response.raise_for_status()
                 json_obj = response.json()
                 panel_data.panel_token = json_obj["access_token"]
+                TOKEN_REFRESHES.inc(1)
                 return panel_data
             except httpx.HTTPStatusError:
                 message = f"[{response.status_code}] {response.text}"
@@ -70,111 +81,452 @@ async def get_token(panel_data: PanelType) -> PanelType | ValueError:
     raise ValueError(message)
 
 
-async def all_user(panel_data: PanelType) -> list[UserType] | ValueError:
+async def get_users_page(
+    client: httpx.AsyncClient,
+    panel_data: PanelType,
+    headers: dict,
+    offset: int,
+    limit: int,
+) -> dict:
     """
-    Get the list of all users from the panel API.
+    Get one page of the user list from the panel API.
 
     Args:
+        client (httpx.AsyncClient): The client used for the request.
         panel_data (PanelType): A PanelType object containing
         the username, password, and domain for the panel API.
+        headers (dict): The request headers (with the token, refreshed on 401).
+        offset (int): The index of the first user of the page.
+        limit (int): The number of users of the page.
 
     Returns:
-        list[user]: The list of usernames of all users.
+        dict: The decoded page ({"users": [...], "total": ...}).
 
     Raises:
-        ValueError: If the function fails to get the users from both the HTTP
-        and HTTPS endpoints.
+        ValueError: If the page could not be fetched after 5 attempts.
     """
-    for attempt in range(20):
-        get_panel_token = await get_token(panel_data)
-        if isinstance(get_panel_token, ValueError):
-            raise get_panel_token
-        token = get_panel_token.panel_token
-        headers = {
-            "Authorization": f"Bearer {token}",
-        }
-        for scheme in ["https", "http"]:
+    for attempt in range(5):
+        schemes = ["https", "http"]
+        if PANEL_SCHEMES.get(panel_data.panel_domain) == "http":
+            schemes.reverse()
+        for scheme in schemes:
             url = f"{scheme}://{panel_data.panel_domain}/api/users"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.get(url, headers=headers, timeout=10)
-                    response.raise_for_status()
-                user_inform = response.json()
-                return [
-                    UserType(name=user["username"]) for user in user_inform["users"]
-                ]
+                response = await client.get(
+                    url,
+                    params={"offset": offset, "limit": limit},
+                    headers=headers,
+                    timeout=30,
+                )
+                response.raise_for_status()
+                PANEL_SCHEMES[panel_data.panel_domain] = scheme
+                return response.json()
             except SSLError:
                 continue
             except httpx.HTTPStatusError:
-                message = f"[{response.status_code}] {response.text}"
-                await send_logs(message)
-                logger.error(message)
-                continue
+                logger.error("[%s] %s", response.status_code, response.text)
+                if response.status_code == 401:
+                    get_panel_token = await get_token(panel_data)
+                    headers["Authorization"] = f"Bearer {get_panel_token.panel_token}"
+                break
             except Exception as error:  # pylint: disable=broad-except
-                message = f"An unexpected error occurred: {error}"
-                await send_logs(message)
-                logger.error(message)
+                logger.error("An unexpected error occurred: %s", error)
                 continue
         await asyncio.sleep(random.randint(2, 5) * attempt)
-    message = (
-        "Failed to get users after 20 attempts. make sure the panel is running "
-        + "and the username and password are correct."
-    )
-    await send_logs(message)
-    logger.error(message)
-    raise ValueError(message)
+    raise ValueError(f"Failed to get the users {offset}-{offset + limit} after 5 attempts.")
 
 
-async def enable_all_user(panel_data: PanelType) -> None | ValueError:
+async def iter_users(
+    panel_data: PanelType, page_size: int = 1000, pages_in_flight: int = 3
+) -> AsyncIterator[PanelUserType]:
     """
-    Enable all users on the panel.
+    Stream the user list of the panel page by page.
+    Up to 'pages_in_flight' pages are requested at the same time,
+    the users are yielded in order as soon as their page arrives.
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+        page_size (int): The number of users per request.
+        pages_in_flight (int): The number of pages requested at the same time.
+
+    Yields:
+        PanelUserType: The name and status of each user.
+
+    Raises:
+        ValueError: If the function fails to get the token or a page.
+    """
+    get_panel_token = await get_token(panel_data)
+    if isinstance(get_panel_token, ValueError):
+        raise get_panel_token
+    headers = {"Authorization": f"Bearer {get_panel_token.panel_token}"}
+    async with panel_client() as client:
+        page = await get_users_page(client, panel_data, headers, 0, page_size)
+        for user in page["users"]:
+            yield PanelUserType(user["username"], UserStatus.from_panel(user.get("status")))
+        total = page.get("total")
+        if total is None or len(page["users"]) != page_size:
+            return  # everything was in the first page (or paging is not supported)
+        offsets = iter(range(page_size, total, page_size))
+        in_flight: deque[asyncio.Task] = deque()
+
+        def request_next_page() -> None:
+            offset = next(offsets, None)
+            if offset is not None:
+                in_flight.append(
+                    asyncio.create_task(
+                        get_users_page(client, panel_data, headers, offset, page_size)
+                    )
+                )
+
+        for _ in range(pages_in_flight):
+            request_next_page()
+        try:
+            while in_flight:
+                page = await in_flight.popleft()
+                request_next_page()
+                for user in page["users"]:
+                    yield PanelUserType(
+                        user["username"], UserStatus.from_panel(user.get("status"))
+                    )
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+
+async def all_user(panel_data: PanelType) -> list[PanelUserType] | ValueError:
+    """
+    Get the list of all users from the panel API.
 
     Args:
         panel_data (PanelType): A PanelType object containing
         the username, password, and domain for the panel API.
 
     Returns:
-        None
+        list[PanelUserType]: The name and status of all users.
 
     Raises:
-        ValueError: If the function fails to enable the users on both the HTTP
+        ValueError: If the function fails to get the users from both the HTTP
         and HTTPS endpoints.
     """
+    try:
+        return [user async for user in iter_users(panel_data)]
+    except ValueError as error:
+        message = (
+            f"Failed to get users: {error} Make sure the panel is running "
+            + "and the username and password are correct."
+        )
+        await send_logs(message)
+        logger.error(message)
+        raise ValueError(message) from error
+
+
+@dataclass
+class EnableState:
+    """
+    The retry state of one user in a bulk enable.
+
+    Attributes:
+        username (str): The username of the user.
+        attempts (int): The number of PUT requests sent for this user.
+        enabled (bool): True once the panel confirmed the user is active.
+        error (str | None): The last error, None if there was no error.
+    """
+
+    username: str
+    attempts: int = 0
+    enabled: bool = False
+    error: str | None = None
+
+
+async def set_user_status(
+    client: httpx.AsyncClient,
+    panel_data: PanelType,
+    username: str,
+    status: str,
+    headers: dict,
+) -> int | None:
+    """
+    Send one status change of a user to the panel.
+    The scheme that worked last time is tried first.
+
+    Args:
+        client (httpx.AsyncClient): The client used for the request.
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+        username (str): The username of the user.
+        status (str): The new status ("active" or "disabled").
+        headers (dict): The request headers (with the token).
+
+    Returns:
+        int | None: None on success, otherwise the HTTP status code (0 if
+        the panel could not be reached).
+    """
+    error_code = 0
+    schemes = ["https", "http"]
+    if PANEL_SCHEMES.get(panel_data.panel_domain) == "http":
+        schemes.reverse()
+    for scheme in schemes:
+        url = f"{scheme}://{panel_data.panel_domain}/api/user/{username}"
+        try:
+            response = await client.put(
+                url, json={"status": status}, headers=headers, timeout=5
+            )
+            response.raise_for_status()
+            PANEL_SCHEMES[panel_data.panel_domain] = scheme
+            USER_STATES.set(username, UserStatus.from_panel(status))
+            return None
+        except SSLError:
+            continue
+        except httpx.HTTPStatusError:
+            error_code = response.status_code
+            logger.error("[%s] %s", response.status_code, response.text)
+            return error_code
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("An unexpected error occurred: %s", error)
+            continue
+    return error_code
+
+
+async def get_user_status(
+    client: httpx.AsyncClient,
+    panel_data: PanelType,
+    username: str,
+    headers: dict,
+) -> str | None:
+    """
+    Get the current status of a user from the panel.
+
+    Args:
+        client (httpx.AsyncClient): The client used for the request.
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+        username (str): The username of the user.
+        headers (dict): The request headers (with the token).
+
+    Returns:
+        str | None: The status ("active", "disabled", ...), "" if the user
+        does not exist, None if the panel could not be asked.
+    """
+    schemes = ["https", "http"]
+    if PANEL_SCHEMES.get(panel_data.panel_domain) == "http":
+        schemes.reverse()
+    for scheme in schemes:
+        url = f"{scheme}://{panel_data.panel_domain}/api/user/{username}"
+        try:
+            response = await client.get(url, headers=headers, timeout=5)
+            if response.status_code == 404:
+                return ""
+            response.raise_for_status()
+            PANEL_SCHEMES[panel_data.panel_domain] = scheme
+            status = response.json().get("status")
+            USER_STATES.set(username, UserStatus.from_panel(status))
+            return status
+        except SSLError:
+            continue
+        except httpx.HTTPStatusError:
+            logger.error("[%s] %s", response.status_code, response.text)
+            return None
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("An unexpected error occurred: %s", error)
+            continue
+    return None
+
+
+async def enable_users_bulk(  # pylint: disable=too-many-locals,too-many-statements
+    panel_data: PanelType,
+    usernames: Iterable[str] | AsyncIterable[str],
+    concurrency: int = 10,
+    max_attempts: int = 5,
+) -> list[EnableState]:
+    """
+    Enable many users with a bounded number of requests in flight.
+    A failed user is retried later (2-5 x attempt seconds) without holding
+    a worker, so one slow user does not delay the others.
+    Users the user-state index knows as active are not sent again.
+    With an async iterable the first users are enabled while the
+    next ones are still being fetched.
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+        usernames (Iterable[str] | AsyncIterable[str]): The users to enable.
+        concurrency (int): The maximum number of requests in flight.
+        max_attempts (int): The number of attempts for each user.
+
+    Returns:
+        list[EnableState]: The final state of every user.
+
+    Raises:
+        ValueError: If the function fails to get a token (or the users).
+    """
+    states: list[EnableState] = []
+    seen: set[str] = set()
+    queue: asyncio.Queue[EnableState] = asyncio.Queue()
+    finished = asyncio.Event()
+    counts = {"pending": 0, "done": 0, "producing": 1}
+
+    def add(username: str) -> None:
+        if username in seen:
+            return
+        seen.add(username)
+        state = EnableState(username)
+        states.append(state)
+        state.enabled = USER_STATES.skip(username, UserStatus.ACTIVE)
+        if not state.enabled:
+            counts["pending"] += 1
+            queue.put_nowait(state)
+
+    def set_final() -> None:
+        counts["done"] += 1
+        if counts["done"] % max(1, counts["pending"] // 10) == 0:
+            logger.info(
+                "Enable users progress: %s/%s", counts["done"], counts["pending"]
+            )
+        if not counts["producing"] and counts["done"] == counts["pending"]:
+            finished.set()
+
+    async def produce() -> None:
+        if isinstance(usernames, AsyncIterable):
+            async for username in usernames:
+                add(username)
+        counts["producing"] = 0
+        if counts["done"] == counts["pending"]:
+            finished.set()
+
+    if not isinstance(usernames, AsyncIterable):
+        for username in usernames:
+            add(username)
+        if not counts["pending"]:
+            return states
     get_panel_token = await get_token(panel_data)
     if isinstance(get_panel_token, ValueError):
         raise get_panel_token
-    token = get_panel_token.panel_token
-    headers = {
-        "Authorization": f"Bearer {token}",
-    }
-    users = await all_user(panel_data)
-    if isinstance(users, ValueError):
-        raise users
-    for username in users:
-        for scheme in ["https", "http"]:  # add this later: save what scheme is used
-            url = f"{scheme}://{panel_data.panel_domain}/api/user/{username.name}"
-            status = {"status": "active"}
+    headers = {"Authorization": f"Bearer {get_panel_token.panel_token}"}
+    loop = asyncio.get_running_loop()
+
+    async def enable_once(client: httpx.AsyncClient, state: EnableState) -> bool:
+        """Send one enable of the user, returns True when it reached its final state."""
+        state.attempts += 1
+        error_code = await set_user_status(
+            client, panel_data, state.username, "active", headers
+        )
+        if error_code is None:
+            state.enabled = True
+            state.error = None
+            logger.info("Enabled user: %s", state.username)
+            return True
+        state.error = f"HTTP {error_code}" if error_code else "connection error"
+        if error_code == 401:
             try:
-                async with httpx.AsyncClient(verify=False) as client:
-                    response = await client.put(
-                        url, json=status, headers=headers, timeout=5
-                    )
-                    response.raise_for_status()
-                message = f"Enabled user: {username.name}"
-                await send_logs(message)
-                logger.info(message)
-                break
-            except SSLError:
-                continue
-            except httpx.HTTPStatusError:
-                message = f"[{response.status_code}] {response.text}"
-                await send_logs(message)
-                logger.error(message)
-                continue
+                get_panel_token = await get_token(panel_data)
+                headers["Authorization"] = f"Bearer {get_panel_token.panel_token}"
+            except ValueError as error:
+                state.error = str(error)
+        return state.attempts >= max_attempts or error_code == 404
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while True:
+            state = await queue.get()
+            try:
+                final = await enable_once(client, state)
             except Exception as error:  # pylint: disable=broad-except
-                message = f"An unexpected error occurred: {error}"
-                await send_logs(message)
-                logger.error(message)
+                # a worker must always settle its user, or the run never finishes
+                logger.exception("Failed to enable user %s", state.username)
+                state.error = f"unexpected error: {error}"
+                final = True
+            if final:
+                set_final()
+            else:
+                loop.call_later(
+                    random.randint(2, 5) * state.attempts, queue.put_nowait, state
+                )
+
+    async with panel_client() as client:
+        workers = [
+            asyncio.create_task(worker(client))
+            for _ in range(
+                concurrency
+                if isinstance(usernames, AsyncIterable)
+                else min(concurrency, counts["pending"])
+            )
+        ]
+        try:
+            await produce()
+            await finished.wait()
+        finally:
+            for task in workers:
+                task.cancel()
+    return states
+
+
+async def enable_users_with_report(
+    panel_data: PanelType, usernames: Iterable[str] | AsyncIterable[str]
+) -> list[EnableState]:
+    """
+    Run enable_users_bulk() with 'ENABLE_CONCURRENCY' from the config
+    and send one summary to the admins.
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+        usernames (Iterable[str] | AsyncIterable[str]): The users to enable.
+
+    Returns:
+        list[EnableState]: The final state of every user.
+    """
+    data = await read_config()
+    states = await enable_users_bulk(
+        panel_data, usernames, int(data.get("ENABLE_CONCURRENCY", 10))
+    )
+    await send_enable_report(states)
+    return states
+
+
+async def send_enable_report(states: list[EnableState]) -> None:
+    """
+    Send one summary of an enable run to the admins (nothing if it is empty).
+
+    Args:
+        states (list[EnableState]): The final state of every user.
+    """
+    if not states:
+        return
+    failed = [state for state in states if not state.enabled]
+    skipped = sum(1 for state in states if state.enabled and not state.attempts)
+    message = f"Enabled users: <b>{len(states) - len(failed)}</b>/{len(states)}"
+    if skipped:
+        message += f" (already active: {skipped})"
+    if failed:
+        message += "\nFailed: " + ", ".join(
+            f"<code>{state.username}</code> ({state.error})" for state in failed[:50]
+        )
+    await send_logs(message)
+    logger.info(message)
+
+
+async def enable_all_user(panel_data: PanelType) -> None | ValueError:
+    """
+    Enable all users on the panel.
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the function fails to get the token or the users.
+    """
+    await enable_users_with_report(
+        panel_data,
+        (
+            user.name
+            async for user in iter_users(panel_data)
+            if user.status is not UserStatus.ACTIVE
+        ),
+    )
     logger.info("Enabled all users")
 
 
@@ -193,60 +545,24 @@ async def enable_selected_users(
         None
 
     Raises:
-        ValueError: If the function fails to enable the users on both the HTTP
-        and HTTPS endpoints.
+        ValueError: If some users could not be enabled after 5 attempts
+        (every user is tried before raising).
     """
-    for username in inactive_users:
-        success = False
-        for attempt in range(5):
-            get_panel_token = await get_token(panel_data)
-            if isinstance(get_panel_token, ValueError):
-                raise get_panel_token
-            token = get_panel_token.panel_token
-            headers = {
-                "Authorization": f"Bearer {token}",
-            }
-            status = {"status": "active"}
-            for scheme in ["https", "http"]:
-                url = f"{scheme}://{panel_data.panel_domain}/api/user/{username}"
-                try:
-                    async with httpx.AsyncClient(verify=False) as client:
-                        response = await client.put(
-                            url, json=status, headers=headers, timeout=5
-                        )
-                        response.raise_for_status()
-                    message = f"Enabled user: {username}"
-                    await send_logs(message)
-                    logger.info(message)
-                    success = True
-                    break
-                except SSLError:
-                    continue
-                except httpx.HTTPStatusError:
-                    message = f"[{response.status_code}] {response.text}"
-                    await send_logs(message)
-                    logger.error(message)
-                    continue
-                except Exception as error:  # pylint: disable=broad-except
-                    message = f"An unexpected error occurred: {error}"
-                    await send_logs(message)
-                    logger.error(message)
-                    continue
-            if success:
-                break
-            await asyncio.sleep(random.randint(2, 5) * attempt)
-        if not success:
-            message = (
-                f"Failed enable user: {username} after 20 attempts. Make sure the panel is running "
-                + "and the username and password are correct."
-            )
-            await send_logs(message)
-            logger.error(message)
-            raise ValueError(message)
+    states = await enable_users_with_report(panel_data, list(inactive_users))
+    failed = [state.username for state in states if not state.enabled]
+    if failed:
+        message = (
+            f"Failed enable users: {', '.join(failed)} after 5 attempts."
+            + " Make sure the panel is running and the username and password are correct."
+        )
+        logger.error(message)
+        raise ValueError(message)
     logger.info("Enabled selected users")
 
 
-async def disable_user(panel_data: PanelType, username: UserType) -> None | ValueError:
+async def disable_user(
+    panel_data: PanelType, username: UserType, notify: bool = True
+) -> None | ValueError:
     """
     Disable a user on the panel.
 
@@ -254,6 +570,8 @@ async def disable_user(panel_data: PanelType, username: UserType) -> None | Valu
         panel_data (PanelType): A PanelType object containing
         the username, password, and domain for the panel API.
         username (user): The username of the user to disable.
+        notify (bool): Send "Disabled user" to the admins
+        (False when the caller sends a summary instead).
 
     Returns:
         None
@@ -274,13 +592,15 @@ async def disable_user(panel_data: PanelType, username: UserType) -> None | Valu
         for scheme in ["https", "http"]:
             url = f"{scheme}://{panel_data.panel_domain}/api/user/{username.name}"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
+                async with panel_client() as client:
                     response = await client.put(
                         url, json=status, headers=headers, timeout=5
                     )
                     response.raise_for_status()
+                USER_STATES.set(username.name, UserStatus.DISABLE)
                 message = f"Disabled user: {username.name}"
-                await send_logs(message)
+                if notify:
+                    await send_logs(message)
                 logger.info(message)
                 dis_obj = DisabledUsers()
                 await dis_obj.add_user(username.name)
@@ -334,7 +654,7 @@ async def get_nodes(panel_data: PanelType) -> list[NodeType] | ValueError:
         for scheme in ["https", "http"]:
             url = f"{scheme}://{panel_data.panel_domain}/api/nodes"
             try:
-                async with httpx.AsyncClient(verify=False) as client:
+                async with panel_client() as client:
                     response = await client.get(url, headers=headers, timeout=10)
                     response.raise_for_status()
                 user_inform = response.json()
@@ -373,12 +693,101 @@ async def get_nodes(panel_data: PanelType) -> list[NodeType] | ValueError:
 
 async def enable_dis_user(panel_data: PanelType):
     """
-    Enable disabled users every 'TIME_TO_ACTIVE_USERS' seconds.
+    Enable every disabled user 'TIME_TO_ACTIVE_USERS' seconds after its own disable.
+    At most 'ENABLE_RATE' users (default 5) are enabled per second so the
+    panel writes are spread over time, users that fail are tried again a minute later.
+    One summary is sent when no user is due anymore, or every
+    ENABLE_REPORT_INTERVAL seconds during a long run.
     """
+    set_panel_priority(RequestPriority.REENABLE)
     dis_obj = DisabledUsers()
+    dis_obj.rebuild_schedule()
+    sweep: dict[str, EnableState] = {}  # the states not reported yet, by username
+    sweep_started = 0.0
+    while True:
+        data = await read_config()
+        time_to_active = int(data["TIME_TO_ACTIVE_USERS"])
+        rate = max(1, int(data.get("ENABLE_RATE", 5)))
+        now = time.time()
+        due_users = dis_obj.pop_due_users(now - time_to_active, rate)
+        if due_users:
+            # the disable times, a user disabled again meanwhile is kept
+            scheduled = dis_obj.disabled_times(due_users)
+            try:
+                states = await enable_users_bulk(
+                    panel_data, due_users, int(data.get("ENABLE_CONCURRENCY", 10))
+                )
+            except ValueError as error:
+                logger.error(error)
+                await dis_obj.postpone_users(
+                    due_users, now - time_to_active + 60, scheduled
+                )
+                await asyncio.sleep(1)
+                continue
+            await dis_obj.remove_users(
+                [state.username for state in states if state.enabled], scheduled
+            )
+            failed = [state.username for state in states if not state.enabled]
+            if failed:
+                await dis_obj.postpone_users(
+                    failed, now - time_to_active + 60, scheduled
+                )
+            sweep_started = sweep_started or now
+            sweep.update((state.username, state) for state in states)
+            if now - sweep_started >= ENABLE_REPORT_INTERVAL:
+                await send_enable_report(list(sweep.values()))
+                sweep.clear()
+                sweep_started = 0.0
+            await asyncio.sleep(1)
+            continue
+        if sweep:
+            await send_enable_report(list(sweep.values()))
+            sweep.clear()
+            sweep_started = 0.0
+        next_disabled_at = dis_obj.next_disabled_at()
+        if next_disabled_at is None:
+            await dis_obj.wait_for_change(60)
+        else:
+            await dis_obj.wait_for_change(
+                min(next_disabled_at + time_to_active - now, 60)
+            )
+
+
+async def refresh_user_states(panel_data: PanelType) -> None:
+    """
+    Fill the user-state index with the status of every user of the panel
+    (the whole user list is read on every refresh).
+
+    Args:
+        panel_data (PanelType): A PanelType object containing
+        the username, password, and domain for the panel API.
+
+    Raises:
+        ValueError: If the function fails to get the users.
+    """
+    started_at = time.time()
+    users = await all_user(panel_data)
+    if isinstance(users, ValueError):
+        raise users
+    USER_STATES.update(users, started_at)
+    logger.info(
+        "User-state index refreshed: %s users in %.1fs "
+        + "(skipped requests so far: %s)",
+        len(users),
+        time.time() - started_at,
+        USER_STATE_METRICS["skipped_requests"],
+    )
+
+
+async def run_user_state_refresh(panel_data: PanelType) -> None:
+    """
+    Refresh the user-state index every 'USER_STATE_REFRESH' seconds (default 600),
+    between two refreshes it is kept up to date by our own writes.
+    """
     while True:
+        try:
+            await refresh_user_states(panel_data)
+        except ValueError as error:
+            logger.error(error)
         data = await read_config()
-        await asyncio.sleep(int(data["TIME_TO_ACTIVE_USERS"]))
-        if DISABLED_USERS:
-            await enable_selected_users(panel_data, DISABLED_USERS)
-            await dis_obj.read_and_clear_users()
+        await asyncio.sleep(int(data.get("USER_STATE_REFRESH", 600)))
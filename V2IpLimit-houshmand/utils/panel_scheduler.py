@@ -0,0 +1,341 @@
+"""
+This module contains the scheduler that every panel API request goes through.
+It limits the request rate with a token bucket, gives the tokens to the
+most important requests first, caps the concurrent requests per endpoint
+and pauses all requests when the panel answers 429/503 with Retry-After.
+"""
+
+import asyncio
+import heapq
+import itertools
+import sys
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+
+try:
+    import httpx
+except ImportError:
+    print("Module 'httpx' is not installed use: 'pip install httpx' to install it")
+    sys.exit()
+
+from utils.logs import logger
+from utils.metrics import PANEL_ERRORS, PANEL_REQUEST_SECONDS
+
+
+class RequestPriority(IntEnum):
+    """
+    The priority classes of panel requests (lower value is served first).
+
+    Attributes:
+        ENFORCEMENT (int): Disabling users over the limit.
+        REENABLE (int): Enabling users again.
+        NODES (int): Node discovery and node status checks.
+        REPORTING (int): User lists, reports and bot commands.
+    """
+
+    ENFORCEMENT = 0
+    REENABLE = 1
+    NODES = 2
+    REPORTING = 3
+
+
+PANEL_PRIORITY: ContextVar[RequestPriority] = ContextVar(
+    "PANEL_PRIORITY", default=RequestPriority.REPORTING
+)
+ENDPOINT_LIMITS: dict[str, int] = {
+    "token": 2,
+    "users": 3,
+    "user": 20,
+    "nodes": 2,
+    "other": 5,
+}
+SCHEDULER_METRICS: dict[str, dict] = {
+    "requests": {priority.name: 0 for priority in RequestPriority},
+    "wait_seconds": {priority.name: 0.0 for priority in RequestPriority},
+    "throttled": {"429": 0, "503": 0},
+}
+
+
+def set_panel_priority(priority: RequestPriority) -> None:
+    """
+    Set the priority of the panel requests of the current task
+    (and of the tasks it creates afterwards).
+
+    Args:
+        priority (RequestPriority): The priority class.
+    """
+    PANEL_PRIORITY.set(priority)
+
+
+def endpoint_of(path: str) -> str:
+    """
+    Returns the endpoint group of a panel URL path.
+
+    Args:
+        path (str): The URL path, for example "/api/user/test".
+
+    Returns:
+        str: "token", "users", "user", "nodes" or "other".
+    """
+    if path.startswith("/api/admin/token"):
+        return "token"
+    if path.startswith("/api/users"):
+        return "users"
+    if path.startswith("/api/user/"):
+        return "user"
+    if path.startswith("/api/nodes"):
+        return "nodes"
+    return "other"
+
+
+def parse_retry_after(value: str | None, maximum: float = 300) -> float | None:
+    """
+    Parse a Retry-After header (seconds or an HTTP date).
+
+    Args:
+        value (str | None): The header value.
+        maximum (float): The longest pause accepted.
+
+    Returns:
+        float | None: The seconds to wait, None if there is no valid header.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), maximum)
+
+
+class EndpointSlots:
+    """
+    The concurrency cap of one endpoint group, a free slot is given
+    to the most important waiting request first.
+
+    Args:
+        limit (int): The maximum number of concurrent requests.
+    """
+
+    def __init__(self, limit: int):
+        self.free = limit
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: RequestPriority) -> None:
+        """
+        Wait for a free slot.
+
+        Args:
+            priority (RequestPriority): The priority class of the request.
+        """
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was already handed to this request
+            raise
+
+    def release(self) -> None:
+        """Give the slot to the most important waiting request or free it."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():  # skip the requests cancelled while waiting
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class PanelScheduler:  # pylint: disable=too-many-instance-attributes
+    """
+    A token bucket with priority ordered waiters and per-endpoint concurrency caps.
+
+    Args:
+        rate (float): The number of requests per second.
+        burst (int): The number of requests that can be sent at once.
+        endpoint_limits (dict[str, int] | None): The maximum number of
+            concurrent requests per endpoint group.
+    """
+
+    def __init__(
+        self,
+        rate: float = 20.0,
+        burst: int = 40,
+        endpoint_limits: dict[str, int] | None = None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.endpoint_limits = {**ENDPOINT_LIMITS, **(endpoint_limits or {})}
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._slots: dict[str, EndpointSlots] = {}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._dispatcher: asyncio.Task | None = None
+
+    def configure(self, rate: float, burst: int) -> None:
+        """
+        Change the rate limit.
+
+        Args:
+            rate (float): The number of requests per second.
+            burst (int): The number of requests that can be sent at once.
+        """
+        self._refill()
+        self.rate = max(rate, 0.1)
+        self.burst = max(burst, 1)
+        self.tokens = min(self.tokens, self.burst)
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        """Reset the asyncio objects when the event loop changed (main() restarts it)."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._slots = {}
+            self._waiters = []
+            self._dispatcher = None
+        return loop
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop sending requests for 'seconds' (Retry-After of the panel).
+
+        Args:
+            seconds (float): The pause length.
+        """
+        paused_until = time.monotonic() + seconds
+        if paused_until > self.paused_until:
+            self.paused_until = paused_until
+            logger.warning("Panel asked to slow down, pause requests for %.1fs", seconds)
+
+    async def _take_token(self, priority: RequestPriority) -> None:
+        loop = self._bind()
+        self._refill()
+        if not self._waiters and self.tokens >= 1 and time.monotonic() >= self.paused_until:
+            self.tokens -= 1
+            return
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch(), name="panel_scheduler")
+        await future
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # the request was cancelled while waiting
+            self.tokens -= 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, priority: RequestPriority | None = None):
+        """
+        Wait for a token and then for a free slot of the endpoint, then run the request.
+        Both are given in priority order, so a request that waits for a busy
+        endpoint never holds back a more important one.
+
+        Args:
+            endpoint (str): The endpoint group (see endpoint_of()).
+            priority (RequestPriority | None): The priority class,
+                the priority of the current task if None.
+        """
+        self._bind()
+        if priority is None:
+            priority = PANEL_PRIORITY.get()
+        slots = self._slots.get(endpoint)
+        if slots is None:
+            slots = self._slots[endpoint] = EndpointSlots(
+                self.endpoint_limits.get(endpoint, self.endpoint_limits["other"])
+            )
+        start = time.monotonic()
+        await self._take_token(priority)
+        await slots.acquire(priority)
+        try:
+            SCHEDULER_METRICS["requests"][priority.name] += 1
+            SCHEDULER_METRICS["wait_seconds"][priority.name] += time.monotonic() - start
+            yield
+        finally:
+            slots.release()
+
+
+PANEL_SCHEDULER = PanelScheduler()
+
+
+class ScheduledTransport(httpx.AsyncHTTPTransport):
+    """
+    An httpx transport that sends every request through PANEL_SCHEDULER.
+    Requests answered with 429/503 and a Retry-After header are sent again
+    (up to 3 times) after the pause.
+    """
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_of(request.url.path)
+        for attempt in range(3):
+            async with PANEL_SCHEDULER.slot(endpoint):
+                start = time.monotonic()
+                try:
+                    response = await super().handle_async_request(request)
+                except Exception as error:
+                    PANEL_ERRORS.inc(1, endpoint, type(error).__name__)
+                    raise
+                PANEL_REQUEST_SECONDS.observe(time.monotonic() - start, endpoint)
+            if response.status_code >= 400:
+                PANEL_ERRORS.inc(1, endpoint, str(response.status_code))
+            if response.status_code not in (429, 503) or attempt == 2:
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            SCHEDULER_METRICS["throttled"][str(response.status_code)] += 1
+            if retry_after is None:
+                return response
+            await response.aclose()
+            PANEL_SCHEDULER.pause(retry_after)
+        return response
+
+
+def panel_client(**kwargs) -> httpx.AsyncClient:
+    """
+    Returns an AsyncClient for the panel API whose requests go through the scheduler.
+    """
+    return httpx.AsyncClient(
+        verify=False, transport=ScheduledTransport(verify=False), **kwargs
+    )
+
+
+def configure_scheduler(config_data: dict) -> None:
+    """
+    Apply 'PANEL_RATE' (requests per second, default 20) and
+    'PANEL_BURST' (default 40) from the config.
+
+    Args:
+        config_data (dict): The config.
+    """
+    PANEL_SCHEDULER.configure(
+        float(config_data.get("PANEL_RATE", 20)), int(config_data.get("PANEL_BURST", 40))
+    )
@@ -6,8 +6,12 @@ import ipaddress
 import random
 import re
 import sys
+import time
+from functools import lru_cache
 
 from utils.check_usage import ACTIVE_USERS
+from utils.latency import finish_stamp, new_stamp
+from utils.metrics import GEO_LOOKUPS, LOG_FRAMES, LOG_LINES, PARSE_SECONDS
 from utils.read_config import read_config
 from utils.types import UserType
 
@@ -34,6 +38,8 @@ INVALID_IPS = {
 VALID_IPS = []
 CACHE = {}
 
+USERNAME_ID_REGEX = re.compile(r"^\d+\.")
+
 API_ENDPOINTS = {
     "http://ip-api.com/json/": "countryCode",
     "https://ipinfo.io/": "country",
@@ -51,7 +57,7 @@ async def remove_id_from_username(username: str) -> str:
     Returns:
         str: The username with the ID removed.
     """
-    return re.sub(r"^\d+\.", "", username)
+    return USERNAME_ID_REGEX.sub("", username)
 
 
 async def check_ip(ip_address: str) -> None | str:
@@ -68,7 +74,9 @@ async def check_ip(ip_address: str) -> None | str:
         str: The country code of the IP address location, or None
     """
     if ip_address in CACHE:
+        GEO_LOOKUPS.inc(1, "hit")
         return CACHE[ip_address]
+    GEO_LOOKUPS.inc(1, "miss")
     endpoint, key = random.choice(list(API_ENDPOINTS.items()))
     url = endpoint + ip_address
     if "ipapi.co" in endpoint:
@@ -82,6 +90,7 @@ async def check_ip(ip_address: str) -> None | str:
             CACHE[ip_address] = country
         return country
     except Exception:  # pylint: disable=broad-except
+        GEO_LOOKUPS.inc(1, "error")
         return None
 
 
@@ -97,6 +106,20 @@ async def is_valid_ip(ip: str) -> bool:
     Returns:
         bool: True if the string is a valid IP address, False otherwise.
     """
+    return is_public_ip(ip)
+
+
+@lru_cache(maxsize=65536)
+def is_public_ip(ip: str) -> bool:
+    """
+    Cached check used by is_valid_ip(), the same IPs show up in almost every log frame.
+
+    Args:
+        ip (str): The string to check.
+
+    Returns:
+        bool: True if the string is a valid public IP address, False otherwise.
+    """
     try:
         ip_obj = ipaddress.ip_address(ip)
         return not ip_obj.is_private
@@ -109,27 +132,36 @@ IP_V4_REGEX = re.compile(r"(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})")
 EMAIL_REGEX = re.compile(r"email:\s*([A-Za-z0-9._%+-]+)")
 
 
-async def parse_logs(log: str) -> dict[str, UserType] | dict:  # pylint: disable=too-many-branches
+async def parse_logs(  # pylint: disable=too-many-branches,too-many-locals,too-many-statements
+    log: str, node: str | None = None, received: float | None = None
+) -> dict[str, UserType] | dict:
     """
     Asynchronously parse logs to extract and validate IP addresses and emails.
 
     Args:
         log (str): The log to parse.
+        node (str | None): The name of the node that sent the log.
+        received (float | None): The time the log was received (default: now).
 
     Returns:
         list[UserType]
     """
+    start = time.perf_counter()
     data = await read_config()
     if data.get("INVALID_IPS"):
         INVALID_IPS.update(data.get("INVALID_IPS"))
     lines = log.splitlines()
+    node_label = node or "unknown"
+    LOG_FRAMES.inc(1, node_label)
+    LOG_LINES.inc(len(lines), node_label)
+    stamp = None
     for line in lines:
         if "accepted" not in line:
             continue
         if "BLOCK]" in line:
             continue
         ip_v6_match = IP_V6_REGEX.search(line)
-        ip_v4_match = IP_V4_REGEX.search(line)
+        ip_v4_match = None if ip_v6_match else IP_V4_REGEX.search(line)
         email_match = EMAIL_REGEX.search(line)
         if ip_v6_match:
             ip = ip_v6_match.group(1)
@@ -157,13 +189,22 @@ async def parse_logs(log: str) -> dict[str, UserType] | dict:  # pylint: disable
         else:
             continue
 
+        if stamp is None:
+            stamp = new_stamp(line, received or time.time(), node_label)
         user = ACTIVE_USERS.get(email)
         if user:
             user.ip.append(ip)
+            if ip not in user.first_seen:
+                user.first_seen[ip] = stamp
         else:
             user = ACTIVE_USERS.setdefault(
                 email,
-                UserType(name=email, ip=[ip]),
+                UserType(name=email, ip=[ip], first_seen={ip: stamp}),
             )
+        if node:
+            user.nodes.add(node)
 
+    if stamp is not None:
+        finish_stamp(stamp)
+    PARSE_SECONDS.observe(time.perf_counter() - start, node_label)
     return ACTIVE_USERS
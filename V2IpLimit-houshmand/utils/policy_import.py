@@ -0,0 +1,208 @@
+"""
+This module reads the special limits and except users of an uploaded file
+(bulk import with /import_limits) and builds the rows of /export_limits.
+
+Formats (optionally gzip'd, like the exported .csv.gz):
+    .csv    "username,limit" rows
+    .jsonl  {"username": ..., "limit": ...} lines
+    .json   {"SPECIAL_LIMIT": {...}, "EXCEPT_USERS": [...]} (like an old config.json)
+The limit is a number of at least 1, "except" (no limit), "remove" (remove
+the special limit) or "remove_except" (remove from the except users).
+"""
+
+import csv
+import gzip
+import json
+import os
+from dataclasses import dataclass, field
+
+from utils.policy_store import PolicyStore
+
+MAX_IMPORT_ROWS = 200_000
+MAX_IMPORT_ERRORS = 20  # errors listed in the reply
+EXPORT_HEADER = ("username", "limit")
+
+
+@dataclass
+class PolicyChanges:
+    """
+    The changes read from an import file. When a user has several rows
+    the last one wins: the last number or "remove" for the special limit,
+    the last "except" or "remove_except" for the except users.
+
+    Attributes:
+        limit_actions (dict[str, int | None]): The special limit of each user,
+            None to remove it.
+        except_actions (dict[str, bool]): True to add the user to the except
+            users, False to remove it.
+        rows (int): The number of rows read.
+        errors (list[str]): The first invalid rows (line and reason).
+        error_count (int): The number of invalid rows.
+    """
+
+    limit_actions: dict[str, int | None] = field(default_factory=dict)
+    except_actions: dict[str, bool] = field(default_factory=dict)
+    rows: int = 0
+    errors: list[str] = field(default_factory=list)
+    error_count: int = 0
+
+    @property
+    def limits(self) -> dict[str, int]:
+        """The special limits to set."""
+        return {
+            username: limit
+            for username, limit in self.limit_actions.items()
+            if limit is not None
+        }
+
+    @property
+    def remove_limits(self) -> list[str]:
+        """The users whose special limit is removed."""
+        return [username for username, limit in self.limit_actions.items() if limit is None]
+
+    @property
+    def add_except(self) -> list[str]:
+        """The users added to the except users."""
+        return [username for username, add in self.except_actions.items() if add]
+
+    @property
+    def remove_except(self) -> list[str]:
+        """The users removed from the except users."""
+        return [username for username, add in self.except_actions.items() if not add]
+
+    def error(self, line: int, reason: str) -> None:
+        """
+        Record an invalid row.
+
+        Args:
+            line (int): The line (or position) of the row.
+            reason (str): Why it is invalid.
+        """
+        self.error_count += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append(f"{line}: {reason}")
+
+    def add(self, line: int, username, limit) -> None:
+        """
+        Validate one row and add it to the changes.
+
+        Args:
+            line (int): The line (or position) of the row.
+            username: The username.
+            limit: A number of at least 1, "except", "remove" or "remove_except".
+        """
+        self.rows += 1
+        if self.rows > MAX_IMPORT_ROWS:
+            self.error(line, f"more than {MAX_IMPORT_ROWS} rows")
+            return
+        username = str(username or "").strip()
+        if not username or any(char.isspace() for char in username):
+            self.error(line, f"invalid username {username!r}")
+            return
+        action = str(limit if limit is not None else "").strip().lower()
+        if action == "except":
+            self.except_actions[username] = True
+        elif action == "remove":
+            self.limit_actions[username] = None
+        elif action == "remove_except":
+            self.except_actions[username] = False
+        elif action.isdecimal() and action.isascii():
+            if int(action) < 1:
+                self.error(line, f"the limit of {username} must be at least 1")
+                return
+            self.limit_actions[username] = int(action)
+        else:
+            self.error(line, f"invalid limit {limit!r} for {username}")
+
+
+def _read_csv(file, changes: PolicyChanges) -> None:
+    reader = csv.reader(file)
+    for row in reader:
+        if reader.line_num == 1 and row and row[0].strip().lower() == "username":
+            continue  # the header
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) != 2:
+            changes.error(reader.line_num, "expected 2 columns")
+            continue
+        changes.add(reader.line_num, row[0], row[1])
+
+
+def _read_jsonl(file, changes: PolicyChanges) -> None:
+    for line_num, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            changes.add(line_num, record["username"], record["limit"])
+        except (json.JSONDecodeError, KeyError, TypeError) as error:
+            changes.error(line_num, f"invalid line ({error})")
+
+
+def _read_json(file, changes: PolicyChanges) -> None:
+    data = json.load(file)
+    if not isinstance(data, dict):
+        raise ValueError("The JSON file must be an object")
+    special_limit = data.get("SPECIAL_LIMIT") or {}
+    except_users = data.get("EXCEPT_USERS") or []
+    if not isinstance(special_limit, dict):
+        raise ValueError("SPECIAL_LIMIT must be an object of username: limit")
+    if not isinstance(except_users, list):
+        raise ValueError("EXCEPT_USERS must be a list of usernames")
+    for position, (username, limit) in enumerate(special_limit.items(), 1):
+        changes.add(position, username, limit)
+    for position, username in enumerate(except_users, 1):
+        if isinstance(username, (dict, list)):
+            changes.error(position, f"invalid except user {username!r}")
+            continue
+        changes.add(position, username, "except")
+
+
+READERS = {".csv": _read_csv, ".jsonl": _read_jsonl, ".json": _read_json}
+
+
+def read_policy_file(path: str, filename: str) -> PolicyChanges:
+    """
+    Read and validate an import file row by row (run it in a worker thread).
+
+    Args:
+        path (str): The downloaded file.
+        filename (str): The name of the uploaded file (for its format).
+
+    Returns:
+        PolicyChanges: The changes and the invalid rows.
+
+    Raises:
+        ValueError: If the format is not supported or the file can not be read.
+    """
+    filename = filename.lower()
+    extension = os.path.splitext(filename.removesuffix(".gz"))[1]
+    if extension not in READERS:
+        raise ValueError("Send a .csv, .jsonl or .json file (it can be .gz)")
+    changes = PolicyChanges()
+    try:
+        if filename.endswith(".gz"):
+            file = gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+        else:
+            file = open(path, "r", encoding="utf-8-sig", newline="")  # pylint: disable=consider-using-with
+        with file:
+            READERS[extension](file, changes)
+    except (OSError, UnicodeDecodeError, csv.Error, json.JSONDecodeError) as error:
+        raise ValueError(f"Failed to read the file: {error}") from error
+    return changes
+
+
+def export_rows(store: PolicyStore) -> list[tuple[str, int | str]]:
+    """
+    The rows of /export_limits (a snapshot, it can be written from a worker thread).
+
+    Args:
+        store (PolicyStore): The policy store.
+
+    Returns:
+        list[tuple[str, int | str]]: The special limits, then the except users.
+    """
+    store.load()
+    rows: list[tuple[str, int | str]] = sorted(store.special_limits.items())
+    rows.extend((username, "except") for username in sorted(store.except_users))
+    return rows
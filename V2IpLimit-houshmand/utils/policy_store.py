@@ -0,0 +1,298 @@
+"""
+This module keeps the per-user tables (SPECIAL_LIMIT and EXCEPT_USERS)
+in a sqlite database instead of config.json.
+A change is one indexed row write instead of a rewrite of the config,
+the tables are also kept in memory for the limit checks.
+The tables of an existing config.json are moved to the database once
+(and again if they are added to the config by hand).
+"""
+
+import asyncio
+import sqlite3
+import threading
+from collections.abc import Callable
+from typing import Any
+
+from utils.config_store import CONFIG_STORE
+from utils.logs import logger
+
+POLICY_DB = ".policy.sqlite3"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS special_limits (
+    username TEXT PRIMARY KEY,
+    ip_limit INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS except_users (
+    username TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+
+def _prefix_range(prefix: str) -> tuple[str, str]:
+    """The bounds of the usernames starting with 'prefix' (uses the primary key index)."""
+    return prefix, prefix + "\U0010ffff"
+
+
+class PolicyStore:
+    """
+    The special limits and except users.
+    Reads come from memory, writes go to the database from a worker
+    thread first and then to memory.
+
+    Args:
+        filename (str): The sqlite database.
+    """
+
+    def __init__(self, filename: str = POLICY_DB):
+        self.filename = filename
+        self.special_limits: dict[str, int] = {}
+        self.except_users: set[str] = set()
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()  # one statement at a time on the connection
+        self._lock: tuple | None = None
+        self._subscribers: list[Callable[[], Any]] = []
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+        return self._lock[1]
+
+    def load(self) -> "PolicyStore":
+        """
+        Open the database and read the tables the first time.
+
+        Returns:
+            PolicyStore: The store.
+        """
+        if self._db is None:
+            with self._db_lock:
+                db = sqlite3.connect(self.filename, check_same_thread=False)
+                db.executescript(SCHEMA)
+                self.special_limits = dict(
+                    db.execute("SELECT username, ip_limit FROM special_limits")
+                )
+                self.except_users = {
+                    row[0] for row in db.execute("SELECT username FROM except_users")
+                }
+                self._db = db
+        return self
+
+    def subscribe(self, callback: Callable[[], Any]) -> None:
+        """
+        Call 'callback' after every change (a callback is only added once).
+
+        Args:
+            callback (Callable[[], Any]): The function to call.
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def _notify(self) -> None:
+        for callback in self._subscribers:
+            try:
+                callback()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Policy subscriber %s failed: %s", callback, error)
+
+    def _execute(self, statements: list[tuple[str, list]]) -> None:
+        """Run the statements in one transaction (in a worker thread)."""
+        with self._db_lock, self._db:
+            for sql, rows in statements:
+                self._db.executemany(sql, rows)
+
+    def _query(self, sql: str, params: tuple) -> list[tuple]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    async def write(
+        self,
+        limits: dict[str, int] | None = None,
+        remove_limits: list[str] | None = None,
+        add_except: list[str] | None = None,
+        remove_except: list[str] | None = None,
+    ) -> None:
+        """
+        Apply changes to both tables in one transaction.
+
+        Args:
+            limits (dict[str, int] | None): The special limits to set.
+            remove_limits (list[str] | None): The users whose special limit is removed.
+            add_except (list[str] | None): The users added to the except users.
+            remove_except (list[str] | None): The users removed from the except users.
+        """
+        self.load()
+        limits = limits or {}
+        remove_limits = remove_limits or []
+        add_except = add_except or []
+        remove_except = remove_except or []
+        async with self._get_lock():
+            await asyncio.to_thread(
+                self._execute,
+                [
+                    (
+                        "INSERT OR REPLACE INTO special_limits VALUES (?, ?)",
+                        list(limits.items()),
+                    ),
+                    (
+                        "DELETE FROM special_limits WHERE username = ?",
+                        [(user,) for user in remove_limits],
+                    ),
+                    (
+                        "INSERT OR IGNORE INTO except_users VALUES (?)",
+                        [(user,) for user in add_except],
+                    ),
+                    (
+                        "DELETE FROM except_users WHERE username = ?",
+                        [(user,) for user in remove_except],
+                    ),
+                ],
+            )
+            self.special_limits.update(limits)
+            for user in remove_limits:
+                self.special_limits.pop(user, None)
+            self.except_users.update(add_except)
+            self.except_users.difference_update(remove_except)
+            self._notify()
+
+    async def set_limit(self, username: str, limit: int) -> bool:
+        """
+        Set the special limit of a user.
+
+        Args:
+            username (str): The username.
+            limit (int): The number of IPs allowed.
+
+        Returns:
+            bool: True if the user had a special limit before.
+        """
+        set_before = username in self.load().special_limits
+        await self.write(limits={username: int(limit)})
+        return set_before
+
+    async def add_except(self, username: str) -> bool:
+        """
+        Add a user to the except users.
+
+        Args:
+            username (str): The username.
+
+        Returns:
+            bool: False if the user was already an except user.
+        """
+        if username in self.load().except_users:
+            return False
+        await self.write(add_except=[username])
+        return True
+
+    async def remove_except(self, username: str) -> bool:
+        """
+        Remove a user from the except users.
+
+        Args:
+            username (str): The username.
+
+        Returns:
+            bool: False if the user was not an except user.
+        """
+        if username not in self.load().except_users:
+            return False
+        await self.write(remove_except=[username])
+        return True
+
+    async def limits_with_prefix(self, prefix: str) -> list[tuple[str, int]]:
+        """
+        Returns the special limits of the usernames starting with 'prefix'.
+
+        Args:
+            prefix (str): The start of the usernames.
+
+        Returns:
+            list[tuple[str, int]]: The usernames and their limit, sorted by username.
+        """
+        self.load()
+        return await asyncio.to_thread(
+            self._query,
+            "SELECT username, ip_limit FROM special_limits"
+            + " WHERE username >= ? AND username < ? ORDER BY username",
+            _prefix_range(prefix),
+        )
+
+    async def except_users_with_prefix(self, prefix: str) -> list[str]:
+        """
+        Returns the except users whose username starts with 'prefix'.
+
+        Args:
+            prefix (str): The start of the usernames.
+
+        Returns:
+            list[str]: The usernames, sorted.
+        """
+        self.load()
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT username FROM except_users"
+            + " WHERE username >= ? AND username < ? ORDER BY username",
+            _prefix_range(prefix),
+        )
+        return [row[0] for row in rows]
+
+    def _backup(self, path: str) -> None:
+        target = sqlite3.connect(path)
+        try:
+            with self._db_lock:
+                self._db.backup(target)
+        finally:
+            target.close()
+
+    async def backup(self, path: str) -> None:
+        """
+        Copy the database to 'path' (a consistent copy, even during writes).
+
+        Args:
+            path (str): The file to write.
+        """
+        self.load()
+        await asyncio.to_thread(self._backup, path)
+
+    async def migrate_config(self) -> None:
+        """
+        Move SPECIAL_LIMIT and EXCEPT_USERS of config.json to the database
+        (they replace the rows of the same users) and remove them from the config.
+        Special limits that are not numbers are skipped with a warning.
+        """
+        config_data = CONFIG_STORE.get()
+        if "SPECIAL_LIMIT" not in config_data and "EXCEPT_USERS" not in config_data:
+            return
+        limits = {}
+        for username, limit in (config_data.get("SPECIAL_LIMIT") or {}).items():
+            try:
+                limits[username] = int(limit)
+            except (TypeError, ValueError):
+                logger.warning("Invalid special limit for %s: %r", username, limit)
+        except_users = [str(user) for user in config_data.get("EXCEPT_USERS") or []]
+        await self.write(limits=limits, add_except=except_users)
+
+        def remove_tables(config: dict) -> None:
+            config.pop("SPECIAL_LIMIT", None)
+            config.pop("EXCEPT_USERS", None)
+
+        await CONFIG_STORE.update(remove_tables)
+        logger.info(
+            "Moved %s special limits and %s except users from %s to %s",
+            len(limits),
+            len(except_users),
+            CONFIG_STORE.filename,
+            self.filename,
+        )
+
+
+POLICY_STORE = PolicyStore()
+
+
+def _on_config_change(config_data: dict) -> None:
+    if "SPECIAL_LIMIT" in config_data or "EXCEPT_USERS" in config_data:
+        asyncio.create_task(POLICY_STORE.migrate_config(), name="policy_migration")
+
+
+CONFIG_STORE.subscribe(_on_config_change)
@@ -0,0 +1,187 @@
+"""
+This module contains the profiling tools of the bot commands.
+A sampling profiler reads the stack of the event loop thread from another
+thread (nothing runs when no profile is taken) and writes the collapsed
+stacks used by flamegraph tools. tracemalloc snapshots show memory growth,
+tracing only runs between /memory_snapshot and /memory_snapshot stop.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+MAX_PROFILE_SECONDS = 300
+SAMPLE_INTERVAL = 0.005  # seconds between two samples
+PROFILER_STATE: dict = {"sampler": None, "snapshot": None}
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(";", ":")
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread.
+
+    Args:
+        thread_id (int): The thread to sample (the event loop thread).
+        interval (float): Seconds between two samples.
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()  # "root;...;leaf" -> samples
+        self.samples = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self.stop_event = threading.Event()
+
+    def run(self, seconds: float) -> None:
+        """
+        Take samples for 'seconds' or until stop() (blocking, run it in a thread).
+
+        Args:
+            seconds (float): The profile length.
+        """
+        self.started_at = time.monotonic()
+        deadline = self.started_at + seconds
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            self.stop_event.wait(self.interval)
+        self.duration = time.monotonic() - self.started_at
+
+    def stop(self) -> None:
+        """Stop taking samples."""
+        self.stop_event.set()
+
+    def top_functions(self, limit: int = 20) -> list[tuple[str, int, int]]:
+        """
+        Returns the functions seen in the most samples.
+
+        Args:
+            limit (int): The number of functions.
+
+        Returns:
+            list[tuple[str, int, int]]: The function, its own samples (it was running)
+                and its total samples (it was on the stack), most own samples first
+                (the event loop frames are on every stack).
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(limit)]
+
+    def write_collapsed(self, path: str) -> None:
+        """
+        Write the collapsed stacks ("root;...;leaf count" lines, the input of
+        flamegraph.pl and speedscope).
+
+        Args:
+            path (str): The file to write.
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def write_file(self) -> str:
+        """
+        Write the collapsed stacks to a new temp file (remove it with
+        utils.report_file.remove_report()).
+
+        Returns:
+            str: The path of the file.
+        """
+        name = time.strftime("profile-%Y%m%d-%H%M%S.folded")
+        path = os.path.join(tempfile.mkdtemp(prefix="v2iplimit-"), name)
+        self.write_collapsed(path)
+        return path
+
+
+def start_profile(thread_id: int) -> StackSampler:
+    """
+    Create the sampler of a new profile.
+
+    Args:
+        thread_id (int): The thread to sample.
+
+    Returns:
+        StackSampler: The sampler (call run() in a worker thread).
+
+    Raises:
+        ValueError: If a profile is already running.
+    """
+    sampler = PROFILER_STATE["sampler"]
+    if sampler is not None and not sampler.stop_event.is_set():
+        raise ValueError("A profile is already running")
+    sampler = PROFILER_STATE["sampler"] = StackSampler(thread_id)
+    return sampler
+
+
+def stop_profile() -> bool:
+    """
+    Stop the running profile early.
+
+    Returns:
+        bool: False if no profile was running.
+    """
+    sampler = PROFILER_STATE["sampler"]
+    if sampler is None or sampler.stop_event.is_set():
+        return False
+    sampler.stop()
+    return True
+
+
+def memory_snapshot(limit: int = 15) -> list[str]:
+    """
+    Start tracing memory allocations on the first call, the next calls
+    return the lines that grew the most since the previous call.
+
+    Args:
+        limit (int): The number of lines.
+
+    Returns:
+        list[str]: The biggest differences, empty on the first call.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        PROFILER_STATE["snapshot"] = tracemalloc.take_snapshot()
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    previous = PROFILER_STATE["snapshot"]
+    PROFILER_STATE["snapshot"] = snapshot
+    stats = snapshot.compare_to(previous, "lineno")
+    return [str(stat) for stat in stats[:limit]]
+
+
+def stop_memory_tracing() -> bool:
+    """
+    Stop tracing memory allocations (it slows down the program).
+
+    Returns:
+        bool: False if it was not tracing.
+    """
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    PROFILER_STATE["snapshot"] = None
+    return True
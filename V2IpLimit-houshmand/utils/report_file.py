@@ -0,0 +1,75 @@
+"""
+This module writes large reports to gzip'd CSV or JSON-lines files.
+Rows are streamed to the file from a worker thread, so the whole
+report is never built as one text in memory.
+"""
+
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+import time
+from collections.abc import Iterable, Sequence
+
+REPORT_INLINE_ROWS = 50  # smaller lists are sent as a text message
+
+
+def _write_rows(
+    path: str, header: Sequence[str], rows: Iterable[Sequence], file_format: str
+) -> int:
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as file:
+        if file_format == "jsonl":
+            for row in rows:
+                file.write(json.dumps(dict(zip(header, row)), ensure_ascii=False) + "\n")
+                count += 1
+        else:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+async def write_report(
+    name: str,
+    header: Sequence[str],
+    rows: Iterable[Sequence],
+    file_format: str = "csv",
+) -> str:
+    """
+    Write a report file in a worker thread.
+    The rows must not change while they are written (pass a snapshot).
+
+    Args:
+        name (str): The start of the file name, for example "usage".
+        header (Sequence[str]): The column names.
+        rows (Iterable[Sequence]): The rows, one value per column.
+        file_format (str): "csv" or "jsonl".
+
+    Returns:
+        str: The path of the .csv.gz or .jsonl.gz file (the caller deletes it).
+    """
+    if file_format not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown report format: {file_format}")
+    file_name = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.{file_format}.gz"
+    path = os.path.join(tempfile.mkdtemp(prefix="v2iplimit-"), file_name)
+    await asyncio.to_thread(_write_rows, path, header, rows, file_format)
+    return path
+
+
+def remove_report(path: str) -> None:
+    """
+    Delete a report file written by write_report() and its directory.
+
+    Args:
+        path (str): The path of the report file.
+    """
+    try:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
@@ -0,0 +1,390 @@
+"""
+This module contains a syslog receiver (UDP and TCP) for Xray instances
+that are not managed by the panel and forward their logs over syslog.
+The IP of every sender is added to INVALID_IPS, so a node that also
+shows up as a client in the logs (for example a relay) is never counted
+as an IP of a user.
+"""
+
+import asyncio
+import re
+import socket
+import time
+from dataclasses import dataclass
+
+from telegram_bot.send_message import send_logs
+from utils.logs import logger
+from utils.node_health import node_stream
+from utils.parse_logs import INVALID_IPS, parse_logs
+
+SYSLOG_STATS: dict[str, "SyslogSenderStats"] = {}
+
+XRAY_LINE_REGEX = re.compile(r"\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}")
+SYSLOG_HOSTNAME_REGEX = re.compile(
+    r"^<\d{1,3}>(?:1 \S+ (\S+)|\w{3} [ \d]\d \d{2}:\d{2}:\d{2} (\S+))"
+)
+SEQUENCE_ID_REGEX = re.compile(r'sequenceId="(\d+)"')
+OCTET_COUNT_REGEX = re.compile(rb"\d{1,10} <")
+
+
+@dataclass
+class SyslogSenderStats:  # pylint: disable=too-many-instance-attributes
+    """
+    Counters kept for every host that forwards logs to the syslog receiver.
+
+    Attributes:
+        node_name (str): The name used to tag the events of this sender.
+        packets (int): Number of datagrams or TCP frames received.
+        lines (int): Number of log lines received.
+        bytes (int): Number of bytes received.
+        last_sequence (int | None): The last RFC 5424 'sequenceId' seen.
+        lost (int): Messages missing according to the 'sequenceId' gaps.
+        out_of_order (int): Messages that arrived with an old 'sequenceId'.
+        dropped (int): Packets dropped here because the queue was full.
+        reported_lost (int): The 'lost' value at the time of the last alert.
+        reported_dropped (int): The 'dropped' value at the time of the last alert.
+        last_seen (float): Time of the last received packet.
+    """
+
+    node_name: str
+    packets: int = 0
+    lines: int = 0
+    bytes: int = 0
+    last_sequence: int | None = None
+    lost: int = 0
+    out_of_order: int = 0
+    dropped: int = 0
+    reported_lost: int = 0
+    reported_dropped: int = 0
+    last_seen: float = 0.0
+
+    def track_sequence(self, sequence: int) -> None:
+        """
+        Update the loss counters with a new 'sequenceId'.
+
+        Args:
+            sequence (int): The sequence id of the received message.
+        """
+        if self.last_sequence is None or sequence == 1:
+            self.last_sequence = sequence
+            return
+        expected = self.last_sequence + 1
+        if sequence > expected:
+            self.lost += sequence - expected
+        elif sequence < expected:
+            self.out_of_order += 1
+            return
+        self.last_sequence = sequence
+
+
+def tcp_framing(buffer: bytes) -> bool | None:
+    """
+    Detect the framing of a TCP syslog connection from its first frame.
+    Octet-counting (RFC 6587 3.4.1) is only used when the first frame is
+    a length followed by " <" (the PRI of the message), so LF-framed lines
+    that start with a digit stay LF-framed.
+
+    Args:
+        buffer (bytes): The data received so far.
+
+    Returns:
+        bool | None: True for octet-counting, False for LF framing,
+        None if more data is needed to decide.
+    """
+    if OCTET_COUNT_REGEX.match(buffer):
+        return True
+    if re.fullmatch(rb"\d{1,10} ?", buffer):
+        return None
+    return False
+
+
+def split_tcp_frames(buffer: bytes, octet_counting: bool) -> tuple[list[bytes], bytes]:
+    """
+    Split a TCP syslog stream into frames.
+
+    Args:
+        buffer (bytes): The data received so far.
+        octet_counting (bool): The framing of the connection (see tcp_framing()),
+            True for octet-counting and False for LF framing.
+
+    Returns:
+        tuple[list[bytes], bytes]: The complete frames and the remaining data.
+    """
+    frames = []
+    while buffer:
+        if octet_counting:
+            length, separator, rest = buffer.partition(b" ")
+            if not separator:
+                break
+            if not length.isdigit():
+                buffer = rest
+                continue
+            size = int(length)
+            if len(rest) < size:
+                break
+            frames.append(rest[:size])
+            buffer = rest[size:].lstrip(b"\n")
+            continue
+        frame, separator, rest = buffer.partition(b"\n")
+        if not separator:
+            break
+        if frame:
+            frames.append(frame)
+        buffer = rest
+    return frames, buffer
+
+
+class SyslogReceiver:
+    """
+    Collects syslog packets and feeds them in batches to parse_logs().
+
+    Packets are only queued by the socket callbacks, one drain task
+    parses them 'batch_size' packets at a time and yields in between,
+    so the sockets keep being read while a big backlog is parsed.
+    """
+
+    def __init__(
+        self,
+        node_names: dict[str, str] | None = None,
+        max_pending: int = 200_000,
+        batch_size: int = 2048,
+    ):
+        self.node_names = node_names or {}
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.stats = SYSLOG_STATS
+        self._pending: list[tuple[str, bytes, float]] = []
+        self._wakeup = asyncio.Event()
+
+    def _sender(self, host: str, data: bytes | None = None) -> SyslogSenderStats:
+        stats = self.stats.get(host)
+        if stats is None:
+            node_name = self.node_names.get(host)
+            if not node_name and data:
+                match = SYSLOG_HOSTNAME_REGEX.match(data.decode("utf-8", "replace"))
+                if match:
+                    node_name = match.group(1) or match.group(2)
+            stats = self.stats.setdefault(
+                host, SyslogSenderStats(node_name=node_name or host)
+            )
+            node_stream(stats.node_name).set_state("syslog")
+            INVALID_IPS.add(host)
+        return stats
+
+    def feed(self, host: str, data: bytes) -> None:
+        """
+        Queue a packet received from a host.
+
+        Args:
+            host (str): The IP address of the sender.
+            data (bytes): The raw packet.
+        """
+        stats = self._sender(host, data)
+        if len(self._pending) >= self.max_pending:
+            stats.dropped += 1
+            return
+        node_stream(stats.node_name).queued += 1
+        self._pending.append((host, data, time.time()))
+        self._wakeup.set()
+
+    async def drain(self) -> int:  # pylint: disable=too-many-locals
+        """
+        Parse up to 'batch_size' queued packets, grouped by the sending node.
+
+        Returns:
+            int: The number of lines that were processed.
+        """
+        packets = self._pending[: self.batch_size]
+        del self._pending[: self.batch_size]
+        now = time.time()
+        frames: dict[str, list[str]] = {}
+        received: dict[str, float] = {}  # the oldest packet of each node
+        total_lines = 0
+        for host, data, arrived in packets:
+            stats = self._sender(host, data)
+            stats.packets += 1
+            stats.bytes += len(data)
+            stats.last_seen = now
+            lines = frames.setdefault(stats.node_name, [])
+            received.setdefault(stats.node_name, arrived)
+            messages = data.decode("utf-8", "replace").splitlines()
+            stream = node_stream(stats.node_name)
+            stream.queued -= 1
+            stream.frame(len(messages), now)
+            for message in messages:
+                stats.lines += 1
+                total_lines += 1
+                if "sequenceId" in message:
+                    sequence = SEQUENCE_ID_REGEX.search(message)
+                    if sequence:
+                        stats.track_sequence(int(sequence.group(1)))
+                if "accepted" not in message:
+                    continue
+                xray_line = XRAY_LINE_REGEX.search(message)
+                if xray_line:
+                    lines.append(message[xray_line.start() :])
+        for node_name, lines in frames.items():
+            if lines:
+                await parse_logs(
+                    "\n".join(lines), node=node_name, received=received[node_name]
+                )
+        return total_lines
+
+    async def drain_forever(self) -> None:
+        """Wait for packets and drain them as long as the receiver runs."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                await self.drain()
+                await asyncio.sleep(0)
+
+    async def report_losses_forever(self, interval: int = 60) -> None:
+        """
+        Periodically warn about senders that lost messages.
+
+        Args:
+            interval (int): Seconds between two checks.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for host, stats in list(self.stats.items()):
+                if (
+                    stats.lost == stats.reported_lost
+                    and stats.dropped == stats.reported_dropped
+                ):
+                    continue
+                log_message = (
+                    f"[Syslog] node: {stats.node_name} ip: {host}"
+                    + f" lost: {stats.lost - stats.reported_lost}"
+                    + f" dropped: {stats.dropped - stats.reported_dropped}"
+                    + f" packets: {stats.packets}"
+                )
+                stats.reported_lost = stats.lost
+                stats.reported_dropped = stats.dropped
+                await send_logs(log_message)
+                logger.warning(log_message, extra={"node": stats.node_name})
+
+    async def handle_tcp(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Read syslog frames from a TCP connection.
+
+        Args:
+            reader (asyncio.StreamReader): The reader of the connection.
+            writer (asyncio.StreamWriter): The writer of the connection.
+        """
+        host = writer.get_extra_info("peername")[0]
+        buffer = b""
+        octet_counting = None  # the framing is chosen once, from the first frame
+        try:
+            while chunk := await reader.read(65536):
+                buffer += chunk
+                if octet_counting is None:
+                    octet_counting = tcp_framing(buffer)
+                    if octet_counting is None:
+                        continue
+                frames, buffer = split_tcp_frames(buffer, octet_counting)
+                if frames:
+                    self.feed(host, b"\n".join(frames))
+        except ConnectionError as error:
+            logger.error("[Syslog] connection from %s closed: %s", host, error)
+        finally:
+            writer.close()
+
+
+class SyslogDatagramProtocol(asyncio.DatagramProtocol):
+    """Queue the syslog datagrams of a UDP endpoint in a receiver."""
+
+    def __init__(self, receiver: SyslogReceiver):
+        self.receiver = receiver
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self.receiver.feed(addr[0], data)
+
+    def error_received(self, exc: Exception) -> None:
+        logger.error("[Syslog] UDP error: %s", exc)
+
+    def close(self) -> None:
+        """Stop reading and close the socket."""
+        if self.transport is not None:
+            self.transport.close()
+
+
+async def start_syslog_receiver(
+    receiver: SyslogReceiver, host: str, port: int
+) -> tuple[SyslogDatagramProtocol, asyncio.Server]:
+    """
+    Open the UDP and TCP listeners of a receiver.
+
+    Args:
+        receiver (SyslogReceiver): The receiver that gets the packets.
+        host (str): The address to listen on.
+        port (int): The port to listen on (both UDP and TCP).
+
+    Returns:
+        tuple[SyslogDatagramProtocol, asyncio.Server]: The UDP endpoint
+        and the TCP server.
+
+    Raises:
+        OSError: If the address can not be used.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    except OSError as error:
+        logger.error("[Syslog] can not enlarge the receive buffer: %s", error)
+    try:
+        sock.bind((host, port))
+        sock.setblocking(False)
+        _, datagram_protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: SyslogDatagramProtocol(receiver), sock=sock
+        )
+    except OSError:
+        sock.close()
+        raise
+    try:
+        server = await asyncio.start_server(receiver.handle_tcp, host, port)
+    except OSError:
+        datagram_protocol.close()
+        raise
+    return datagram_protocol, server
+
+
+async def run_syslog_receiver(config_data: dict) -> None:
+    """
+    Run the syslog receiver configured with 'SYSLOG_PORT', 'SYSLOG_HOST'
+    and 'SYSLOG_NODES' (a map of sender IP to node name).
+    If the port can not be opened the error is reported and it returns,
+    so the other tasks keep running.
+
+    Args:
+        config_data (dict): The content of the config file.
+    """
+    host = config_data.get("SYSLOG_HOST", "0.0.0.0")
+    port = int(config_data["SYSLOG_PORT"])
+    receiver = SyslogReceiver(config_data.get("SYSLOG_NODES", {}))
+    try:
+        datagram_protocol, server = await start_syslog_receiver(receiver, host, port)
+    except OSError as error:
+        # the other tasks keep running without the syslog receiver
+        log_message = f"Syslog receiver can not listen on {host}:{port}: {error}"
+        await send_logs(log_message)
+        logger.error(log_message)
+        return
+    log_message = f"Syslog receiver listening on {host}:{port} (UDP and TCP)"
+    await send_logs(log_message)
+    logger.info(log_message)
+    try:
+        async with server:
+            await asyncio.gather(
+                receiver.drain_forever(), receiver.report_losses_forever()
+            )
+    finally:
+        datagram_protocol.close()
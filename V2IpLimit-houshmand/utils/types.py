@@ -56,6 +56,42 @@ class UserStatus(Enum):
     ACTIVE = "ACTIVE"
     DISABLE = "DISABLE"
 
+    @property
+    def panel_status(self) -> str:
+        """The status string used by the panel API."""
+        return "active" if self is UserStatus.ACTIVE else "disabled"
+
+    @classmethod
+    def from_panel(cls, status: str | None) -> "UserStatus | None":
+        """
+        Convert a status of the panel API.
+
+        Args:
+            status (str | None): The status from the panel ("active", "disabled", ...).
+
+        Returns:
+            UserStatus | None: None for the other statuses (limited, expired, on_hold).
+        """
+        if status == "active":
+            return cls.ACTIVE
+        if status == "disabled":
+            return cls.DISABLE
+        return None
+
+
+@dataclass(slots=True, frozen=True)
+class PanelUserType:
+    """
+    A compact record of the panel user list.
+
+    Attributes:
+        name (str): The username of the user.
+        status (UserStatus | None): The status of the user on the panel.
+    """
+
+    name: str
+    status: UserStatus | None = None
+
 
 @dataclass
 class UserType:
@@ -66,8 +102,13 @@ class UserType:
         name (str): The name of the user.
         status (str | None): The status of the user. None if no status is provided.
         ip (list[str] | list): List of IP address of the user.
+        nodes (set[str]): Names of the nodes the user was seen on.
+        first_seen (dict[str, list]): The stamp of the frame that first showed
+            each IP (see utils/latency.py).
     """
 
     name: str
     status: UserStatus | None = None
     ip: list[str] | list = field(default_factory=list)
+    nodes: set[str] = field(default_factory=set)
+    first_seen: dict[str, list] = field(default_factory=dict)
@@ -0,0 +1,192 @@
+"""
+This module builds the usage report of each check interval.
+Only the changes since the previous interval are reported (new offenders,
+users whose IP count changed and users back under their limit),
+the full list of active IPs is sent as a compressed CSV document
+on request or on a longer schedule.
+"""
+
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+USAGE_REPORT_STATE: dict = {
+    "counts": {},  # username -> number of active IPs in the previous interval
+    "offenders": set(),  # users over their limit in the previous interval
+    "latest": {},  # username -> active IPs (tuple) of the last interval, for the full report
+    "last_full": 0.0,  # time of the last full report
+}
+USAGE_REPORT_HEADER = ("username", "ip_count", "ips")
+
+
+@dataclass
+class UsageDelta:
+    """
+    The changes between two check intervals.
+
+    Attributes:
+        new_offenders (dict[str, int]): Users over the limit now but not before,
+            with their IP count.
+        changed (dict[str, tuple[int, int]]): Users whose IP count changed
+            (previous count, current count).
+        back_under_limit (list[str]): Users over the limit before but not now.
+        new_users (int): Users active now but not in the previous interval.
+        gone_users (int): Users active in the previous interval but not now.
+    """
+
+    new_offenders: dict[str, int] = field(default_factory=dict)
+    changed: dict[str, tuple[int, int]] = field(default_factory=dict)
+    back_under_limit: list[str] = field(default_factory=list)
+    new_users: int = 0
+    gone_users: int = 0
+
+
+def diff_usage(
+    previous: dict[str, int],
+    current: dict[str, int],
+    previous_offenders: set[str],
+    offenders: set[str],
+) -> UsageDelta:
+    """
+    Compare two intervals.
+
+    Args:
+        previous (dict[str, int]): The IP count of each user in the previous interval.
+        current (dict[str, int]): The IP count of each user now.
+        previous_offenders (set[str]): The users over the limit in the previous interval.
+        offenders (set[str]): The users over the limit now.
+
+    Returns:
+        UsageDelta: The changes.
+    """
+    delta = UsageDelta()
+    for user_name in offenders - previous_offenders:
+        delta.new_offenders[user_name] = current.get(user_name, 0)
+    back_under_limit = previous_offenders - offenders
+    delta.back_under_limit = sorted(back_under_limit)
+    for user_name, count in current.items():
+        previous_count = previous.get(user_name)
+        if previous_count is None:
+            delta.new_users += 1
+        elif (
+            previous_count != count
+            and user_name not in delta.new_offenders
+            and user_name not in back_under_limit
+        ):
+            delta.changed[user_name] = (previous_count, count)
+    delta.gone_users = sum(1 for user_name in previous if user_name not in current)
+    return delta
+
+
+def build_summary(
+    current: dict[str, int], offenders: set[str], delta: UsageDelta, max_lines: int = 30
+) -> str:
+    """
+    Build the compact summary of one interval.
+
+    Args:
+        current (dict[str, int]): The IP count of each user.
+        offenders (set[str]): The users over the limit.
+        delta (UsageDelta): The changes since the previous interval.
+        max_lines (int): The maximum number of users listed per section.
+
+    Returns:
+        str: The summary (HTML).
+    """
+    lines = [
+        f"Active users: <b>{len(current)}</b> (+{delta.new_users} -{delta.gone_users})"
+        + f" Active IPs: <b>{sum(current.values())}</b>"
+        + f" Over the limit: <b>{len(offenders)}</b>"
+    ]
+    if delta.new_offenders:
+        lines.append(f"New over the limit ({len(delta.new_offenders)}):")
+        for user_name, count in sorted(
+            delta.new_offenders.items(), key=lambda item: item[1], reverse=True
+        )[:max_lines]:
+            lines.append(f"+ <code>{user_name}</code> {count} ips")
+    if delta.back_under_limit:
+        lines.append(f"Back under the limit ({len(delta.back_under_limit)}):")
+        for user_name in delta.back_under_limit[:max_lines]:
+            lines.append(f"- <code>{user_name}</code> {current.get(user_name, 0)} ips")
+    if delta.changed:
+        lines.append(f"IP count changed ({len(delta.changed)}):")
+        for user_name, (before, after) in sorted(
+            delta.changed.items(),
+            key=lambda item: abs(item[1][1] - item[1][0]),
+            reverse=True,
+        )[:max_lines]:
+            lines.append(f"~ <code>{user_name}</code> {before} → {after}")
+    for section in (delta.new_offenders, delta.back_under_limit, delta.changed):
+        if len(section) > max_lines:
+            lines.append("... and more, send /usage_report for the full report")
+            break
+    return "\n".join(lines)
+
+
+def usage_rows(current: dict[str, tuple[str, ...]]) -> Iterator[tuple[str, int, str]]:
+    """
+    The rows of the full report: every active user with their IPs,
+    most IPs first.
+
+    Args:
+        current (dict[str, tuple[str, ...]]): The active IPs of each user.
+
+    Yields:
+        tuple[str, int, str]: The username, the IP count and the IPs (space separated).
+    """
+    for email, ips in sorted(current.items(), key=lambda x: len(x[1]), reverse=True):
+        if ips:
+            yield email, len(ips), " ".join(ips)
+
+
+def full_report_caption(current: dict[str, tuple[str, ...]]) -> str:
+    """
+    The caption of the full report document.
+
+    Args:
+        current (dict[str, tuple[str, ...]]): The active IPs of each user.
+
+    Returns:
+        str: The caption (HTML).
+    """
+    total_ips = sum(len(ips) for ips in current.values())
+    users = sum(1 for ips in current.values() if ips)
+    return (
+        f"Full usage report: <b>{users}</b> users,"
+        + f" Count Of All Active IPs: <b>{total_ips}</b>\n"
+        + "<code>github.com/houshmand-2005/V2IpLimit/</code>"
+    )
+
+
+def usage_report(
+    current: dict[str, list[str]], offenders: set[str], full_interval: float
+) -> tuple[str, bool]:
+    """
+    Build the summary of one interval and remember it for the next one.
+    The active IPs are kept in USAGE_REPORT_STATE["latest"] for the full report.
+
+    Args:
+        current (dict[str, list[str]]): The active IPs of each user.
+        offenders (set[str]): The users over the limit.
+        full_interval (float): Seconds between two full reports (0 to only
+            send it on request with /usage_report).
+
+    Returns:
+        tuple[str, bool]: The summary and whether the full report is due.
+    """
+    counts = {user_name: len(ips) for user_name, ips in current.items() if ips}
+    delta = diff_usage(
+        USAGE_REPORT_STATE["counts"], counts, USAGE_REPORT_STATE["offenders"], offenders
+    )
+    summary = build_summary(counts, offenders, delta)
+    now = time.time()
+    full_due = bool(full_interval) and now - USAGE_REPORT_STATE["last_full"] >= full_interval
+    if full_due:
+        USAGE_REPORT_STATE["last_full"] = now
+    USAGE_REPORT_STATE["counts"] = counts
+    USAGE_REPORT_STATE["offenders"] = set(offenders)
+    # a snapshot, the report file is written from a worker thread
+    USAGE_REPORT_STATE["latest"] = {
+        user_name: tuple(ips) for user_name, ips in current.items() if ips
+    }
+    return summary, full_due
@@ -0,0 +1,93 @@
+"""
+This module contains the index of the panel status of every user.
+It is filled in bulk from the user list of the panel and updated by our
+own writes, so requests that would not change anything are skipped.
+"""
+
+import time
+from collections.abc import Iterable
+
+from utils.types import PanelUserType, UserStatus
+
+USER_STATE_METRICS: dict[str, float] = {
+    "users": 0,
+    "skipped_requests": 0,  # writes skipped because the user had the status already
+    "refreshes": 0,
+    "last_refresh": 0.0,  # time of the last refresh
+    "last_refresh_seconds": 0.0,  # duration of the last refresh
+}
+
+
+class UserStateIndex:
+    """
+    The last known panel status of every user.
+    """
+
+    def __init__(self):
+        self.states: dict[str, UserStatus | None] = {}
+        self.written_at: dict[str, float] = {}
+
+    def get(self, username: str) -> UserStatus | None:
+        """
+        Returns the last known status of a user, None if it is unknown.
+        """
+        return self.states.get(username)
+
+    def set(self, username: str, status: UserStatus | None) -> None:
+        """
+        Save a status written (or read) by us.
+
+        Args:
+            username (str): The username of the user.
+            status (UserStatus | None): The new status, None if it is unknown.
+        """
+        self.states[username] = status
+        self.written_at[username] = time.time()
+
+    def skip(self, username: str, status: UserStatus) -> bool:
+        """
+        Check if a write can be skipped because the user has the status already.
+        Skipped writes are counted.
+
+        Args:
+            username (str): The username of the user.
+            status (UserStatus): The status the caller wants to set.
+
+        Returns:
+            bool: True if the request is not needed.
+        """
+        if self.states.get(username) is status:
+            USER_STATE_METRICS["skipped_requests"] += 1
+            return True
+        return False
+
+    def update(self, users: Iterable[PanelUserType], started_at: float) -> None:
+        """
+        Replace the index with a full user list of the panel (every refresh
+        reads all the users again, it is not incremental).
+        Statuses written by us after 'started_at' are newer and kept,
+        users missing from the list (deleted) are removed.
+
+        Args:
+            users (Iterable[PanelUserType]): The users of the panel with their status.
+            started_at (float): The time the user list was requested.
+        """
+        states = {}
+        for user in users:
+            if self.written_at.get(user.name, 0) > started_at:
+                states[user.name] = self.states.get(user.name)
+            else:
+                states[user.name] = user.status
+        self.states = states
+        self.written_at = {
+            username: written_at
+            for username, written_at in self.written_at.items()
+            if written_at > started_at
+        }
+        USER_STATE_METRICS["users"] = len(states)
+        USER_STATE_METRICS["refreshes"] += 1
+        USER_STATE_METRICS["last_refresh"] = time.time()
+        USER_STATE_METRICS["last_refresh_seconds"] = time.time() - started_at
+
+
+USER_STATES = UserStateIndex()
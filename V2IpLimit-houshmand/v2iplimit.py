@@ -10,6 +10,7 @@ import time
 from run_telegram import run_telegram_bot
 from telegram_bot.send_message import send_logs
 from utils.check_usage import run_check_users_usage
+from utils.config_store import CONFIG_STORE, run_config_watcher
 from utils.get_logs import (
     TASKS,
     check_and_add_new_nodes,
@@ -19,19 +20,31 @@ from utils.get_logs import (
     handle_cancel_all,
 )
 from utils.handel_dis_users import DisabledUsers
-from utils.logs import logger
+from utils.log_capture import start_capture
+from utils.logs import configure_logging, logger
+from utils.loop_monitor import run_loop_monitor
+from utils.metrics_server import run_metrics_server
+from utils.outbox import start_outbox
 from utils.panel_api import (
     enable_dis_user,
-    enable_selected_users,
     get_nodes,
+    run_user_state_refresh,
 )
+from utils.panel_scheduler import configure_scheduler
+from utils.policy_store import POLICY_STORE
 from utils.read_config import read_config
+from utils.syslog_receiver import run_syslog_receiver
 from utils.types import PanelType
 
 VERSION = "1.0.6"
 
 parser = argparse.ArgumentParser(description="Help message")
 parser.add_argument("--version", action="version", version=VERSION)
+parser.add_argument(
+    "--capture",
+    metavar="DIRECTORY",
+    help="Save the raw logs of the panel and nodes (replay them with replay_logs.py)",
+)
 args = parser.parse_args()
 
 dis_obj = DisabledUsers()
@@ -39,6 +52,9 @@ dis_obj = DisabledUsers()
 
 async def main():
     """Main function to run the code."""
+    configure_logging(CONFIG_STORE.get())
+    CONFIG_STORE.subscribe(configure_logging)
+    await POLICY_STORE.migrate_config()
     print("Telegram Bot running...")
     asyncio.create_task(run_telegram_bot())
     await asyncio.sleep(2)
@@ -61,15 +77,18 @@ async def main():
                 + "\nIn <b>60 seconds</b> later the program will try again."
             )
             await asyncio.sleep(60)
+    configure_scheduler(config_file)
+    CONFIG_STORE.subscribe(configure_scheduler)
     panel_data = PanelType(
         config_file["PANEL_USERNAME"],
         config_file["PANEL_PASSWORD"],
         config_file["PANEL_DOMAIN"],
     )
-    dis_users = await dis_obj.read_and_clear_users()
-    await enable_selected_users(panel_data, dis_users)
     await get_nodes(panel_data)
+    start_outbox(panel_data, int(config_file.get("DISABLE_CONCURRENCY", 10)))
     async with asyncio.TaskGroup() as tg:
+        if args.capture:
+            tg.create_task(start_capture(args.capture).run(), name="log_capture")
         print("Start Create Panel Task Test: ")
         await create_panel_task(panel_data, tg)
         await asyncio.sleep(5)
@@ -98,6 +117,22 @@ async def main():
             enable_dis_user(panel_data),
             name="enable_dis_user",
         )
+        tg.create_task(
+            run_user_state_refresh(panel_data),
+            name="user_state_refresh",
+        )
+        tg.create_task(run_config_watcher(), name="config_watcher")
+        tg.create_task(run_loop_monitor(config_file), name="loop_monitor")
+        if config_file.get("METRICS_PORT"):
+            tg.create_task(
+                run_metrics_server(config_file),
+                name="metrics_server",
+            )
+        if config_file.get("SYSLOG_PORT"):
+            tg.create_task(
+                run_syslog_receiver(config_file),
+                name="syslog_receiver",
+            )
         await run_check_users_usage(panel_data)
 
 